@@ -0,0 +1,266 @@
+import time
+from fastapi import HTTPException
+from PIL import Image
+from apps.calculator.utils import analyze_image, analyze_images, stream_analyze_image
+from apps.calculator.resilience import CircuitOpen
+from apps.calculator.evaluator import EvaluationError, evaluate, normalize_vars, results_match
+from apps.calculator.glyphs import GlyphClassifier
+from constants import (
+    RECOGNITION_BACKEND, LOCAL_MIN_CONFIDENCE, LOCAL_MIN_MARGIN, AUTO_SERVE_LOCAL, STUB_BACKEND, STUB_LATENCY_MS,
+    MODEL_FALLBACK,
+)
+from metrics import verbose
+
+
+class RecognitionBackend:
+    """Turns a prepared canvas region into [{expr, result, assign}] rows.
+
+    recognize() is synchronous and runs on the model thread pool; engines that
+    can stream override recognize_stream() to report rows as they are produced.
+    Engines that can answer several images in one call set supports_batch and
+    override recognize_batch(), which returns None for items to retry alone.
+    """
+
+    name = None
+    supports_batch = False
+
+    def recognize(self, img: Image.Image, dict_of_vars: dict) -> list:
+        raise NotImplementedError
+
+    def recognize_stream(self, img: Image.Image, dict_of_vars: dict, on_answer) -> list:
+        rows = self.recognize(img, dict_of_vars)
+        for row in rows:
+            on_answer(row)
+        return rows
+
+    def recognize_batch(self, items: list) -> list:
+        return [self.recognize(img, dict_of_vars) for img, dict_of_vars in items]
+
+
+def unavailable_row(e: Exception) -> dict:
+    return {"expr": "Model unavailable", "result": str(e), "assign": False}
+
+
+class GeminiBackend(RecognitionBackend):
+    """Gemini through the resilient model client. While its circuit breaker is
+    open, calls go to the fallback engine if there is one, else fail fast.
+    Fallback rows are marked, so they are served but never cached as Gemini's."""
+
+    name = 'gemini'
+    supports_batch = True
+
+    def __init__(self, fallback: RecognitionBackend = None):
+        self.fallback = fallback
+        self.fallback_served = 0
+
+    def recognize(self, img, dict_of_vars):
+        try:
+            return analyze_image(img, dict_of_vars)
+        except CircuitOpen as e:
+            if self.fallback is None:
+                return [unavailable_row(e)]
+            self.fallback_served += 1
+            return mark_fallback(self.fallback.recognize(img, dict_of_vars))
+
+    def recognize_batch(self, items):
+        try:
+            return analyze_images(items)
+        except CircuitOpen as e:
+            if self.fallback is None:
+                return [[unavailable_row(e)] for _ in items]
+            self.fallback_served += len(items)
+            return [mark_fallback(rows) for rows in self.fallback.recognize_batch(items)]
+
+    def recognize_stream(self, img, dict_of_vars, on_answer):
+        try:
+            return stream_analyze_image(img, dict_of_vars, on_answer)
+        except CircuitOpen as e:
+            if self.fallback is None:
+                row = unavailable_row(e)
+                on_answer(row)
+                return [row]
+            self.fallback_served += 1
+            rows = self.fallback.recognize_stream(img, dict_of_vars, lambda row: on_answer(mark_fallback([row])[0]))
+            return mark_fallback(rows)
+
+
+def mark_fallback(rows: list) -> list:
+    return [{**row, "fallback": True} for row in rows]
+
+
+class LowConfidence(Exception):
+    pass
+
+
+class LocalBackend(RecognitionBackend):
+    """Offline engine: template-matched glyphs plus the local evaluator, on CPU."""
+
+    name = 'local'
+
+    def __init__(self, min_confidence: float = LOCAL_MIN_CONFIDENCE, min_margin: float = LOCAL_MIN_MARGIN):
+        self.min_confidence = min_confidence
+        self.min_margin = min_margin
+        self._classifier = None
+
+    @property
+    def classifier(self):
+        if self._classifier is None:
+            # Templates are rendered on first use so importing the module stays cheap
+            self._classifier = GlyphClassifier()
+        return self._classifier
+
+    def read(self, img, dict_of_vars):
+        """Rows for every line, or LowConfidence if any glyph or expression is doubtful."""
+        scope = normalize_vars(dict_of_vars)
+        rows = []
+        for text, confidence, margin in self.classifier.read(img):
+            if confidence < self.min_confidence:
+                raise LowConfidence(f"{text!r} read with confidence {confidence:.2f}")
+            if margin < self.min_margin:
+                raise LowConfidence(f"{text!r} read with a margin of {margin:.2f} over the next glyph")
+            try:
+                result, target, value = evaluate(text, scope)
+            except EvaluationError as e:
+                raise LowConfidence(f"{text!r} is not an expression: {e}")
+            if target is not None:
+                scope[target] = value
+            rows.append({"expr": text, "result": result, "assign": target is not None})
+        if not rows:
+            raise LowConfidence("No glyphs found")
+        return rows
+
+    def recognize(self, img, dict_of_vars):
+        try:
+            return self.read(img, dict_of_vars)
+        except LowConfidence as e:
+            return [{"expr": "Unrecognized", "result": str(e), "assign": False}]
+
+
+class AutoBackend(RecognitionBackend):
+    """Local engine first; only canvases it can't read confidently go to Gemini.
+
+    Unless serve_local is set, every canvas still goes to Gemini and the local
+    read is only compared with its answer (local_agreed of local_compared),
+    which is how the local engine's accuracy on real handwriting is measured
+    before it is trusted with it.
+    """
+
+    name = 'auto'
+
+    def __init__(self, local: LocalBackend, remote: RecognitionBackend, serve_local: bool = AUTO_SERVE_LOCAL):
+        self.local = local
+        self.remote = remote
+        self.serve_local = serve_local
+        self.local_served = 0
+        self.remote_served = 0
+        self.local_compared = 0
+        self.local_agreed = 0
+
+    def read_local(self, img, dict_of_vars):
+        """The local engine's rows, or None when it isn't confident."""
+        try:
+            return self.local.read(img, dict_of_vars)
+        except LowConfidence as e:
+            verbose(f"Local recognition fell back to {self.remote.name}: {e}")
+            return None
+
+    def compare(self, local_rows, remote_rows):
+        if local_rows is None:
+            return
+        self.local_compared += 1
+        self.local_agreed += len(local_rows) == len(remote_rows) and all(
+            results_match(local['result'], str(remote.get('result', '')))
+            for local, remote in zip(local_rows, remote_rows)
+        )
+
+    def recognize(self, img, dict_of_vars):
+        rows = self.read_local(img, dict_of_vars)
+        if rows is not None and self.serve_local:
+            self.local_served += 1
+            return rows
+        self.remote_served += 1
+        answer = self.remote.recognize(img, dict_of_vars)
+        self.compare(rows, answer)
+        return answer
+
+    @property
+    def supports_batch(self):
+        return self.remote.supports_batch
+
+    def recognize_batch(self, items):
+        local = [self.read_local(img, dict_of_vars) for img, dict_of_vars in items]
+        results = [None] * len(items)
+        remote = []
+        for index, rows in enumerate(local):
+            if rows is not None and self.serve_local:
+                results[index] = rows
+                self.local_served += 1
+            else:
+                remote.append(index)
+        if remote:
+            self.remote_served += len(remote)
+            answers = self.remote.recognize_batch([items[i] for i in remote])
+            for index, rows in zip(remote, answers):
+                results[index] = rows
+                if rows is not None:
+                    self.compare(local[index], rows)
+        return results
+
+    def recognize_stream(self, img, dict_of_vars, on_answer):
+        rows = self.read_local(img, dict_of_vars)
+        if rows is None or not self.serve_local:
+            self.remote_served += 1
+            answer = self.remote.recognize_stream(img, dict_of_vars, on_answer)
+            self.compare(rows, answer)
+            return answer
+        self.local_served += 1
+        for row in rows:
+            on_answer(row)
+        return rows
+
+
+class StubBackend(RecognitionBackend):
+    """Fixed answers after a fixed delay, for running the pipeline offline in benchmarks."""
+
+    name = 'stub'
+    supports_batch = True
+
+    def __init__(self, rows=None, latency_ms: int = STUB_LATENCY_MS):
+        self.rows = rows or [{"expr": "2 + 2", "result": "4", "assign": False}]
+        self.latency_ms = latency_ms
+        self.calls = 0
+
+    def recognize(self, img, dict_of_vars):
+        return self.recognize_batch([(img, dict_of_vars)])[0]
+
+    def recognize_batch(self, items):
+        # One sleep per call however many images it carries, like a real round trip
+        self.calls += 1
+        if self.latency_ms:
+            time.sleep(self.latency_ms / 1000)
+        return [[dict(row) for row in self.rows] for _ in items]
+
+
+local_backend = LocalBackend()
+gemini_backend = GeminiBackend(fallback=local_backend if MODEL_FALLBACK == 'local' else None)
+BACKENDS = {
+    'gemini': gemini_backend,
+    'local': local_backend,
+    'auto': AutoBackend(local_backend, gemini_backend),
+}
+
+
+def enable_stub_backend() -> StubBackend:
+    """Register the 'stub' backend, so clients can't pick canned answers unless it is switched on."""
+    return BACKENDS.setdefault('stub', StubBackend())
+
+
+if STUB_BACKEND or RECOGNITION_BACKEND == 'stub':
+    enable_stub_backend()
+
+
+def get_backend(name: str = None) -> RecognitionBackend:
+    backend = BACKENDS.get(name or RECOGNITION_BACKEND)
+    if backend is None:
+        raise HTTPException(status_code=400, detail=f"Unknown recognition backend: {name}. Choose from {', '.join(BACKENDS)}")
+    return backend
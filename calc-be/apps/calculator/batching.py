@@ -0,0 +1,96 @@
+import asyncio
+from apps.calculator.pool import run_model_call
+from constants import BATCH_MAX_SIZE, BATCH_MAX_WAIT_MS
+from metrics import verbose
+
+
+class MicroBatcher:
+    """Group images from concurrent requests into one multi-image model call.
+
+    The first image to arrive opens a batch; it is sent when it holds max_size
+    images or max_wait_ms after it opened, whichever comes first. Items the
+    batched answer doesn't cover are retried as individual calls.
+    """
+
+    def __init__(self, backend, max_size: int = BATCH_MAX_SIZE, max_wait_ms: int = BATCH_MAX_WAIT_MS):
+        self.backend = backend
+        self.max_size = max_size
+        self.max_wait = max_wait_ms / 1000
+        self._pending = []
+        self._timer = None
+        self._running = set()
+        self.calls = 0
+        self.batched_images = 0
+        self.fallbacks = 0
+
+    async def submit(self, img, dict_of_vars: dict) -> list:
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((img, dict_of_vars, future))
+        if len(self._pending) >= self.max_size:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.max_wait, self._flush)
+        return await future
+
+    def _flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._pending = self._pending, []
+        if batch:
+            task = asyncio.ensure_future(self._run(batch))
+            self._running.add(task)
+            task.add_done_callback(self._running.discard)
+
+    async def _run(self, batch):
+        items = [(img, dict_of_vars) for img, dict_of_vars, _ in batch]
+        self.calls += 1
+        try:
+            if len(items) == 1:
+                results = [await run_model_call(self.backend.recognize, *items[0])]
+            else:
+                self.batched_images += len(items)
+                results = await run_model_call(self.backend.recognize_batch, items)
+            retry = [i for i, rows in enumerate(results) if rows is None]
+            if retry:
+                self.fallbacks += len(retry)
+                self.calls += len(retry)
+                verbose(f"Batched answer missed {len(retry)} of {len(items)} images, retrying them individually")
+                answers = await asyncio.gather(*(run_model_call(self.backend.recognize, *items[i]) for i in retry))
+                for index, rows in zip(retry, answers):
+                    results[index] = rows
+        except Exception as e:
+            for _, _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        for (_, _, future), rows in zip(batch, results):
+            if not future.done():
+                future.set_result(rows)
+
+    def stats(self) -> dict:
+        return {
+            "max_size": self.max_size,
+            "max_wait_ms": int(self.max_wait * 1000),
+            "calls": self.calls,
+            "batched_images": self.batched_images,
+            "fallbacks": self.fallbacks,
+        }
+
+
+batchers = {}
+
+
+def batching_enabled(backend) -> bool:
+    return BATCH_MAX_SIZE > 1 and backend.supports_batch
+
+
+def get_batcher(backend) -> MicroBatcher:
+    if backend.name not in batchers:
+        batchers[backend.name] = MicroBatcher(backend, BATCH_MAX_SIZE, BATCH_MAX_WAIT_MS)
+    return batchers[backend.name]
+
+
+def batching_stats() -> dict:
+    return {name: batcher.stats() for name, batcher in batchers.items()}
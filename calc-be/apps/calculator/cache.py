@@ -0,0 +1,110 @@
+import hashlib
+import json
+import time
+from collections import OrderedDict
+from threading import Lock
+from PIL import Image
+from constants import CACHE_MAX_ENTRIES, CACHE_TTL_SECONDS, REDIS_URL
+
+REDIS_KEY_PREFIX = "drawcal:result:"
+
+
+def canonical_vars(dict_of_vars: dict) -> str:
+    """Serialize variables so that key order and whitespace don't change the key."""
+    return json.dumps(dict_of_vars or {}, sort_keys=True, separators=(',', ':'), ensure_ascii=False, default=str)
+
+
+def make_cache_key(img: Image.Image, dict_of_vars: dict) -> str:
+    """Hash a preprocessed canvas (see preprocess.prepare_image) together with its variables."""
+    digest = hashlib.sha256()
+    digest.update(f"{img.mode}:{img.size[0]}x{img.size[1]}".encode())
+    digest.update(img.tobytes())
+    digest.update(canonical_vars(dict_of_vars).encode())
+    return digest.hexdigest()
+
+
+class ResultCache:
+    """LRU + TTL cache of analysis results with an optional shared Redis tier.
+
+    The Redis tier uses the asyncio client, so a slow or unreachable Redis
+    delays only the requests waiting on it, never the event loop.
+    """
+
+    def __init__(self, max_entries: int = CACHE_MAX_ENTRIES, ttl: int = CACHE_TTL_SECONDS, redis_url: str = None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = Lock()
+        self._redis = None
+        if redis_url:
+            try:
+                import redis.asyncio
+                self._redis = redis.asyncio.Redis.from_url(redis_url, socket_timeout=0.2, socket_connect_timeout=0.2)
+            except Exception as e:
+                print(f"Redis cache disabled: {e}")
+        self.hits = 0
+        self.redis_hits = 0
+        self.misses = 0
+
+    async def get(self, key: str):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                expires_at, value = entry
+                if expires_at > now:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._entries[key]
+
+        if self._redis is not None:
+            try:
+                raw = await self._redis.get(REDIS_KEY_PREFIX + key)
+            except Exception as e:
+                print(f"Redis get failed: {e}")
+                raw = None
+            if raw is not None:
+                value = json.loads(raw)
+                self._store_local(key, value, now)
+                with self._lock:
+                    self.redis_hits += 1
+                return value
+
+        with self._lock:
+            self.misses += 1
+        return None
+
+    async def set(self, key: str, value):
+        self._store_local(key, value, time.monotonic())
+        if self._redis is not None:
+            try:
+                await self._redis.set(REDIS_KEY_PREFIX + key, json.dumps(value), ex=self.ttl)
+            except Exception as e:
+                print(f"Redis set failed: {e}")
+
+    def _store_local(self, key: str, value, now: float):
+        with self._lock:
+            self._entries[key] = (now + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "ttl": self.ttl,
+                "hits": self.hits,
+                "redis_hits": self.redis_hits,
+                "misses": self.misses,
+                "redis": self._redis is not None,
+            }
+
+
+result_cache = ResultCache(redis_url=REDIS_URL)
@@ -0,0 +1,161 @@
+import asyncio
+import time
+import uuid
+from collections import OrderedDict
+import numpy as np
+from fastapi import HTTPException
+from apps.calculator.cache import canonical_vars
+from apps.calculator.pipeline import analyze_cached, merge_regions, EVALUATE_LOCALLY
+from apps.calculator.vargraph import VariableGraph
+from apps.calculator.pool import analysis_limiter, run_image_work
+from apps.calculator.preprocess import decode_data_url, open_image, to_gray_array, estimate_background, ink_mask
+from apps.calculator.segment import region_boxes, prepare_region
+from constants import CANVAS_MAX_SESSIONS, CANVAS_SESSION_TTL, RECOGNITION_MODE
+from metrics import span, verbose
+
+
+def decode_gray(data_url: str) -> np.ndarray:
+    """Decode a PNG data URL straight to a luminance array; top-level for the image pool."""
+    return to_gray_array(open_image(decode_data_url(data_url)))
+
+
+def _overlaps(a, b) -> bool:
+    return a[0] < b[2] and b[0] < a[2] and a[1] < b[3] and b[1] < a[3]
+
+
+class CanvasSession:
+    """A canvas kept server side as one byte per pixel, plus the rows last produced per region
+    and the variable graph built from them."""
+
+    def __init__(self, gray: np.ndarray, backend_name: str = None):
+        self.gray = np.array(gray, dtype=np.uint8, copy=True)
+        self.backend_name = backend_name
+        self.background = estimate_background(self.gray)
+        self.regions = {}
+        self.vars = {}
+        self.rows = []
+        self.graph = VariableGraph()
+        self.lock = asyncio.Lock()
+        self.touched = time.monotonic()
+
+    @property
+    def shape(self):
+        return self.gray.shape
+
+    def replace(self, gray: np.ndarray, backend_name: str = None):
+        self.gray = np.array(gray, dtype=np.uint8, copy=True)
+        self.backend_name = backend_name
+        self.background = estimate_background(self.gray)
+        self.regions = {}
+        return (0, 0, self.gray.shape[1], self.gray.shape[0])
+
+    def apply_patch(self, x: int, y: int, patch: np.ndarray):
+        """Blit a patch into the buffer and return the dirty (left, top, right, bottom) box."""
+        height, width = self.gray.shape
+        patch_height, patch_width = patch.shape
+        if x < 0 or y < 0 or x + patch_width > width or y + patch_height > height:
+            raise HTTPException(status_code=400, detail=f"Patch {patch_width}x{patch_height} at ({x}, {y}) is outside the {width}x{height} canvas")
+        self.gray[y:y + patch_height, x:x + patch_width] = patch
+        return (x, y, x + patch_width, y + patch_height)
+
+    def stale_boxes(self, dict_of_vars: dict) -> set:
+        """Regions whose model output may depend on variables that changed since the last pass."""
+        if RECOGNITION_MODE == 'transcribe' or canonical_vars(dict_of_vars) == canonical_vars(self.vars):
+            return set()
+        if not EVALUATE_LOCALLY:
+            # The model computed every result, so any of them may have used the old values
+            return set(self.regions)
+        stale = self.graph.stale(self.graph.changed_names(dict_of_vars))
+        return {tuple(node.row['region']) for node in stale if 'region' in node.row}
+
+    def plan(self, dirty, dict_of_vars: dict):
+        """Work out which regions need analysis after a change inside `dirty`.
+
+        Returns (boxes, reused, pending): every current region box, the rows for
+        boxes that are untouched since last time, and prepared images for the rest.
+        """
+        forced = self.stale_boxes(dict_of_vars)
+        mask = ink_mask(self.gray, self.background)
+        boxes = region_boxes(mask)
+        reused, pending = {}, []
+        for box in boxes:
+            if box in self.regions and box not in forced and not _overlaps(box, dirty):
+                reused[box] = self.regions[box]
+            else:
+                pending.append((box, prepare_region(self.gray, mask, self.background, box)))
+        return boxes, reused, pending
+
+    async def analyze(self, dirty, dict_of_vars: dict):
+        boxes, reused, pending = await asyncio.to_thread(self.plan, dirty, dict_of_vars)
+        async with analysis_limiter.request() as admission:
+            fresh = await asyncio.gather(*(
+                analyze_cached(image, dict_of_vars, self.backend_name, admission) for _, image in pending
+            ))
+        results = {**reused, **{box: rows for (box, _), rows in zip(pending, fresh)}}
+        self.regions = results
+        self.vars = dict(dict_of_vars or {})
+        verbose(f"Canvas analysis: {len(pending)} region(s) analyzed, {len(reused)} reused")
+        self.rows = merge_regions(boxes, [results[box] for box in boxes])
+        if EVALUATE_LOCALLY:
+            self.rows = await asyncio.to_thread(self.graph.load, self.rows, self.vars)
+        return self.rows
+
+    async def update_vars(self, dict_of_vars: dict):
+        """Change the client variables, re-evaluating only the rows that depend on them.
+
+        Returns (rows, rows recomputed locally). Regions are only sent back to the
+        model when a row there couldn't be evaluated locally and uses a changed name.
+        """
+        if self.stale_boxes(dict_of_vars):
+            rows = await self.analyze((0, 0, 0, 0), dict_of_vars)
+            return rows, len(rows)
+        if not EVALUATE_LOCALLY:
+            return self.rows, 0
+        self.rows, recomputed = await asyncio.to_thread(self.graph.update, dict_of_vars)
+        self.vars = dict(dict_of_vars or {})
+        return self.rows, recomputed
+
+
+class CanvasStore:
+    """Bounded map of canvas id -> CanvasSession with idle expiry."""
+
+    def __init__(self, max_sessions: int = CANVAS_MAX_SESSIONS, ttl: int = CANVAS_SESSION_TTL):
+        self.max_sessions = max_sessions
+        self.ttl = ttl
+        self._sessions = OrderedDict()
+
+    def _evict(self):
+        now = time.monotonic()
+        for canvas_id in [cid for cid, s in self._sessions.items() if now - s.touched > self.ttl]:
+            del self._sessions[canvas_id]
+        while len(self._sessions) > self.max_sessions:
+            self._sessions.popitem(last=False)
+
+    def create(self, gray: np.ndarray, backend_name: str = None):
+        canvas_id = uuid.uuid4().hex
+        self._sessions[canvas_id] = CanvasSession(gray, backend_name)
+        self._evict()
+        return canvas_id, self._sessions[canvas_id]
+
+    def get(self, canvas_id: str) -> CanvasSession:
+        self._evict()
+        session = self._sessions.get(canvas_id)
+        if session is None:
+            raise HTTPException(status_code=404, detail="Canvas not found or expired, please resend the full canvas")
+        session.touched = time.monotonic()
+        self._sessions.move_to_end(canvas_id)
+        return session
+
+    def delete(self, canvas_id: str):
+        self._sessions.pop(canvas_id, None)
+
+    def __len__(self):
+        return len(self._sessions)
+
+
+canvas_store = CanvasStore()
+
+
+async def decode_canvas(data_url: str) -> np.ndarray:
+    with span('decode'):
+        return await run_image_work(decode_gray, data_url)
@@ -0,0 +1,253 @@
+import ast
+import math
+import operator
+import re
+
+MAX_EXPR_LENGTH = 200
+MAX_EXPONENT = 1000
+MAX_INT_BITS = 4096  # intermediate integers; float overflow is caught as it happens
+
+BINARY_OPS = {
+    ast.Add: operator.add,
+    ast.Sub: operator.sub,
+    ast.Mult: operator.mul,
+    ast.Div: operator.truediv,
+    ast.FloorDiv: operator.floordiv,
+    ast.Mod: operator.mod,
+    ast.Pow: operator.pow,
+}
+
+UNARY_OPS = {
+    ast.UAdd: operator.pos,
+    ast.USub: operator.neg,
+}
+
+FUNCTIONS = {
+    'sqrt': math.sqrt,
+    'sin': math.sin,
+    'cos': math.cos,
+    'tan': math.tan,
+    'log': math.log10,
+    'ln': math.log,
+    'exp': math.exp,
+    'abs': abs,
+}
+
+# Left to the model: a handwritten sin(30) usually means degrees, sin(pi/6) radians
+MODEL_ONLY = {'sin', 'cos', 'tan'}
+
+CONSTANTS = {
+    'pi': math.pi,
+    'π': math.pi,
+    'e': math.e,
+}
+
+# Handwriting/typography variants the model transcribes, mapped to Python syntax
+SYMBOLS = {
+    '×': '*',
+    '·': '*',
+    '÷': '/',
+    '−': '-',
+    '–': '-',
+    '^': '**',
+    '√': 'sqrt',
+    '²': '**2',
+    '³': '**3',
+}
+
+NAME_PATTERN = re.compile(r'^[A-Za-z_]\w*$')
+
+
+class EvaluationError(ValueError):
+    pass
+
+
+def normalize_expr(expr: str) -> str:
+    for symbol, replacement in SYMBOLS.items():
+        expr = expr.replace(symbol, replacement)
+    # Implicit multiplication between a number and a name or bracket: 2x, 3(4+1),
+    # but not inside a literal in scientific notation: 1e-3
+    expr = re.sub(r'(\d)(?![eE][+-]?\d)\s*([A-Za-z_(])', r'\1*\2', expr)
+    expr = re.sub(r'\)\s*([\d(])', r')*\1', expr)
+    return expr.strip()
+
+
+def to_number(value):
+    if isinstance(value, bool):
+        raise EvaluationError("Booleans are not numbers")
+    if isinstance(value, (int, float)):
+        return value
+    try:
+        number = float(str(value).strip())
+    except ValueError:
+        raise EvaluationError(f"Not a number: {value!r}")
+    return int(number) if number.is_integer() and '.' not in str(value) else number
+
+
+def normalize_vars(dict_of_vars: dict) -> dict:
+    """Turn the client's variable map into {name: number}.
+
+    The frontend keys assignments by their full expression ("x = 5"), so the
+    name is taken from the left-hand side. Non-numeric values are skipped.
+    """
+    scope = {}
+    for key, value in (dict_of_vars or {}).items():
+        name = str(key).split('=')[0].strip()
+        if not NAME_PATTERN.match(name):
+            continue
+        try:
+            scope[name] = to_number(value)
+        except EvaluationError:
+            continue
+    return scope
+
+
+def _checked(fn, *args):
+    """Apply one operation, keeping every intermediate value a bounded real number."""
+    try:
+        value = fn(*args)
+    except (ZeroDivisionError, OverflowError, ValueError, TypeError) as e:
+        raise EvaluationError(str(e))
+    if isinstance(value, complex):
+        # (-8) ** 0.5 is complex in Python
+        raise EvaluationError("Result is not a real number")
+    if isinstance(value, int) and value.bit_length() > MAX_INT_BITS:
+        raise EvaluationError("Result too large")
+    return value
+
+
+def _eval_node(node, scope: dict):
+    if isinstance(node, ast.Expression):
+        return _eval_node(node.body, scope)
+    if isinstance(node, ast.Constant) and isinstance(node.value, (int, float)) and not isinstance(node.value, bool):
+        return node.value
+    if isinstance(node, ast.Name):
+        if node.id in scope:
+            return scope[node.id]
+        if node.id in CONSTANTS:
+            return CONSTANTS[node.id]
+        raise EvaluationError(f"Unknown variable: {node.id}")
+    if isinstance(node, ast.UnaryOp) and type(node.op) in UNARY_OPS:
+        return _checked(UNARY_OPS[type(node.op)], _eval_node(node.operand, scope))
+    if isinstance(node, ast.BinOp) and type(node.op) in BINARY_OPS:
+        left = _eval_node(node.left, scope)
+        right = _eval_node(node.right, scope)
+        if isinstance(node.op, ast.Pow):
+            if abs(right) > MAX_EXPONENT:
+                raise EvaluationError("Exponent too large")
+            # Nested powers each pass the exponent check: (9^999)^999
+            if isinstance(left, int) and isinstance(right, int) and right > 0 and left.bit_length() * right > MAX_INT_BITS:
+                raise EvaluationError("Result too large")
+        return _checked(BINARY_OPS[type(node.op)], left, right)
+    if (isinstance(node, ast.Call) and isinstance(node.func, ast.Name) and node.func.id in FUNCTIONS
+            and len(node.args) == 1 and not node.keywords):
+        return _checked(FUNCTIONS[node.func.id], _eval_node(node.args[0], scope))
+    raise EvaluationError(f"Unsupported syntax: {type(node).__name__}")
+
+
+def parse(expr: str):
+    """Parse a transcribed expression into (assigned name or None, AST).
+
+    Accepts plain arithmetic ("2 + 2", "2 + 2 =") and assignments ("x = 5",
+    "e = 3"). Equations ("2x + 3 = 13", "2 + 2 = 4") and trigonometry are
+    rejected, so their rows keep the model's answer.
+    """
+    if not expr or len(expr) > MAX_EXPR_LENGTH:
+        raise EvaluationError("Empty or oversized expression")
+    text = normalize_expr(expr).rstrip('=').strip()
+    target = None
+    if '=' in text:
+        left, _, right = text.partition('=')
+        left, right = left.strip(), right.strip()
+        if not NAME_PATTERN.match(left) or left in FUNCTIONS:
+            raise EvaluationError("An equation, not an expression")
+        target, text = left, right
+    try:
+        tree = ast.parse(text, mode='eval')
+    except SyntaxError as e:
+        raise EvaluationError(f"Not an arithmetic expression: {e.msg}")
+    if any(isinstance(n, ast.Name) and n.id in MODEL_ONLY for n in ast.walk(tree)):
+        raise EvaluationError("Trigonometry is left to the model")
+    return target, tree
+
+
+def format_number(value, division: bool = False) -> str:
+    """Format a result the way the prompt asks the model to.
+
+    Whole numbers print without decimals, division keeps 6 places and
+    other decimals keep at least 3.
+    """
+    try:
+        finite = math.isfinite(value)
+    except OverflowError:
+        finite = False
+    if not finite:
+        raise EvaluationError("Result is not finite")
+    if isinstance(value, int) or value.is_integer():
+        return str(int(value))
+    if division:
+        return f"{value:.6f}"
+    text = f"{value:.6f}".rstrip('0')
+    return f"{value:.{max(len(text.split('.')[1]), 3)}f}"
+
+
+def references(tree) -> set:
+    """Names an expression reads, excluding functions.
+
+    Constants are included: a canvas may assign e or pi, and only when
+    nothing does do they fall back to CONSTANTS.
+    """
+    return {n.id for n in ast.walk(tree) if isinstance(n, ast.Name) and n.id not in FUNCTIONS}
+
+
+def evaluate_tree(tree, scope: dict):
+    """Evaluate a parsed expression, returning (result string, value)."""
+    value = _eval_node(tree, scope)
+    division = any(isinstance(n, ast.BinOp) and isinstance(n.op, ast.Div) for n in ast.walk(tree))
+    return format_number(value, division), value
+
+
+def evaluate(expr: str, scope: dict):
+    """Evaluate a transcribed expression, returning (result string, assigned name or None, value)."""
+    target, tree = parse(expr)
+    result, value = evaluate_tree(tree, scope)
+    return result, target, value
+
+
+def is_number(text: str) -> bool:
+    try:
+        return math.isfinite(float(text))
+    except (TypeError, ValueError):
+        return False
+
+
+def decimals_of(text: str) -> int:
+    return len(text.split('.')[1]) if '.' in text else 0
+
+
+def reconcile(result: str, value, model: str):
+    """Check a local result against the model's, returning (result, agrees).
+
+    When the model printed more decimals than format_number keeps, the local
+    value is printed at the model's precision instead, so a correct small
+    result like 0.0000006 is neither rounded away nor "corrected".
+    """
+    decimals = decimals_of(model)
+    if isinstance(value, float) and not value.is_integer() and decimals > decimals_of(result):
+        try:
+            float(model)
+        except ValueError:
+            return result, False
+        result = f"{value:.{min(decimals, 15)}f}"
+    return result, results_match(result, model)
+
+
+def results_match(local: str, model: str) -> bool:
+    """Compare at the precision the model printed, so '3.333' agrees with '3.333333'."""
+    try:
+        model_value = float(model)
+        local_value = float(local)
+    except (TypeError, ValueError):
+        return False
+    decimals = decimals_of(model)
+    return abs(model_value - local_value) <= 0.5 * 10 ** -decimals + 1e-9
@@ -0,0 +1,127 @@
+import re
+import numpy as np
+from PIL import Image, ImageDraw, ImageFont
+from apps.calculator.segment import split_runs
+
+GLYPH_SIZE = 16
+GLYPH_CLASSES = '0123456789+-*/=()x'
+TEMPLATE_FONT_SIZES = (40, 56)
+TEMPLATE_STROKES = (0, 1, 3)
+
+# Handwritten glyphs within a line are separated by a few blank columns at most
+GLYPH_COL_GAP = 2
+LINE_ROW_GAP = 12
+
+TIMES_X = re.compile(r'(?<=[\d)])x(?=[\d(])')
+
+
+def ink_of(img: Image.Image) -> np.ndarray:
+    """Ink mask of a prepared image (dark ink on white)."""
+    return np.asarray(img.convert('L')) < 128
+
+
+def glyph_vector(mask: np.ndarray) -> np.ndarray:
+    """Pad a glyph's ink to a square, shrink it to GLYPH_SIZE² and L2-normalize it."""
+    rows = np.flatnonzero(mask.any(axis=1))
+    cols = np.flatnonzero(mask.any(axis=0))
+    mask = mask[rows[0]:rows[-1] + 1, cols[0]:cols[-1] + 1]
+    height, width = mask.shape
+    side = max(height, width)
+    square = np.zeros((side, side), dtype=np.uint8)
+    top, left = (side - height) // 2, (side - width) // 2
+    square[top:top + height, left:left + width] = mask * 255
+    small = Image.fromarray(square).resize((GLYPH_SIZE, GLYPH_SIZE), Image.BILINEAR)
+    vector = np.asarray(small, dtype=np.float32).ravel()
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
+
+
+def render_templates():
+    """Render every class in a few sizes and stroke weights as the nearest-neighbour reference set."""
+    vectors, labels = [], []
+    for size in TEMPLATE_FONT_SIZES:
+        try:
+            font = ImageFont.load_default(size=size)
+        except TypeError:
+            font = ImageFont.load_default()
+        for stroke in TEMPLATE_STROKES:
+            for label in GLYPH_CLASSES:
+                canvas = Image.new('L', (size * 2, size * 2), 255)
+                ImageDraw.Draw(canvas).text((size // 2, size // 4), label, fill=0, font=font,
+                                            stroke_width=stroke, stroke_fill=0)
+                mask = ink_of(canvas)
+                if mask.any():
+                    vectors.append(glyph_vector(mask))
+                    labels.append(label)
+    return np.stack(vectors), labels
+
+
+class GlyphClassifier:
+    """Nearest-neighbour classifier over rendered digit and operator templates.
+
+    Lines are split by blank row bands and glyphs by blank columns. Dots and
+    minus signs are decided by their size relative to the line before matching,
+    since both look alike once padded to a square. Every read reports the
+    margin of its best class over the runner-up too: a glyph drawn in another
+    hand can be similar to several templates at once, and then the similarity
+    alone says little about which one it is.
+    """
+
+    def __init__(self):
+        self.templates, self.labels = render_templates()
+        self.labels_array = np.array(self.labels)
+
+    def classify(self, mask: np.ndarray):
+        """Return (label, cosine similarity, margin over the best other label) for one glyph mask."""
+        scores = self.templates @ glyph_vector(mask)
+        best = int(np.argmax(scores))
+        label = self.labels[best]
+        others = scores[self.labels_array != label]
+        return label, float(scores[best]), float(scores[best] - others.max())
+
+    def read_glyph(self, glyph: np.ndarray, line_height: int, fragment: bool = False):
+        """Classify a run of ink, splitting it at its thinnest column when it looks
+        like touching glyphs ("44", "7.", "(3") and the halves match better than the whole.
+        Returns (text, lowest confidence, lowest margin)."""
+        rows = np.flatnonzero(glyph.any(axis=1))
+        height, width = rows[-1] - rows[0] + 1, glyph.shape[1]
+        if height < line_height * 0.25:
+            if width < line_height * 0.25 and rows[0] > line_height * 0.6:
+                return '.', 1.0, 1.0
+            if not fragment:
+                return '-', 1.0, 1.0
+            # A sliver cut off a digit (the bar of a 4), not a real mark
+            return '', 0.0, 0.0
+
+        label, score, margin = self.classify(glyph)
+        if width > line_height * 0.6:
+            column_ink = glyph.sum(axis=0)
+            lo, hi = width * 3 // 10, max(width * 7 // 10, width * 3 // 10 + 1)
+            cut = lo + int(np.argmin(column_ink[lo:hi]))
+            left, right = glyph[:, :cut], glyph[:, cut:]
+            if left.any() and right.any():
+                left_text, left_score, left_margin = self.read_glyph(left, line_height, fragment=True)
+                right_text, right_score, right_margin = self.read_glyph(right, line_height, fragment=True)
+                if min(left_score, right_score) > score:
+                    return left_text + right_text, min(left_score, right_score), min(left_margin, right_margin)
+        return label, score, margin
+
+    def read_line(self, line: np.ndarray):
+        """Transcribe one line of ink. Returns (text, lowest glyph confidence, lowest margin)."""
+        chars, confidence, margin = [], 1.0, 1.0
+        for left, right in split_runs(line.any(axis=0), GLYPH_COL_GAP):
+            text, score, gap = self.read_glyph(line[:, left:right], line.shape[0])
+            chars.append(text)
+            confidence, margin = min(confidence, score), min(margin, gap)
+        # An x between two operands is a handwritten times sign (6x7); anywhere else it is the variable
+        return TIMES_X.sub('*', ''.join(chars)), confidence, margin
+
+    def read(self, img: Image.Image):
+        """Transcribe every line of a prepared region. Returns [(text, confidence, margin)]."""
+        mask = ink_of(img)
+        lines = []
+        for top, bottom in split_runs(mask.any(axis=1), LINE_ROW_GAP):
+            text, confidence, margin = self.read_line(mask[top:bottom])
+            if text:
+                lines.append((text, confidence, margin))
+        return lines
@@ -0,0 +1,187 @@
+import asyncio
+import time
+import uuid
+from collections import OrderedDict
+from fastapi import HTTPException
+from apps.calculator.pages import PageSource, segment_page
+from apps.calculator.pipeline import analyze_regions
+from apps.calculator.pool import analysis_limiter, run_image_work
+from constants import JOB_WORKERS, JOB_MAX_JOBS, JOB_TTL, RETRY_AFTER_SECONDS
+from metrics import errors_total, registry
+
+pages_total = registry.counter('drawcal_job_pages_total', 'Batch job pages processed, by outcome', ('outcome',))
+
+
+class Job:
+    """One batch upload: its page source, and a result slot per page filled in as pages finish."""
+
+    def __init__(self, source: PageSource, dict_of_vars: dict, backend_name: str = None):
+        self.id = uuid.uuid4().hex
+        self.source = source
+        self.dict_of_vars = dict_of_vars or {}
+        self.backend_name = backend_name
+        self.results = [None] * len(source)
+        self.completed = 0
+        self.failed = 0
+        self.cancelled = False
+        self.created = time.time()
+        self.finished = None
+
+    @property
+    def pages(self) -> int:
+        return len(self.results)
+
+    @property
+    def status(self) -> str:
+        if self.cancelled:
+            return 'cancelled'
+        if self.finished is not None:
+            return 'done'
+        return 'running' if self.completed or self.failed else 'queued'
+
+    def record(self, index: int, result: dict):
+        self.results[index] = result
+        if result['status'] == 'done':
+            self.completed += 1
+        else:
+            self.failed += 1
+        if self.completed + self.failed == self.pages:
+            self.close()
+
+    def close(self):
+        self.finished = time.time()
+        # The upload is only needed to render pages
+        self.source.close()
+
+    def summary(self, since: int = 0) -> dict:
+        """Status plus the results of finished pages numbered `since` and up."""
+        return {
+            "job_id": self.id,
+            "status": self.status,
+            "pages": self.pages,
+            "completed": self.completed,
+            "failed": self.failed,
+            "created": self.created,
+            "finished": self.finished,
+            "results": [
+                {"page": index, **result}
+                for index, result in enumerate(self.results[since:], start=since)
+                if result is not None
+            ],
+        }
+
+
+class JobQueue:
+    """Batch jobs worked off by a fixed number of background workers, one page at a time.
+
+    Pages from all jobs share one FIFO queue, so JOB_WORKERS bounds how many
+    pages are in progress however many jobs are waiting. Finished and cancelled
+    jobs are kept for JOB_TTL seconds to be polled, and at most JOB_MAX_JOBS
+    jobs are held.
+    """
+
+    def __init__(self, workers: int = JOB_WORKERS, max_jobs: int = JOB_MAX_JOBS, ttl: int = JOB_TTL):
+        self.workers = workers
+        self.max_jobs = max_jobs
+        self.ttl = ttl
+        self._jobs = OrderedDict()
+        self._queue = None
+        self._tasks = []
+
+    def _evict(self, room: int = 0):
+        now = time.time()
+        for job_id in [jid for jid, job in self._jobs.items() if job.finished and now - job.finished > self.ttl]:
+            del self._jobs[job_id]
+        # Unfinished jobs are never dropped to make room
+        finished = [jid for jid, job in self._jobs.items() if job.finished]
+        while len(self._jobs) + room > self.max_jobs and finished:
+            del self._jobs[finished.pop(0)]
+
+    def _start(self):
+        # Bound to the server's event loop, so started by the first submission
+        if self._queue is None:
+            self._queue = asyncio.Queue()
+        self._tasks = [task for task in self._tasks if not task.done()]
+        while len(self._tasks) < self.workers:
+            self._tasks.append(asyncio.get_running_loop().create_task(self._work()))
+
+    def submit(self, job: Job) -> Job:
+        self._evict(room=1)
+        if len(self._jobs) >= self.max_jobs:
+            raise HTTPException(status_code=429, detail="Too many batch jobs in progress, please retry later",
+                                headers={"Retry-After": str(RETRY_AFTER_SECONDS)})
+        self._jobs[job.id] = job
+        self._start()
+        for index in range(job.pages):
+            self._queue.put_nowait((job, index))
+        return job
+
+    def get(self, job_id: str) -> Job:
+        self._evict()
+        job = self._jobs.get(job_id)
+        if job is None:
+            raise HTTPException(status_code=404, detail="Job not found or expired")
+        return job
+
+    def cancel(self, job_id: str):
+        job = self._jobs.get(job_id)
+        if job is not None and job.finished is None:
+            # Queued pages are skipped when a worker reaches them
+            job.cancelled = True
+            job.close()
+
+    async def _work(self):
+        while True:
+            job, index = await self._queue.get()
+            try:
+                if not job.cancelled:
+                    result = await self._process(job, index)
+                    if not job.cancelled:
+                        job.record(index, result)
+            finally:
+                self._queue.task_done()
+
+    async def _process(self, job: Job, index: int) -> dict:
+        try:
+            regions = await run_image_work(segment_page, job.source, index)
+            while True:
+                try:
+                    rows = await analyze_regions(regions, job.dict_of_vars, job.backend_name)
+                    break
+                except HTTPException as e:
+                    # Interactive requests hold the limiter's slots; wait for one instead of failing the page
+                    if e.status_code != 429:
+                        raise
+                    await asyncio.sleep(analysis_limiter.retry_after)
+        except Exception as e:
+            if job.cancelled:
+                # Its document was closed under it; the result is dropped anyway
+                return {"status": "failed", "error": "cancelled"}
+            errors_total.inc(stage='job_page')
+            pages_total.inc(outcome='failed')
+            print(f"Error in job {job.id} page {index}: {e}")
+            return {"status": "failed", "error": str(e)}
+        pages_total.inc(outcome='done')
+        return {"status": "done", "data": rows}
+
+    async def close(self):
+        for task in self._tasks:
+            task.cancel()
+        self._tasks = []
+
+    def stats(self) -> dict:
+        return {
+            "jobs": len(self._jobs),
+            "queued_pages": self._queue.qsize() if self._queue is not None else 0,
+            "workers": self.workers,
+        }
+
+
+job_queue = JobQueue()
+
+
+@registry.collector
+def job_metrics():
+    stats = job_queue.stats()
+    yield "drawcal_jobs", "gauge", "Batch jobs held (queued, running or finished)", {}, stats["jobs"]
+    yield "drawcal_job_queued_pages", "gauge", "Batch job pages waiting for a worker", {}, stats["queued_pages"]
@@ -0,0 +1,97 @@
+"""Pages of a batch upload: a list of data URLs, a multi-page TIFF or a PDF.
+
+Pages are decoded one at a time, when a job worker gets to them, so a long
+document never sits in memory fully rendered. PDF support needs the pypdfium2
+package from requirements.txt.
+"""
+from threading import Lock
+from PIL import Image
+from apps.calculator.preprocess import decode_data_url, open_buffer, open_image
+from apps.calculator.segment import segment_image
+from constants import JOB_PDF_DPI
+from metrics import span
+
+PDF_MAGIC = b'%PDF'
+TIFF_MAGIC = (b'II*\x00', b'MM\x00*')
+# PDFium is not thread-safe
+_pdf_lock = Lock()
+
+
+class UnsupportedDocument(ValueError):
+    pass
+
+
+def detect_kind(data) -> str:
+    head = bytes(data[:4])
+    if head == PDF_MAGIC:
+        return 'pdf'
+    if head in TIFF_MAGIC:
+        return 'tiff'
+    return 'image'
+
+
+def _pdfium():
+    try:
+        import pypdfium2
+    except ImportError:
+        raise UnsupportedDocument("PDF uploads need the pypdfium2 package on the server")
+    return pypdfium2
+
+
+class PageSource:
+    """The pages of one upload, opened once when the job is created.
+
+    load() decodes a single page; a PDF or TIFF is parsed only once, however
+    many pages are then rendered from it. close() releases the document, after
+    which no more pages can be loaded.
+    """
+
+    def __init__(self, kind: str, data):
+        self.kind = kind
+        self._lock = Lock()
+        self._data = None
+        self._document = None
+        if kind == 'data_urls':
+            self._data = data
+            self.pages = len(data)
+        elif kind == 'pdf':
+            pdfium = _pdfium()
+            with _pdf_lock:
+                self._document = pdfium.PdfDocument(bytes(data))
+                self.pages = len(self._document)
+        else:
+            self._document = open_buffer(data)
+            # Decode the first frame now, so a broken file is refused at upload
+            self._document.load()
+            self.pages = getattr(self._document, 'n_frames', 1) if kind == 'tiff' else 1
+
+    def __len__(self) -> int:
+        return self.pages
+
+    def load(self, index: int) -> Image.Image:
+        with span('page_render'):
+            if self.kind == 'data_urls':
+                data = self._data
+                if data is None:
+                    raise ValueError("The upload was closed")
+                return open_image(decode_data_url(data[index]))
+            with _pdf_lock if self.kind == 'pdf' else self._lock:
+                if self._document is None:
+                    raise ValueError("The upload was closed")
+                if self.kind == 'pdf':
+                    return self._document[index].render(scale=JOB_PDF_DPI / 72, grayscale=True).to_pil()
+                # Frames share one file handle, so copy the one we want out before moving on
+                self._document.seek(index)
+                return self._document.convert('L')
+
+    def close(self):
+        self._data = None
+        with _pdf_lock if self.kind == 'pdf' else self._lock:
+            if self._document is not None:
+                self._document.close()
+                self._document = None
+
+
+def segment_page(source: PageSource, index: int):
+    """Decode and segment one page; top-level so it can run in the image pool."""
+    return segment_image(source.load(index))
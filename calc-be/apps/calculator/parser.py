@@ -0,0 +1,187 @@
+import json
+from metrics import parse_fallbacks_total, verbose
+
+ESCAPES = {'n': '\n', 't': '\t', 'r': '\r', 'b': '\b', 'f': '\f', '/': '/', '\\': '\\', '"': '"', "'": "'"}
+BARE_WORDS = {'true': True, 'false': False, 'null': None, 'none': None}
+# Where a key or value begins, the only places a quote opens a string
+VALUE_STARTS = set('{[,:')
+
+
+class ObjectStreamParser:
+    """Pull complete top-level JSON objects out of a model response as it streams in.
+
+    Text is fed in arbitrary chunks; every `{...}` that closes at the outermost
+    object level is returned as soon as its closing brace arrives. Anything
+    around the objects (code fences, the enclosing array, prose) is ignored.
+    Objects that aren't strict JSON (single quotes, bare keys, Python literals,
+    trailing commas) are read by the lenient decoder below. A quote only opens
+    a string where a key or value begins, so `expr: f'(x)` is an unquoted
+    value; an object that never closes is re-read from its next `{` by finish().
+    """
+
+    def __init__(self):
+        self._buffer = []
+        self._depth = 0
+        self._quote = None
+        self._escape = False
+        self._last = None
+
+    def feed(self, chunk: str) -> list:
+        objects = []
+        for char in chunk:
+            if self._depth == 0:
+                if char == '{':
+                    self._depth = 1
+                    self._buffer = [char]
+                    self._last = char
+                continue
+
+            self._buffer.append(char)
+            if self._quote is not None:
+                if self._escape:
+                    self._escape = False
+                elif char == '\\':
+                    self._escape = True
+                elif char == self._quote:
+                    self._quote = None
+                    self._last = char
+                continue
+            if char in ' \t\r\n':
+                continue
+            if (char == '"' or char == "'") and self._last in VALUE_STARTS:
+                self._quote = char
+            elif char == '{':
+                self._depth += 1
+            elif char == '}':
+                self._depth -= 1
+                if self._depth == 0:
+                    obj = decode_object(''.join(self._buffer))
+                    if obj is not None:
+                        objects.append(obj)
+                    self._buffer = []
+            self._last = char
+        return objects
+
+    def finish(self) -> list:
+        """Objects left inside an object that never closed, read again from its next `{`."""
+        objects = []
+        while self._depth:
+            rest = ''.join(self._buffer[1:])
+            self.__init__()
+            objects.extend(self.feed(rest))
+        return objects
+
+    def objects(self, chunks):
+        """Every object in an iterable of text chunks, as each one completes."""
+        for chunk in chunks:
+            yield from self.feed(chunk)
+        yield from self.finish()
+
+
+def decode_object(text: str):
+    """Decode one `{...}`: strict JSON when possible, otherwise leniently. None if neither works."""
+    try:
+        obj = json.loads(text)
+    except json.JSONDecodeError:
+        try:
+            obj = LenientReader(text).read_value()
+        except ValueError:
+            parse_fallbacks_total.inc(kind='unparseable')
+            verbose("Skipping unparseable object in stream:", text)
+            return None
+        parse_fallbacks_total.inc(kind='lenient')
+    return obj if isinstance(obj, dict) else None
+
+
+def parse_answers(text: str) -> list:
+    """Every object in a complete model response, in order."""
+    return list(ObjectStreamParser().objects([text or '']))
+
+
+class LenientReader:
+    """Recursive-descent reader for the JSON-like objects models write by hand.
+
+    Accepts single- or double-quoted strings, unquoted keys, True/False/None,
+    trailing commas and unquoted values such as `result: 99.88` or `expr: 2 + 2`.
+    String contents are never rewritten, so `"f(x): 2x"` survives intact.
+    Raises ValueError on anything it can't make sense of.
+    """
+
+    def __init__(self, text: str):
+        self.text = text
+        self.pos = 0
+
+    def skip(self, chars=' \t\r\n'):
+        while self.pos < len(self.text) and self.text[self.pos] in chars:
+            self.pos += 1
+
+    def peek(self):
+        self.skip()
+        if self.pos >= len(self.text):
+            raise ValueError("Unexpected end of object")
+        return self.text[self.pos]
+
+    def read_value(self):
+        char = self.peek()
+        if char == '{':
+            return self.read_container('}', {})
+        if char == '[':
+            return self.read_container(']', [])
+        if char == '"' or char == "'":
+            return self.read_string()
+        return self.read_bare(',}]')
+
+    def read_container(self, close: str, container):
+        self.pos += 1
+        while True:
+            self.skip(' \t\r\n,')
+            if self.peek() == close:
+                self.pos += 1
+                return container
+            if close == ']':
+                container.append(self.read_value())
+                continue
+            key = self.read_string() if self.peek() in '"\'' else self.read_bare(':,}')
+            if self.peek() != ':':
+                raise ValueError(f"Expected ':' after key {key!r}")
+            self.pos += 1
+            container[str(key)] = self.read_value()
+
+    def read_string(self) -> str:
+        quote = self.text[self.pos]
+        self.pos += 1
+        chars = []
+        while self.pos < len(self.text):
+            char = self.text[self.pos]
+            self.pos += 1
+            if char == quote:
+                return ''.join(chars)
+            if char != '\\' or self.pos >= len(self.text):
+                chars.append(char)
+                continue
+            escaped = self.text[self.pos]
+            self.pos += 1
+            if escaped == 'u' and self.pos + 4 <= len(self.text):
+                try:
+                    chars.append(chr(int(self.text[self.pos:self.pos + 4], 16)))
+                    self.pos += 4
+                    continue
+                except ValueError:
+                    pass
+            # Unknown escapes (LaTeX such as \frac) are kept as written
+            chars.append(ESCAPES.get(escaped, '\\' + escaped))
+        raise ValueError("Unterminated string")
+
+    def read_bare(self, stops: str):
+        start = self.pos
+        while self.pos < len(self.text) and self.text[self.pos] not in stops:
+            self.pos += 1
+        token = self.text[start:self.pos].strip()
+        if not token:
+            raise ValueError(f"Missing value at offset {start}")
+        if token.lower() in BARE_WORDS:
+            return BARE_WORDS[token.lower()]
+        try:
+            return json.loads(token)
+        except json.JSONDecodeError:
+            return token
@@ -0,0 +1,215 @@
+import asyncio
+from fastapi import HTTPException
+from PIL import Image
+from apps.calculator.utils import is_cacheable
+from apps.calculator.backends import get_backend
+from apps.calculator.cache import canonical_vars, make_cache_key, result_cache
+from apps.calculator.pool import analysis_limiter, run_model_call
+from apps.calculator.singleflight import single_flight
+from apps.calculator.batching import batching_enabled, get_batcher
+from apps.calculator.evaluator import EvaluationError, evaluate, normalize_vars
+from apps.calculator.vargraph import evaluate_rows
+from apps.calculator.similar import match_verifier, near_duplicates, thumbnail
+from constants import RECOGNITION_MODE, LOCAL_EVALUATION, PERCEPTUAL_CACHE
+from metrics import span
+
+# Transcriptions carry no results, so they always need local evaluation
+EVALUATE_LOCALLY = LOCAL_EVALUATION or RECOGNITION_MODE == 'transcribe'
+
+
+def key_vars(dict_of_vars: dict) -> dict:
+    # Transcriptions don't depend on the variables, so every vars state shares them
+    return {} if RECOGNITION_MODE == 'transcribe' else dict_of_vars
+
+
+def region_cache_key(image: Image.Image, dict_of_vars: dict, backend) -> str:
+    return backend.name + ':' + make_cache_key(image, key_vars(dict_of_vars))
+
+
+def near_duplicate_scope(dict_of_vars: dict, backend) -> str:
+    return backend.name + ':' + canonical_vars(key_vars(dict_of_vars))
+
+
+def find_near_duplicate(cache_key: str, backend, image: Image.Image, dict_of_vars: dict):
+    """(responses, thumb) for an exact-cache miss. responses come from a
+    perceptually similar image recognized earlier, or are None; thumb is
+    passed on to recognize_and_cache so the image is indexed once recognized.
+    """
+    if not PERCEPTUAL_CACHE:
+        return None, None
+    with span('phash'):
+        thumb = thumbnail(image)
+        responses = near_duplicates.lookup(near_duplicate_scope(dict_of_vars, backend), thumb)
+    if responses is not None:
+        match_verifier.maybe_verify(responses, lambda: single_flight.do(
+            cache_key, lambda: recognize_and_cache(cache_key, backend, image, dict_of_vars, thumb=thumb)
+        ))
+    return responses, thumb
+
+
+async def recognize_and_cache(cache_key: str, backend, image: Image.Image, dict_of_vars: dict, on_answer=None,
+                              thumb=None, admission=None):
+    """Recognize one image under the limiter and cache a successful result.
+
+    With an admission the request's slot is used, which recognize_shared
+    acquires before starting the call; otherwise the call takes a slot of its own. Streaming calls go straight to the backend;
+    otherwise the image may share a model call with other requests' images
+    through the micro-batcher. With a thumb, the result is also indexed for
+    near-duplicate lookups. Errors and fallback answers are never cached.
+    """
+    if admission is not None:
+        responses = await recognize(backend, image, dict_of_vars, on_answer)
+    else:
+        async with analysis_limiter.slot():
+            responses = await recognize(backend, image, dict_of_vars, on_answer)
+    if is_cacheable(responses):
+        await result_cache.set(cache_key, responses)
+        if thumb is not None:
+            near_duplicates.add(near_duplicate_scope(dict_of_vars, backend), thumb, responses)
+    return responses
+
+
+async def recognize(backend, image: Image.Image, dict_of_vars: dict, on_answer=None):
+    if on_answer is not None:
+        return await run_model_call(backend.recognize_stream, image, dict_of_vars, on_answer)
+    if batching_enabled(backend):
+        return await get_batcher(backend).submit(image, dict_of_vars)
+    return await run_model_call(backend.recognize, image, dict_of_vars)
+
+
+async def analyze_cached(image: Image.Image, dict_of_vars: dict, backend_name: str = None, admission=None):
+    """Analyze one prepared image, serving repeats from the result cache and, with
+    PERCEPTUAL_CACHE on, near-duplicates of earlier images from the similarity index.
+
+    Identical images (same pixels, vars and backend) already being analyzed for
+    another request share that call instead of starting their own.
+    """
+    backend = get_backend(backend_name)
+    cache_key = region_cache_key(image, dict_of_vars, backend)
+    responses = await result_cache.get(cache_key)
+    if responses is not None:
+        return responses
+    responses, thumb = find_near_duplicate(cache_key, backend, image, dict_of_vars)
+    if responses is not None:
+        return responses
+
+    _, responses = await recognize_shared(
+        cache_key, admission, lambda: recognize_and_cache(cache_key, backend, image, dict_of_vars, thumb=thumb, admission=admission)
+    )
+    return responses
+
+
+async def recognize_shared(cache_key: str, admission, work):
+    """single_flight.do for one caller, returning (joined, responses).
+
+    Admission is per caller: the request starting the shared call is admitted
+    before it, so a refusal is that request's 429 only. Requests joining a call
+    take no slot, and one whose shared call was refused a slot starts its own.
+    """
+    while True:
+        joined = single_flight.pending(cache_key)
+        if not joined and admission is not None:
+            admission.acquire()
+        try:
+            return joined, await single_flight.do(cache_key, work)
+        except HTTPException as e:
+            if not joined or e.status_code != 429:
+                raise
+
+
+async def analyze_regions(regions, dict_of_vars: dict, backend_name: str = None):
+    """Analyze segmented regions concurrently and merge them into one response list.
+
+    The request holds one limiter slot, whatever its number of regions. Each row
+    is tagged with the [left, top, right, bottom] canvas box it came from. Rows
+    are copied so cached lists are never mutated.
+    """
+    async with analysis_limiter.request() as admission:
+        results = await asyncio.gather(*(
+            analyze_cached(image, dict_of_vars, backend_name, admission) for _, image in regions
+        ))
+    return await finalize(merge_regions([bbox for bbox, _ in regions], results), dict_of_vars)
+
+
+def merge_regions(boxes, results):
+    merged = []
+    for bbox, responses in zip(boxes, results):
+        merged.extend({**row, "region": list(bbox)} for row in responses)
+    return merged
+
+
+async def finalize(rows, dict_of_vars: dict):
+    """Recompute results locally so they don't depend on the model's arithmetic.
+
+    Runs off the event loop: arithmetic on transcribed input is bounded but not free.
+    """
+    if EVALUATE_LOCALLY:
+        with span('evaluate'):
+            return await asyncio.to_thread(evaluate_rows, rows, dict_of_vars)
+    return rows
+
+
+async def stream_regions(regions, dict_of_vars: dict, backend_name: str = None):
+    """Async generator yielding ("row", row) as each expression is recognized in any
+    region, then ("done", rows) with the merged, locally evaluated rows.
+
+    Streamed rows get a provisional local evaluation against dict_of_vars and
+    assignments seen so far; the final rows resolve variables across the canvas.
+    """
+    backend = get_backend(backend_name)
+    loop = asyncio.get_running_loop()
+    queue = asyncio.Queue()
+    results = [None] * len(regions)
+
+    async def run_region(index, bbox, image, admission):
+        emit = lambda row: loop.call_soon_threadsafe(queue.put_nowait, {**row, "region": bbox})
+        cache_key = region_cache_key(image, dict_of_vars, backend)
+        rows = await result_cache.get(cache_key)
+        if rows is None:
+            rows, thumb = find_near_duplicate(cache_key, backend, image, dict_of_vars)
+        if rows is None:
+            joined, rows = await recognize_shared(
+                cache_key, admission, lambda: recognize_and_cache(cache_key, backend, image, dict_of_vars, emit, thumb, admission)
+            )
+            if not joined:
+                results[index] = rows
+                return
+        # Cached, near-duplicate or shared with another request: nothing was streamed for this region yet
+        for row in rows:
+            emit(row)
+        results[index] = rows
+
+    async def run_all():
+        try:
+            # One limiter slot for the whole stream
+            async with analysis_limiter.request() as admission:
+                await asyncio.gather(*(
+                    run_region(i, bbox, image, admission) for i, (bbox, image) in enumerate(regions)
+                ))
+        finally:
+            loop.call_soon_threadsafe(queue.put_nowait, None)
+
+    task = asyncio.create_task(run_all())
+    scope = normalize_vars(dict_of_vars)
+    try:
+        while True:
+            row = await queue.get()
+            if row is None:
+                break
+            if EVALUATE_LOCALLY:
+                row = provisional(row, scope)
+            yield "row", row
+        await task
+    finally:
+        task.cancel()
+    yield "done", await finalize(merge_regions([bbox for bbox, _ in regions], results), dict_of_vars)
+
+
+def provisional(row: dict, scope: dict) -> dict:
+    try:
+        result, target, value = evaluate(row.get('expr', ''), scope)
+    except EvaluationError:
+        return row
+    if target is not None:
+        scope[target] = value
+    return {**row, 'result': result, 'assign': target is not None}
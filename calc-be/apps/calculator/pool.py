@@ -0,0 +1,100 @@
+import asyncio
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from fastapi import HTTPException
+from constants import MODEL_CONCURRENCY, MAX_PENDING_ANALYSES, IMAGE_WORKERS, RETRY_AFTER_SECONDS
+
+# Model calls are network bound and the SDK is synchronous, so they get threads.
+model_executor = ThreadPoolExecutor(max_workers=MODEL_CONCURRENCY, thread_name_prefix="model")
+
+# PIL/NumPy release the GIL for the heavy parts of decode and preprocessing, so a
+# thread pool is enough by default; a process pool is opt-in because serverless
+# runtimes often can't fork workers.
+if IMAGE_WORKERS > 0:
+    image_executor = ProcessPoolExecutor(max_workers=IMAGE_WORKERS)
+else:
+    image_executor = ThreadPoolExecutor(thread_name_prefix="image")
+
+
+class AnalysisLimiter:
+    """Admission control for model work: fail fast with 429 instead of queueing forever."""
+
+    def __init__(self, capacity: int = MAX_PENDING_ANALYSES, retry_after: int = RETRY_AFTER_SECONDS):
+        self.capacity = capacity
+        self.retry_after = retry_after
+        self.in_flight = 0
+        self.rejected = 0
+
+    def check(self):
+        """Raise 429 now if no slot is free."""
+        if self.in_flight >= self.capacity:
+            self.rejected += 1
+            raise HTTPException(
+                status_code=429,
+                detail="Too many calculations in progress, please retry shortly",
+                headers={"Retry-After": str(self.retry_after)},
+            )
+
+    @asynccontextmanager
+    async def slot(self):
+        self.check()
+        self.in_flight += 1
+        try:
+            yield
+        finally:
+            self.in_flight -= 1
+
+    @asynccontextmanager
+    async def request(self):
+        """One slot for a whole request, however many regions it has; see Admission."""
+        admission = Admission(self)
+        try:
+            yield admission
+        finally:
+            admission.release()
+
+    def stats(self) -> dict:
+        return {"in_flight": self.in_flight, "capacity": self.capacity, "rejected": self.rejected}
+
+
+class Admission:
+    """A request's claim on the limiter, taken when its first region needs the model.
+
+    Regions served from the cache take nothing. Once refused, the request stays
+    refused, so its other regions don't go on to spend model calls on a
+    response that is already a 429.
+    """
+
+    def __init__(self, limiter: AnalysisLimiter):
+        self.limiter = limiter
+        self.held = False
+        self.refused = None
+
+    def acquire(self):
+        if self.held:
+            return
+        if self.refused is not None:
+            raise self.refused
+        try:
+            self.limiter.check()
+        except HTTPException as e:
+            self.refused = e
+            raise
+        self.limiter.in_flight += 1
+        self.held = True
+
+    def release(self):
+        if self.held:
+            self.held = False
+            self.limiter.in_flight -= 1
+
+
+analysis_limiter = AnalysisLimiter()
+
+
+async def run_image_work(fn, *args):
+    return await asyncio.get_running_loop().run_in_executor(image_executor, fn, *args)
+
+
+async def run_model_call(fn, *args):
+    return await asyncio.get_running_loop().run_in_executor(model_executor, fn, *args)
@@ -0,0 +1,151 @@
+import base64
+import io
+import numpy as np
+from PIL import Image, UnidentifiedImageError
+from constants import PREPROCESS_MAX_SIDE, PREPROCESS_MODE, PREPROCESS_MARGIN, INK_THRESHOLD
+from metrics import span
+
+
+class BufferReader(io.RawIOBase):
+    """Read-only file object over a bytes/bytearray without copying it, unlike io.BytesIO(bytearray)."""
+
+    def __init__(self, buffer):
+        self._view = memoryview(buffer)
+        self._pos = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def readinto(self, b):
+        n = max(min(len(b), len(self._view) - self._pos), 0)
+        b[:n] = self._view[self._pos:self._pos + n]
+        self._pos += n
+        return n
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self._pos
+        elif whence == io.SEEK_END:
+            offset += len(self._view)
+        self._pos = max(offset, 0)
+        return self._pos
+
+    def tell(self):
+        return self._pos
+
+
+def decode_data_url(data_url: str) -> bytes:
+    with span('base64'):
+        return base64.b64decode(data_url.split(',')[1])
+
+
+def open_buffer(buffer) -> Image.Image:
+    """Image.open over an upload buffer. PIL's own message names the file object
+    (<BufferReader object at 0x...>), which is no use to the client it reaches."""
+    try:
+        return Image.open(BufferReader(buffer))
+    except UnidentifiedImageError:
+        raise UnidentifiedImageError("Not a recognized image file") from None
+
+
+def open_image(buffer) -> Image.Image:
+    with span('open'):
+        img = open_buffer(buffer)
+        # Image.open only reads the header; decode here so the span covers it
+        img.load()
+    return img
+
+
+def to_gray_array(img: Image.Image) -> np.ndarray:
+    """Decode the canvas into a uint8 luminance array."""
+    if img.mode == 'P':
+        img = img.convert('RGBA')
+    if img.mode in ('RGBA', 'LA') and img.getchannel('A').getextrema()[0] < 255:
+        # Transparent pixels count as background, not as black ink
+        img = img.convert('RGBA')
+        background = Image.new('RGBA', img.size, (0, 0, 0, 255))
+        background.alpha_composite(img)
+        img = background
+    return np.asarray(img.convert('L'))
+
+
+def estimate_background(gray: np.ndarray) -> int:
+    """The canvas is filled before drawing, so the border is almost always background."""
+    border = np.concatenate((gray[0, :], gray[-1, :], gray[:, 0], gray[:, -1]))
+    return int(np.median(border))
+
+
+def ink_mask(gray: np.ndarray, background: int = None, threshold: int = INK_THRESHOLD) -> np.ndarray:
+    if background is None:
+        background = estimate_background(gray)
+    # Two uint8 comparisons instead of an int16 difference: no full-size temporaries wider than a byte
+    mask = gray > min(background + threshold, 255)
+    mask |= gray < max(background - threshold, 0)
+    return mask
+
+
+def find_ink_bbox(mask: np.ndarray, margin: int = 0):
+    """Return (left, top, right, bottom) of the ink in the mask, or None for an empty canvas."""
+    rows = np.flatnonzero(mask.any(axis=1))
+    if rows.size == 0:
+        return None
+    cols = np.flatnonzero(mask.any(axis=0))
+    height, width = mask.shape
+    return (
+        max(int(cols[0]) - margin, 0),
+        max(int(rows[0]) - margin, 0),
+        min(int(cols[-1]) + 1 + margin, width),
+        min(int(rows[-1]) + 1 + margin, height),
+    )
+
+
+def prepare_image(img: Image.Image, max_side: int = PREPROCESS_MAX_SIDE, mode: str = PREPROCESS_MODE,
+                  margin: int = PREPROCESS_MARGIN) -> Image.Image:
+    """Crop the canvas to its strokes, downscale it and reduce it to grayscale or bi-level.
+
+    The output is always dark ink on a white background regardless of the
+    canvas theme, which keeps the encoded PNG small and the model input uniform.
+    """
+    if mode == 'off':
+        return img
+
+    gray = to_gray_array(img)
+    background = estimate_background(gray)
+    mask = ink_mask(gray, background)
+    bbox = find_ink_bbox(mask, margin)
+    if bbox is not None:
+        left, top, right, bottom = bbox
+        gray = gray[top:bottom, left:right]
+        mask = mask[top:bottom, left:right]
+
+    return render_crop(gray, mask, background, max_side, mode)
+
+
+def render_crop(gray: np.ndarray, mask: np.ndarray, background: int, max_side: int = PREPROCESS_MAX_SIDE,
+                mode: str = PREPROCESS_MODE) -> Image.Image:
+    """Turn an already cropped luminance/ink pair into the image that is sent to the model."""
+    if mode == '1':
+        out = Image.fromarray(np.where(mask, 0, 255).astype(np.uint8))
+    else:
+        # Map background to white and the strongest ink to black
+        distance = np.abs(gray.astype(np.int16) - background)
+        scale = max(int(distance.max()), 1)
+        out = Image.fromarray((255 - distance * 255 // scale).astype(np.uint8))
+
+    if max(out.size) > max_side:
+        out.thumbnail((max_side, max_side), Image.LANCZOS)
+
+    if mode == '1':
+        # Keep thin strokes that were averaged into light gray by the downscale
+        out = out.point(lambda p: 255 if p >= 224 else 0).convert('1')
+    return out
+
+
+def encode_png(img: Image.Image) -> bytes:
+    with span('encode'):
+        buffer = io.BytesIO()
+        img.save(buffer, format='PNG')
+        return buffer.getvalue()
@@ -0,0 +1,231 @@
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from threading import Lock
+from constants import (
+    MODEL_CONCURRENCY, MODEL_DEADLINE_SECONDS, MODEL_RETRIES, MODEL_HEDGE_PERCENTILE, MODEL_HEDGE_MIN_MS,
+    MODEL_HEDGE_BUDGET, BREAKER_WINDOW, BREAKER_MIN_CALLS, BREAKER_FAILURE_RATIO, BREAKER_COOLDOWN_SECONDS,
+)
+from metrics import registry
+
+retries_total = registry.counter('drawcal_model_retries_total', 'Model calls retried after a transient error')
+hedges_total = registry.counter('drawcal_model_hedges_total', 'Duplicate model calls sent, by which call answered first', ('winner',))
+timeouts_total = registry.counter('drawcal_model_deadline_exceeded_total', 'Model calls abandoned at their deadline')
+
+
+class CircuitOpen(Exception):
+    """The model has been failing; calls are refused until the cooldown ends."""
+
+
+def is_transient(e: Exception) -> bool:
+    """Errors worth retrying: timeouts, dropped connections, 429 and 5xx."""
+    if isinstance(e, (TimeoutError, ConnectionError)):
+        return True
+    # Only reached after a failed call, by which point the SDK has loaded these
+    import requests
+    from google.api_core import exceptions
+    return isinstance(e, (
+        requests.ConnectionError, requests.Timeout,
+        exceptions.TooManyRequests, exceptions.InternalServerError, exceptions.ServiceUnavailable,
+        exceptions.GatewayTimeout, exceptions.DeadlineExceeded,
+    ))
+
+
+class CircuitBreaker:
+    """Opens when at least failure_ratio of the last `window` attempts failed
+    transiently, refuses calls for `cooldown` seconds, then lets one probe
+    through: success closes it again, failure reopens it."""
+
+    def __init__(self, window: int = BREAKER_WINDOW, min_calls: int = BREAKER_MIN_CALLS,
+                 failure_ratio: float = BREAKER_FAILURE_RATIO, cooldown: float = BREAKER_COOLDOWN_SECONDS):
+        self.min_calls = min_calls
+        self.failure_ratio = failure_ratio
+        self.cooldown = cooldown
+        self.state = 'closed'
+        self.opened = 0
+        self.rejected = 0
+        self._outcomes = deque(maxlen=window)
+        self._opened_at = 0.0
+        self._probing = False
+        self._lock = Lock()
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self.state == 'open' and time.monotonic() - self._opened_at >= self.cooldown:
+                self.state = 'half_open'
+                self._probing = False
+            if self.state == 'closed':
+                return True
+            if self.state == 'half_open' and not self._probing:
+                self._probing = True
+                return True
+            self.rejected += 1
+            return False
+
+    def record(self, ok: bool):
+        with self._lock:
+            if self.state == 'half_open':
+                self._probing = False
+                if ok:
+                    self.state = 'closed'
+                    self._outcomes.clear()
+                else:
+                    self._open()
+                return
+            self._outcomes.append(ok)
+            failures = self._outcomes.count(False)
+            if self.state == 'closed' and len(self._outcomes) >= self.min_calls and failures >= self.failure_ratio * len(self._outcomes):
+                self._open()
+
+    def _open(self):
+        self.state = 'open'
+        self.opened += 1
+        self._opened_at = time.monotonic()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"state": self.state, "opened": self.opened, "rejected": self.rejected}
+
+
+class ModelClient:
+    """Deadlines, retries, hedging and a circuit breaker around blocking model calls.
+
+    call(fn) runs fn(timeout) on the calling model thread, where timeout is what
+    is left of the deadline and should be passed on to the SDK. Transient errors
+    are retried with jittered exponential backoff until the deadline. With
+    hedging on, a duplicate is sent once an attempt outlives the recent latency
+    percentile, and whichever answers first wins.
+    """
+
+    def __init__(self, deadline: float = MODEL_DEADLINE_SECONDS, retries: int = MODEL_RETRIES,
+                 hedge_percentile: float = MODEL_HEDGE_PERCENTILE, hedge_min_ms: int = MODEL_HEDGE_MIN_MS,
+                 hedge_budget: float = MODEL_HEDGE_BUDGET, breaker: CircuitBreaker = None):
+        self.deadline = deadline
+        self.retries = retries
+        self.hedge_percentile = hedge_percentile
+        self.hedge_min = hedge_min_ms / 1000
+        self.hedge_budget = hedge_budget
+        self.breaker = breaker or CircuitBreaker()
+        self.calls = 0
+        self.hedges = 0
+        self._latencies = deque(maxlen=200)
+        self._hedge_pool = None
+        self._lock = Lock()
+
+    def call(self, fn):
+        from tenacity import Retrying, retry_if_exception, stop_after_attempt, stop_after_delay, wait_random_exponential
+        deadline = time.monotonic() + self.deadline
+        with self._lock:
+            self.calls += 1
+        backoff = wait_random_exponential(multiplier=0.25, max=2)
+        retrying = Retrying(
+            stop=stop_after_attempt(self.retries + 1) | stop_after_delay(self.deadline),
+            # Never sleep past the deadline
+            wait=lambda state: min(backoff(state), max(deadline - time.monotonic(), 0)),
+            retry=retry_if_exception(is_transient),
+            before_sleep=lambda state: retries_total.inc(),
+            reraise=True,
+        )
+        return retrying(self._hedged, fn, deadline)
+
+    def call_stream(self, fn):
+        """For streamed generations: deadline and breaker only, since a retry or a
+        duplicate could repeat rows the caller has already been handed. The attempt
+        covers the wait for the first chunk, which is when an upstream failure shows."""
+        def first_chunk(timeout):
+            chunks = iter(fn(timeout))
+            return chunks, next(chunks, None)
+
+        chunks, head = self._attempt(first_chunk, time.monotonic() + self.deadline)
+        return self._resume(chunks, head)
+
+    @staticmethod
+    def _resume(chunks, head):
+        if head is not None:
+            yield head
+        yield from chunks
+
+    def _attempt(self, fn, deadline: float):
+        # Before allow(): a half-open breaker's one probe must end in record()
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            timeouts_total.inc()
+            raise TimeoutError(f"Model call exceeded its {self.deadline:g}s deadline")
+        if not self.breaker.allow():
+            raise CircuitOpen("Model temporarily unavailable after repeated failures")
+        start = time.perf_counter()
+        try:
+            result = fn(remaining)
+        except Exception as e:
+            # A rejected request (bad input, blocked content) says nothing about upstream health
+            self.breaker.record(not is_transient(e))
+            raise
+        self.breaker.record(True)
+        with self._lock:
+            self._latencies.append(time.perf_counter() - start)
+        return result
+
+    def hedge_delay(self):
+        """Seconds to wait before sending a duplicate, or None to not hedge this call."""
+        if self.hedge_percentile <= 0:
+            return None
+        with self._lock:
+            if len(self._latencies) < 20 or self.hedges >= self.hedge_budget * self.calls:
+                return None
+            ordered = sorted(self._latencies)
+        return max(ordered[min(int(len(ordered) * self.hedge_percentile / 100), len(ordered) - 1)], self.hedge_min)
+
+    @property
+    def hedge_pool(self):
+        with self._lock:
+            if self._hedge_pool is None:
+                # Not the model pool: waiting there on work queued behind ourselves could deadlock
+                self._hedge_pool = ThreadPoolExecutor(max_workers=MODEL_CONCURRENCY * 2, thread_name_prefix="model-hedge")
+            return self._hedge_pool
+
+    def _hedged(self, fn, deadline: float):
+        delay = self.hedge_delay()
+        if delay is None:
+            return self._attempt(fn, deadline)
+        primary = self.hedge_pool.submit(self._attempt, fn, deadline)
+        done, _ = wait([primary], timeout=min(delay, max(deadline - time.monotonic(), 0)))
+        if done:
+            return primary.result()
+        with self._lock:
+            self.hedges += 1
+        secondary = self.hedge_pool.submit(self._attempt, fn, deadline)
+        pending, error = {primary, secondary}, None
+        while pending:
+            done, pending = wait(pending, timeout=max(deadline - time.monotonic(), 0), return_when=FIRST_COMPLETED)
+            if not done:
+                # The SDK timeout stops the abandoned attempts shortly after
+                timeouts_total.inc()
+                raise TimeoutError(f"Model call exceeded its {self.deadline:g}s deadline")
+            for future in done:
+                if future.exception() is None:
+                    hedges_total.inc(winner='hedge' if future is secondary else 'primary')
+                    return future.result()
+                error = future.exception()
+        raise error
+
+    def stats(self) -> dict:
+        with self._lock:
+            latencies = sorted(self._latencies)
+            calls, hedges = self.calls, self.hedges
+        return {
+            "calls": calls,
+            "hedges": hedges,
+            "p50_ms": round(latencies[len(latencies) // 2] * 1000, 1) if latencies else None,
+            "breaker": self.breaker.stats(),
+        }
+
+
+model_client = ModelClient()
+
+
+@registry.collector
+def resilience_metrics():
+    stats = model_client.breaker.stats()
+    yield "drawcal_model_breaker_open", "gauge", "1 while the model circuit breaker refuses calls", {}, int(stats["state"] == "open")
+    yield "drawcal_model_breaker_opened_total", "counter", "Times the model circuit breaker opened", {}, stats["opened"]
+    yield "drawcal_model_breaker_rejected_total", "counter", "Model calls refused by the open breaker", {}, stats["rejected"]
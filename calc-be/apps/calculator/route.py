@@ -1,33 +1,312 @@
-from fastapi import APIRouter
-import base64
-from io import BytesIO
-from apps.calculator.utils import analyze_image
-from schema import ImageData
-from PIL import Image
+from fastapi import APIRouter, HTTPException, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+import json
+from apps.calculator.cache import result_cache
+from apps.calculator.segment import decode_data_url_and_segment, decode_and_segment
+from apps.calculator.pipeline import analyze_regions, stream_regions
+from apps.calculator.pool import analysis_limiter, run_image_work
+from apps.calculator.singleflight import single_flight
+from apps.calculator.batching import batching_stats
+from apps.calculator.resilience import model_client
+from apps.calculator.canvas import canvas_store, decode_canvas
+from apps.calculator.jobs import Job, job_queue
+from apps.calculator.similar import match_verifier, near_duplicates
+from apps.calculator.pages import PageSource, UnsupportedDocument, detect_kind
+from schema import ImageData, CanvasPatch, VariablesUpdate, BatchJob
+from constants import RAW_UPLOAD_MAX_BYTES, JOB_MAX_PAGES, JOB_UPLOAD_MAX_BYTES
+from metrics import errors_total, registry, span, verbose
 
 router = APIRouter()
 
 @router.post('/process')
 async def run(data: ImageData):
     try:
-        print("Received image data and variables:", data.dict_of_vars)
-        image_data = base64.b64decode(data.image.split(',')[1])
-        image_bytes = BytesIO(image_data)
-        image = Image.open(image_bytes)
-        print("Image successfully decoded and opened")
+        verbose("Received image data and variables:", data.dict_of_vars)
+        with span('decode'):
+            regions = await run_image_work(decode_data_url_and_segment, data.image)
+        verbose(f"Image successfully decoded and split into {len(regions)} region(s)")
         
-        responses = analyze_image(image, dict_of_vars=data.dict_of_vars)
-        print("Analysis complete, responses:", responses)
+        responses = await analyze_regions(regions, data.dict_of_vars, data.backend)
+        verbose("Analysis complete, responses:", responses)
         
         return {
             "message": "Image Processor",
             "type": "success",
             "data": responses,
         }
+    except HTTPException:
+        raise
     except Exception as e:
+        errors_total.inc(stage='route')
         print(f"Error in route: {str(e)}")
         return {
             "message": "Error processing image",
             "type": "error",
             "data": [{"expr": "Error", "result": str(e), "assign": False}],
         }
+
+
+async def read_body(request: Request, max_bytes: int = RAW_UPLOAD_MAX_BYTES) -> bytearray:
+    """Stream the request body into a buffer sized from Content-Length, without
+    the intermediate copies Starlette's request.body() makes."""
+    length = request.headers.get('content-length')
+    if length is not None:
+        if not (length.isascii() and length.isdigit()):
+            raise HTTPException(status_code=400, detail="Invalid Content-Length")
+        size = int(length)
+        if size > max_bytes:
+            raise HTTPException(status_code=413, detail="Image too large")
+        buffer = bytearray(size)
+        view = memoryview(buffer)
+        pos = 0
+        async for chunk in request.stream():
+            if pos + len(chunk) > size:
+                raise HTTPException(status_code=400, detail="Body longer than Content-Length")
+            view[pos:pos + len(chunk)] = chunk
+            pos += len(chunk)
+        if pos != size:
+            raise HTTPException(status_code=400, detail="Body shorter than Content-Length")
+        return buffer
+
+    buffer = bytearray()
+    async for chunk in request.stream():
+        buffer += chunk
+        if len(buffer) > max_bytes:
+            raise HTTPException(status_code=413, detail="Image too large")
+    return buffer
+
+
+def vars_from_request(request: Request) -> dict:
+    raw = request.headers.get('x-dict-of-vars') or request.query_params.get('dict_of_vars') or '{}'
+    try:
+        dict_of_vars = json.loads(raw)
+    except json.JSONDecodeError:
+        raise HTTPException(status_code=400, detail="dict_of_vars must be a JSON object")
+    if not isinstance(dict_of_vars, dict):
+        raise HTTPException(status_code=400, detail="dict_of_vars must be a JSON object")
+    return dict_of_vars
+
+
+@router.post('/process/raw')
+async def run_raw(request: Request):
+    """Binary variant of /process: the body is the PNG itself (e.g. a canvas.toBlob() upload)
+    and variables come as JSON in the X-Dict-Of-Vars header or the dict_of_vars query parameter.
+    An optional backend query parameter selects the recognition engine."""
+    try:
+        dict_of_vars = vars_from_request(request)
+        image_data = await read_body(request)
+        with span('decode'):
+            regions = await run_image_work(decode_and_segment, image_data)
+        del image_data
+        verbose(f"Raw image decoded and split into {len(regions)} region(s)")
+        
+        responses = await analyze_regions(regions, dict_of_vars, request.query_params.get('backend'))
+        
+        return {
+            "message": "Image Processor",
+            "type": "success",
+            "data": responses,
+        }
+    except HTTPException:
+        raise
+    except Exception as e:
+        errors_total.inc(stage='route')
+        print(f"Error in raw route: {str(e)}")
+        return {
+            "message": "Error processing image",
+            "type": "error",
+            "data": [{"expr": "Error", "result": str(e), "assign": False}],
+        }
+
+
+def sse(event: str, data) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+@router.post('/process/stream')
+async def run_stream(data: ImageData):
+    """Server-Sent Events variant of /process: a `result` event per expression as soon
+    as the model has produced it, then `done` with the complete response list."""
+    # Refuse before the stream starts; once it has, the status code is already sent
+    analysis_limiter.check()
+
+    async def events():
+        try:
+            with span('decode'):
+                regions = await run_image_work(decode_data_url_and_segment, data.image)
+            async for kind, payload in stream_regions(regions, data.dict_of_vars, data.backend):
+                yield sse("result" if kind == "row" else "done", payload)
+        except Exception as e:
+            errors_total.inc(stage='route')
+            print(f"Error in stream route: {str(e)}")
+            yield sse("error", [{"expr": "Error", "result": str(e), "assign": False}])
+
+    return StreamingResponse(events(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
+
+
+def canvas_response(canvas_id: str, responses, **extra):
+    return {
+        "message": "Image Processor",
+        "type": "success",
+        "canvas_id": canvas_id,
+        "data": responses,
+        **extra,
+    }
+
+
+def canvas_error(e: Exception):
+    errors_total.inc(stage='route')
+    print(f"Error in canvas route: {str(e)}")
+    return {
+        "message": "Error processing image",
+        "type": "error",
+        "data": [{"expr": "Error", "result": str(e), "assign": False}],
+    }
+
+
+@router.post('/canvas')
+async def create_canvas(data: ImageData):
+    """Upload a full canvas once; later edits can be sent as patches against the returned canvas_id."""
+    try:
+        gray = await decode_canvas(data.image)
+        canvas_id, session = canvas_store.create(gray, data.backend)
+        async with session.lock:
+            responses = await session.analyze((0, 0, gray.shape[1], gray.shape[0]), data.dict_of_vars)
+        return canvas_response(canvas_id, responses)
+    except HTTPException:
+        raise
+    except Exception as e:
+        return canvas_error(e)
+
+
+@router.put('/canvas/{canvas_id}')
+async def replace_canvas(canvas_id: str, data: ImageData):
+    """Replace the whole server-held canvas, e.g. after a clear or a window resize."""
+    try:
+        session = canvas_store.get(canvas_id)
+        gray = await decode_canvas(data.image)
+        async with session.lock:
+            dirty = session.replace(gray, data.backend)
+            responses = await session.analyze(dirty, data.dict_of_vars)
+        return canvas_response(canvas_id, responses)
+    except HTTPException:
+        raise
+    except Exception as e:
+        return canvas_error(e)
+
+
+@router.patch('/canvas/{canvas_id}')
+async def patch_canvas(canvas_id: str, data: CanvasPatch):
+    """Apply a dirty-rectangle PNG at (x, y) and re-analyze only the regions it touches."""
+    try:
+        session = canvas_store.get(canvas_id)
+        patch = await decode_canvas(data.image)
+        async with session.lock:
+            dirty = session.apply_patch(data.x, data.y, patch)
+            responses = await session.analyze(dirty, data.dict_of_vars)
+        return canvas_response(canvas_id, responses)
+    except HTTPException:
+        raise
+    except Exception as e:
+        return canvas_error(e)
+
+
+@router.put('/canvas/{canvas_id}/vars')
+async def update_canvas_vars(canvas_id: str, data: VariablesUpdate):
+    """Change variables and re-evaluate only the expressions that depend on them, without re-recognizing."""
+    try:
+        session = canvas_store.get(canvas_id)
+        async with session.lock:
+            responses, recomputed = await session.update_vars(data.dict_of_vars)
+        return canvas_response(canvas_id, responses, recomputed=recomputed)
+    except HTTPException:
+        raise
+    except Exception as e:
+        return canvas_error(e)
+
+
+@router.delete('/canvas/{canvas_id}')
+async def delete_canvas(canvas_id: str):
+    canvas_store.delete(canvas_id)
+    return {"success": True}
+
+
+def enqueue_job(source: PageSource, dict_of_vars: dict, backend: str = None):
+    try:
+        if len(source) == 0:
+            raise HTTPException(status_code=400, detail="The upload has no pages")
+        if len(source) > JOB_MAX_PAGES:
+            raise HTTPException(status_code=413, detail=f"At most {JOB_MAX_PAGES} pages per job")
+        job = job_queue.submit(Job(source, dict_of_vars, backend))
+    except HTTPException:
+        source.close()
+        raise
+    return JSONResponse(status_code=202, content={
+        "job_id": job.id,
+        "status": job.status,
+        "pages": job.pages,
+        "status_url": f"/calculator/jobs/{job.id}",
+    })
+
+
+@router.post('/jobs')
+async def create_job(data: BatchJob):
+    """Queue a batch of canvases (e.g. worksheet pages) and return at once; poll the
+    status URL for per-page results as they finish."""
+    return enqueue_job(PageSource('data_urls', data.images), data.dict_of_vars, data.backend)
+
+
+@router.post('/jobs/raw')
+async def create_raw_job(request: Request):
+    """Binary variant of /jobs: the body is a PDF, a (multi-page) TIFF or a single image.
+    Variables and backend are passed as for /process/raw."""
+    dict_of_vars = vars_from_request(request)
+    data = await read_body(request, JOB_UPLOAD_MAX_BYTES)
+    kind = detect_kind(data)
+    try:
+        # Parsed once here; the job's workers render pages from the open document
+        source = await run_image_work(PageSource, kind, data)
+    except UnsupportedDocument as e:
+        raise HTTPException(status_code=415, detail=str(e))
+    except Exception:
+        raise HTTPException(status_code=415, detail="Upload a PDF, TIFF or image file")
+    return enqueue_job(source, dict_of_vars, request.query_params.get('backend'))
+
+
+@router.get('/jobs/{job_id}')
+async def job_status(job_id: str, since: int = 0):
+    """Job progress plus the results of finished pages; `since` skips pages already collected."""
+    return job_queue.get(job_id).summary(since)
+
+
+@router.delete('/jobs/{job_id}')
+async def cancel_job(job_id: str):
+    job_queue.cancel(job_id)
+    return {"success": True}
+
+
+@router.get('/cache/stats')
+async def cache_stats():
+    return {**result_cache.stats(), "analysis": analysis_limiter.stats(), "coalescing": single_flight.stats(),
+            "batching": batching_stats(), "model": model_client.stats(), "jobs": job_queue.stats(),
+            "near_duplicates": {**near_duplicates.stats(), **match_verifier.stats()}}
+
+
+@registry.collector
+def calculator_metrics():
+    """Expose the calculator's own statistics on /metrics."""
+    cache = result_cache.stats()
+    yield "drawcal_cache_hits_total", "counter", "Result cache hits by tier", {"tier": "memory"}, cache["hits"]
+    yield "drawcal_cache_hits_total", "counter", "Result cache hits by tier", {"tier": "redis"}, cache["redis_hits"]
+    yield "drawcal_cache_misses_total", "counter", "Result cache misses", {}, cache["misses"]
+    yield "drawcal_cache_entries", "gauge", "Entries in the in-memory result cache", {}, cache["entries"]
+    analysis = analysis_limiter.stats()
+    yield "drawcal_analyses_in_flight", "gauge", "Analyses holding a limiter slot", {}, analysis["in_flight"]
+    yield "drawcal_analyses_rejected_total", "counter", "Analyses refused with 429", {}, analysis["rejected"]
+    coalescing = single_flight.stats()
+    yield "drawcal_coalesced_calls_total", "counter", "Model calls saved by sharing an identical in-flight analysis", {}, coalescing["saved_calls"]
+    for backend, stats in batching_stats().items():
+        yield "drawcal_batch_calls_total", "counter", "Model calls made by the micro-batcher", {"backend": backend}, stats["calls"]
+        yield "drawcal_batched_images_total", "counter", "Images sent in multi-image model calls", {"backend": backend}, stats["batched_images"]
+        yield "drawcal_batch_fallbacks_total", "counter", "Batched images retried alone", {"backend": backend}, stats["fallbacks"]
+    yield "drawcal_canvas_sessions", "gauge", "Server-held canvases", {}, len(canvas_store)
@@ -0,0 +1,81 @@
+import numpy as np
+from PIL import Image
+from apps.calculator.preprocess import (
+    decode_data_url, open_image, to_gray_array, estimate_background, ink_mask, find_ink_bbox, render_crop,
+)
+from constants import (
+    PREPROCESS_MODE, PREPROCESS_MARGIN, SEGMENT_REGIONS, SEGMENT_ROW_GAP, SEGMENT_COL_GAP,
+    SEGMENT_MIN_INK, SEGMENT_MAX_REGIONS,
+)
+
+
+def split_runs(profile: np.ndarray, min_gap: int):
+    """Split a 1-D ink profile into (start, end) runs separated by at least min_gap empty cells."""
+    ink = np.flatnonzero(profile)
+    if ink.size == 0:
+        return []
+    breaks = np.flatnonzero(np.diff(ink) > min_gap)
+    starts = np.concatenate(([ink[0]], ink[breaks + 1]))
+    ends = np.concatenate((ink[breaks], [ink[-1]])) + 1
+    return list(zip(starts.tolist(), ends.tolist()))
+
+
+def find_regions(mask: np.ndarray, row_gap: int = SEGMENT_ROW_GAP, col_gap: int = SEGMENT_COL_GAP,
+                 min_ink: int = SEGMENT_MIN_INK):
+    """XY-cut of the ink mask: lines first, then expressions within a line.
+
+    Returns tight (left, top, right, bottom) boxes ordered top-to-bottom,
+    left-to-right, which is the order the model used to list expressions in.
+    """
+    regions = []
+    for top, bottom in split_runs(mask.any(axis=1), row_gap):
+        band = mask[top:bottom]
+        for left, right in split_runs(band.any(axis=0), col_gap):
+            block = band[:, left:right]
+            if np.count_nonzero(block) < min_ink:
+                continue
+            rows = np.flatnonzero(block.any(axis=1))
+            regions.append((left, top + int(rows[0]), right, top + int(rows[-1]) + 1))
+    return regions
+
+
+def region_boxes(mask: np.ndarray, margin: int = PREPROCESS_MARGIN):
+    """Padded region boxes for a canvas mask.
+
+    Falls back to a single region covering all ink when segmentation is disabled,
+    the canvas is empty, or it fragments into more regions than are worth separate
+    model calls.
+    """
+    height, width = mask.shape
+    regions = find_regions(mask) if SEGMENT_REGIONS and PREPROCESS_MODE != 'off' else []
+    if not regions or len(regions) > SEGMENT_MAX_REGIONS:
+        regions = [find_ink_bbox(mask) or (0, 0, width, height)]
+    return [
+        (max(left - margin, 0), max(top - margin, 0), min(right + margin, width), min(bottom + margin, height))
+        for left, top, right, bottom in regions
+    ]
+
+
+def prepare_region(gray: np.ndarray, mask: np.ndarray, background: int, box) -> Image.Image:
+    left, top, right, bottom = box
+    return render_crop(gray[top:bottom, left:right], mask[top:bottom, left:right], background)
+
+
+def segment_image(img: Image.Image):
+    """Split the canvas into [(bbox, prepared image)] regions."""
+    gray = to_gray_array(img)
+    background = estimate_background(gray)
+    mask = ink_mask(gray, background)
+    boxes = region_boxes(mask)
+    if PREPROCESS_MODE == 'off':
+        return [(list(box), img.crop(box)) for box in boxes]
+    return [(list(box), prepare_region(gray, mask, background, box)) for box in boxes]
+
+
+def decode_and_segment(image_bytes):
+    """Decode an uploaded PNG (bytes or bytearray) and segment it; top-level so it can run in a worker process."""
+    return segment_image(open_image(image_bytes))
+
+
+def decode_data_url_and_segment(data_url: str):
+    return decode_and_segment(decode_data_url(data_url))
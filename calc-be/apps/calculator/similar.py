@@ -0,0 +1,209 @@
+import asyncio
+import random
+import time
+import uuid
+from collections import OrderedDict
+from threading import Lock
+import numpy as np
+from PIL import Image
+from constants import (
+    PERCEPTUAL_THRESHOLD, PERCEPTUAL_MAX_BLOCK_DIFF, PERCEPTUAL_MAX_ENTRIES, PERCEPTUAL_VERIFY_RATE, CACHE_TTL_SECONDS,
+)
+from apps.calculator.utils import is_cacheable
+from metrics import registry
+
+HASH_SIDE = 64  # canvas side the DCT is taken over
+HASH_FREQS = 16  # lowest frequencies kept per axis: a 256-bit hash
+HASH_BITS = HASH_FREQS * HASH_FREQS
+GUARD_BLOCK = 8
+
+_dct = np.cos(np.pi * np.outer(np.arange(HASH_SIDE), 2 * np.arange(HASH_SIDE) + 1) / (2 * HASH_SIDE))
+
+
+def thumbnail(img: Image.Image) -> np.ndarray:
+    """Pad a prepared image (dark ink on white, cropped to its ink) to a square
+    and shrink it to HASH_SIDE², so position and canvas size drop out."""
+    gray = img.convert('L')
+    width, height = gray.size
+    side = max(width, height)
+    square = Image.new('L', (side, side), 255)
+    square.paste(gray, ((side - width) // 2, (side - height) // 2))
+    return np.asarray(square.resize((HASH_SIDE, HASH_SIDE), Image.BOX), dtype=np.uint8)
+
+
+def perceptual_hash(thumb: np.ndarray) -> int:
+    """pHash: one bit per low DCT frequency, set when it is above their median."""
+    low = (_dct @ thumb.astype(np.float64) @ _dct.T)[:HASH_FREQS, :HASH_FREQS].ravel()
+    bits = low > np.median(low[1:])
+    return int.from_bytes(np.packbits(bits).tobytes(), 'big')
+
+
+def block_diff(a: np.ndarray, b: np.ndarray) -> float:
+    """Largest mean pixel difference over GUARD_BLOCK² blocks of two thumbnails."""
+    blocks = HASH_SIDE // GUARD_BLOCK
+    diff = np.abs(a.astype(np.int16) - b.astype(np.int16))
+    return float(diff.reshape(blocks, GUARD_BLOCK, blocks, GUARD_BLOCK).mean(axis=(1, 3)).max())
+
+
+class NearDuplicateIndex:
+    """Bounded LRU + TTL index of recognized images, searched by Hamming distance.
+
+    Multi-index hashing: each hash is cut into threshold + 1 chunks and
+    every chunk is indexed exactly, so by pigeonhole anything within
+    `threshold` bits shares at least one chunk with the probe. Candidates
+    must then also pass block_diff, because a one-digit edit moves a
+    whole-image hash less than a harmless re-encode does; it is the local
+    check that tells "2+3" from "2+8". Entries are grouped by `scope`
+    (backend and variables), and only entries in the same scope match.
+    """
+
+    def __init__(self, threshold: int = PERCEPTUAL_THRESHOLD, max_block_diff: float = PERCEPTUAL_MAX_BLOCK_DIFF,
+                 max_entries: int = PERCEPTUAL_MAX_ENTRIES, ttl: int = CACHE_TTL_SECONDS):
+        self.threshold = threshold
+        self.max_block_diff = max_block_diff
+        self.max_entries = max_entries
+        self.ttl = ttl
+        # threshold + 1 chunks covering exactly HASH_BITS: the first ones get one bit more
+        width, extra = divmod(HASH_BITS, threshold + 1)
+        widths = [width + (i < extra) for i in range(threshold + 1)]
+        self._chunks = [(sum(widths[:i]), (1 << w) - 1) for i, w in enumerate(widths)]
+        self._entries = OrderedDict()
+        self._buckets = {}
+        self._lock = Lock()
+        self.hits = 0
+        self.misses = 0
+        self.rejected = 0
+
+    def _keys(self, scope: str, phash: int):
+        return [(scope, i, (phash >> shift) & mask) for i, (shift, mask) in enumerate(self._chunks)]
+
+    def lookup(self, scope: str, thumb: np.ndarray):
+        """Responses of the closest indexed image within both thresholds, or None."""
+        phash = perceptual_hash(thumb)
+        now = time.monotonic()
+        best = None
+        with self._lock:
+            candidates = set()
+            for key in self._keys(scope, phash):
+                candidates |= self._buckets.get(key, set())
+            for entry_id in candidates:
+                expires_at, entry_hash, entry_thumb, responses, _ = self._entries[entry_id]
+                if expires_at <= now:
+                    self._remove(entry_id)
+                    continue
+                distance = bin(phash ^ entry_hash).count('1')
+                if distance > self.threshold:
+                    continue
+                if block_diff(thumb, entry_thumb) > self.max_block_diff:
+                    self.rejected += 1
+                    continue
+                if best is None or distance < best[0]:
+                    best = (distance, entry_id, responses)
+            if best is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(best[1])
+            self.hits += 1
+            return best[2]
+
+    def add(self, scope: str, thumb: np.ndarray, responses):
+        phash = perceptual_hash(thumb)
+        entry_id = uuid.uuid4().hex
+        with self._lock:
+            self._entries[entry_id] = (time.monotonic() + self.ttl, phash, thumb, responses, scope)
+            for key in self._keys(scope, phash):
+                self._buckets.setdefault(key, set()).add(entry_id)
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))
+
+    def _remove(self, entry_id: str):
+        _, phash, _, _, scope = self._entries.pop(entry_id)
+        for key in self._keys(scope, phash):
+            bucket = self._buckets.get(key)
+            if bucket is not None:
+                bucket.discard(entry_id)
+                if not bucket:
+                    del self._buckets[key]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._buckets.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "threshold": self.threshold,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else None,
+                "guard_rejections": self.rejected,
+            }
+
+
+class MatchVerifier:
+    """Measures the false-match rate: a sample of near-duplicate hits is also
+    recognized for real in the background, and a hit counts as false when
+    the expressions differ. The real result is cached, so the next exact
+    repeat is served correctly either way."""
+
+    def __init__(self, rate: float = PERCEPTUAL_VERIFY_RATE):
+        self.rate = rate
+        self.verified = 0
+        self.false_matches = 0
+        self.skipped = 0
+        self._tasks = set()
+
+    def maybe_verify(self, reused, recognize):
+        """Check `reused` against await recognize(), for a sample of calls."""
+        if self.rate <= 0 or random.random() >= self.rate:
+            return
+        task = asyncio.get_running_loop().create_task(self._verify(reused, recognize))
+        # Keep a reference until it finishes, or it may be collected mid-flight
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _verify(self, reused, recognize):
+        try:
+            actual = await recognize()
+        except Exception:
+            # Typically a 429 from the limiter: interactive requests come first
+            self.skipped += 1
+            return
+        if not is_cacheable(actual):
+            self.skipped += 1
+            return
+        self.verified += 1
+        if expressions(actual) != expressions(reused):
+            self.false_matches += 1
+
+    def stats(self) -> dict:
+        return {
+            "verify_rate": self.rate,
+            "verified": self.verified,
+            "false_matches": self.false_matches,
+            "false_match_rate": round(self.false_matches / self.verified, 4) if self.verified else None,
+            "skipped": self.skipped,
+        }
+
+
+def expressions(responses) -> list:
+    return sorted(''.join(str(row.get('expr', '')).split()) for row in responses)
+
+
+near_duplicates = NearDuplicateIndex()
+match_verifier = MatchVerifier()
+
+
+@registry.collector
+def near_duplicate_metrics():
+    index, verifier = near_duplicates.stats(), match_verifier.stats()
+    yield "drawcal_near_duplicate_hits_total", "counter", "Results reused from a perceptually similar image", {}, index["hits"]
+    yield "drawcal_near_duplicate_misses_total", "counter", "Near-duplicate lookups without a match", {}, index["misses"]
+    yield "drawcal_near_duplicate_guard_rejections_total", "counter", "Hash matches refused by the local pixel check", {}, index["guard_rejections"]
+    yield "drawcal_near_duplicate_entries", "gauge", "Images in the near-duplicate index", {}, index["entries"]
+    yield "drawcal_near_duplicate_verified_total", "counter", "Near-duplicate hits checked against a real recognition", {}, verifier["verified"]
+    yield "drawcal_near_duplicate_false_matches_total", "counter", "Checked near-duplicate hits whose expressions differed", {}, verifier["false_matches"]
@@ -0,0 +1,48 @@
+import asyncio
+
+
+class SingleFlight:
+    """Coalesce concurrent identical work onto one shared in-flight task.
+
+    The first caller for a key starts the work; callers arriving while it runs
+    await the same task instead of repeating it. The task is shielded, so a
+    caller that disconnects doesn't cancel the result the others are waiting on.
+    The key is forgotten as soon as the work finishes; caching results is left to
+    the caller.
+    """
+
+    def __init__(self):
+        self._tasks = {}
+        self.started = 0
+        self.coalesced = 0
+
+    def pending(self, key: str) -> bool:
+        return key in self._tasks
+
+    async def do(self, key: str, work):
+        """Await work() for key, sharing the call with any identical one in flight.
+
+        `work` is a zero-argument callable returning a coroutine; it is only
+        called when no task for the key is running.
+        """
+        task = self._tasks.get(key)
+        if task is None:
+            task = asyncio.ensure_future(work())
+            self._tasks[key] = task
+            task.add_done_callback(lambda t: self._finish(key, t))
+            self.started += 1
+        else:
+            self.coalesced += 1
+        return await asyncio.shield(task)
+
+    def _finish(self, key: str, task: asyncio.Future):
+        self._tasks.pop(key, None)
+        # Mark the error as retrieved in case every caller went away before it finished
+        if not task.cancelled():
+            task.exception()
+
+    def stats(self) -> dict:
+        return {"in_flight": len(self._tasks), "started": self.started, "saved_calls": self.coalesced}
+
+
+single_flight = SingleFlight()
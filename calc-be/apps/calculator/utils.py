@@ -1,58 +1,56 @@
-import google.generativeai as genai
 import json
-import re
+from threading import Lock
 from PIL import Image
-import io
-from constants import GEMINI_API_KEY
+from constants import GEMINI_API_KEY, GEMINI_API_ENDPOINT, RECOGNITION_MODE, STRUCTURED_OUTPUT
+from apps.calculator.preprocess import encode_png
+from apps.calculator.parser import ObjectStreamParser, parse_answers
+from apps.calculator.resilience import CircuitOpen, model_client
+from metrics import errors_total, parse_fallbacks_total, span, verbose
 
-genai.configure(api_key=GEMINI_API_KEY)
-model = genai.GenerativeModel(model_name="gemini-1.5-flash")
+# The Gemini SDK takes longer to import than the rest of the app together, so
+# the model client is created on the first call rather than at startup
+model = None
+_model_lock = Lock()
 
-def clean_json_string(s):
-    print("Original response:", s)
-    
-    # If the response is empty or None, return a default response
-    if not s:
-        return '[{"expr": "No response", "result": "Please try again", "assign": false}]'
-    
-    # First, try to extract content from markdown code blocks if present
-    code_block_match = re.search(r'```(?:json)?\s*([\s\S]*?)\s*```', s)
-    if code_block_match:
-        s = code_block_match.group(1)
-    
-    # Remove any remaining markdown formatting
-    s = re.sub(r'```\w*', '', s)
-    
-    # Remove any leading/trailing whitespace
-    s = s.strip()
-    
-    # If the string is empty after cleaning, return a default response
-    if not s:
-        return '[{"expr": "Empty response", "result": "Please try again", "assign": false}]'
-    
-    # If the string doesn't start with [ or {, wrap it in []
-    if not s.startswith('[') and not s.startswith('{'):
-        s = f'[{s}]'
-    
-    # Replace single quotes with double quotes for JSON compatibility
-    s = re.sub(r"'([^']*)'", r'"\1"', s)
-    
-    # Ensure all keys are quoted
-    s = re.sub(r'(\w+):', r'"\1":', s)
-    
-    # Remove any Python-specific syntax
-    s = s.replace('True', 'true')
-    s = s.replace('False', 'false')
-    s = s.replace('None', 'null')
-    
-    # Remove any newlines and extra spaces while preserving decimal points
-    s = re.sub(r'\s+', ' ', s)
-    
-    # Remove any remaining non-JSON text while preserving mathematical operators and decimal points
-    s = re.sub(r'[^\[\]\{\}\"\'\w\s:,+\-*/=().]', '', s)
-    
-    print("Cleaned string:", s)
-    return s
+def get_model():
+    global model
+    with _model_lock:
+        if model is None:
+            import google.generativeai as genai
+            if GEMINI_API_ENDPOINT:
+                genai.configure(api_key=GEMINI_API_KEY, transport='rest', client_options={'api_endpoint': GEMINI_API_ENDPOINT})
+            else:
+                genai.configure(api_key=GEMINI_API_KEY)
+            model = genai.GenerativeModel(model_name="gemini-1.5-flash")
+    return model
+
+def generate(content_parts, config, stream: bool = False):
+    """generate_content under the model client's deadline, retries and circuit breaker.
+    Returns the response text, or the chunk iterator when streaming."""
+    if stream:
+        return model_client.call_stream(lambda timeout: get_model().generate_content(
+            content_parts, generation_config=config, stream=True, request_options={'timeout': timeout}))
+    return model_client.call(lambda timeout: get_model().generate_content(
+        content_parts, generation_config=config, request_options={'timeout': timeout}).text)
+
+# Placeholder expressions returned when analysis fails; these must never be cached
+ERROR_EXPRS = {
+    "No response",
+    "Empty response",
+    "Invalid response format",
+    "No valid results found",
+    "Error parsing response",
+    "Error in API call",
+    "Model unavailable",
+    "Unrecognized",
+}
+
+def is_error_response(responses: list) -> bool:
+    return any(r.get('expr') in ERROR_EXPRS for r in responses)
+
+def is_cacheable(responses: list) -> bool:
+    # Fallback rows stand in for the model only while its breaker is open
+    return not is_error_response(responses) and not any(r.get('fallback') for r in responses)
 
 def format_result(result_str: str) -> str:
     """Format the result string to ensure proper decimal point handling."""
@@ -85,9 +83,21 @@ def format_result(result_str: str) -> str:
     except ValueError:
         return result_str
 
-def analyze_image(img: Image, dict_of_vars: dict):
-    dict_of_vars_str = json.dumps(dict_of_vars, ensure_ascii=False)
-    
+TRANSCRIBE_PROMPT = "\n".join([
+    "Transcribe every handwritten mathematical expression in the image.",
+    "Return ONLY a JSON array of objects with double-quoted keys 'expr' and 'assign'.",
+    "Copy digits, decimal points, operators and variable names exactly as written; do not compute anything.",
+    "Set assign to true for variable assignments like x = 5.",
+    "If an expression is not plain arithmetic (e.g. an equation to solve), also include its answer as 'result'.",
+    'Example: [{"expr": "44.55 + 55.33", "assign": false}, {"expr": "x = 5", "assign": true}]',
+])
+
+def build_prompt(dict_of_vars: dict) -> str:
+    if RECOGNITION_MODE == 'transcribe':
+        return TRANSCRIBE_PROMPT
+    return solve_prompt(json.dumps(dict_of_vars, ensure_ascii=False))
+
+def solve_prompt(dict_of_vars_str: str) -> str:
     # Create a structured prompt with clear instructions
     prompt = [
         "You are a mathematical expression analyzer that handles all types of calculations including decimal and non-decimal numbers. Your task is to analyze the provided image and return a JSON response.",
@@ -134,96 +144,217 @@ def analyze_image(img: Image, dict_of_vars: dict):
         "",
         "Now analyze the image, being careful to handle both decimal and non-decimal numbers appropriately, and return your response in the exact format shown above."
     ]
+    return "\n".join(prompt)
+
+# With structured output the response schema fixes the format, so the prompt
+# only describes the task. Both are built once here and sent unchanged.
+def response_schema(batched: bool = False) -> dict:
+    properties = {"expr": {"type": "STRING"}, "result": {"type": "STRING"}, "assign": {"type": "BOOLEAN"}}
+    required = ["expr", "assign"] if RECOGNITION_MODE == 'transcribe' else ["expr", "result", "assign"]
+    if batched:
+        properties["image"] = {"type": "INTEGER"}
+        required.append("image")
+    return {"type": "ARRAY", "items": {"type": "OBJECT", "properties": properties, "required": required}}
+
+if RECOGNITION_MODE == 'transcribe':
+    STRUCTURED_PROMPT = "\n".join([
+        "Transcribe every handwritten mathematical expression in the image, one item each.",
+        "Copy digits, decimal points, operators and variable names exactly as written; do not compute anything.",
+        "assign is true for variable assignments like x = 5.",
+        "Give result only for expressions that are not plain arithmetic, such as equations to solve.",
+    ])
+else:
+    STRUCTURED_PROMPT = "\n".join([
+        "Evaluate every handwritten mathematical expression in the image, one item each.",
+        "Copy numbers exactly as written, keeping every decimal point (44.55 is not 4455).",
+        "result: whole numbers without decimals; otherwise at least 3 decimal places, up to 6 for division.",
+        "assign is true for variable assignments like x = 5, with the assigned value as result.",
+        "Use the variables given with the image.",
+    ])
+
+GENERATION_CONFIG = {"response_mime_type": "application/json", "response_schema": response_schema()}
+BATCH_GENERATION_CONFIG = {"response_mime_type": "application/json", "response_schema": response_schema(batched=True)}
+
+def generation_config(batched: bool = False):
+    if not STRUCTURED_OUTPUT:
+        return None
+    return BATCH_GENERATION_CONFIG if batched else GENERATION_CONFIG
+
+def build_content_parts(img: Image, dict_of_vars: dict):
+    # Convert the (already cropped and downscaled) PIL Image to bytes
+    img_byte_arr = encode_png(img)
     
-    try:
-        # Convert PIL Image to bytes
-        img_byte_arr = io.BytesIO()
-        img.save(img_byte_arr, format='PNG')
-        img_byte_arr = img_byte_arr.getvalue()
-        
-        # Create the content parts with emphasis on decimal handling
-        content_parts = [
-            {
-                "text": "\n".join(prompt)
-            },
-            {
-                "inline_data": {
-                    "mime_type": "image/png",
-                    "data": img_byte_arr
-                }
+    if STRUCTURED_OUTPUT:
+        parts = [{"text": STRUCTURED_PROMPT}]
+        if dict_of_vars and RECOGNITION_MODE != 'transcribe':
+            parts.append({"text": "Variables: " + json.dumps(dict_of_vars, ensure_ascii=False)})
+        parts.append({"inline_data": {"mime_type": "image/png", "data": img_byte_arr}})
+        return parts
+    
+    # Create the content parts with emphasis on decimal handling
+    return [
+        {
+            "text": build_prompt(dict_of_vars)
+        },
+        {
+            "inline_data": {
+                "mime_type": "image/png",
+                "data": img_byte_arr
             }
-        ]
+        }
+    ]
+
+BATCH_HEADER = "\n".join([
+    "You are given {count} separate images, numbered in the order they appear (Image 1 to Image {count}).",
+    "Analyze each image on its own, following the rules below.",
+    "Return ONE JSON array with the objects for all images, and add an integer key 'image' to every object",
+    "giving the number of the image it came from.",
+    "",
+])
+
+def build_batch_parts(items: list):
+    """Content parts for one call covering several (image, dict_of_vars) items."""
+    if STRUCTURED_OUTPUT:
+        rules = STRUCTURED_PROMPT
+    elif RECOGNITION_MODE == 'transcribe':
+        rules = TRANSCRIBE_PROMPT
+    else:
+        rules = solve_prompt("the variables listed for each image below")
+    parts = [{"text": BATCH_HEADER.format(count=len(items)) + rules}]
+    for number, (img, dict_of_vars) in enumerate(items, start=1):
+        parts.append({"text": f"Image {number} variables: {json.dumps(dict_of_vars, ensure_ascii=False)}"})
+        parts.append({"inline_data": {"mime_type": "image/png", "data": encode_png(img)}})
+    return parts
+
+def analyze_images(items: list) -> list:
+    """Analyze several (image, dict_of_vars) items in a single model call.
+
+    Returns one list of rows per item, or None for items the response couldn't
+    be attributed to (missing or unparseable), which the caller retries alone.
+    If the call itself fails every item gets the usual error row.
+    """
+    try:
+        parts = build_batch_parts(items)
+        with span('model'):
+            text = generate(parts, generation_config(batched=True))
+    except CircuitOpen:
+        raise
+    except Exception as e:
+        # The API itself failed; retrying each image alone would just repeat the failure
+        errors_total.inc(stage='model')
+        print(f"Error in batched Gemini API call: {e}")
+        return [[{"expr": "Error in API call", "result": str(e), "assign": False}] for _ in items]
+
+    results = [[] for _ in items]
+    answers = read_answers(text)
+    with span('format'):
+        for answer in answers:
+            try:
+                number = int(answer.get('image'))
+            except (TypeError, ValueError):
+                continue
+            if 1 <= number <= len(items) and 'expr' in answer:
+                results[number - 1].append(process_answer(answer))
+    return [rows or None for rows in results]
+
+def read_answers(text: str) -> list:
+    """Objects in a complete response. Schema-constrained output is plain JSON, so
+    it skips the tolerant scan unless the model somehow broke format."""
+    with span('parse'):
+        if STRUCTURED_OUTPUT and text:
+            try:
+                answers = json.loads(text)
+            except json.JSONDecodeError:
+                parse_fallbacks_total.inc(kind='structured')
+                verbose("Structured response was not valid JSON, scanning it instead")
+            else:
+                if isinstance(answers, list):
+                    return [answer for answer in answers if isinstance(answer, dict)]
+        return parse_answers(text)
+
+def process_answer(answer: dict) -> dict:
+    # Get the expression and result
+    expr = str(answer.get('expr', ''))
+    result = str(answer.get('result', ''))
+    
+    # Ensure the expression preserves decimal points
+    if '.' not in expr and any(c.isdigit() for c in expr):
+        # Check if the original expression in the image had decimal points
+        # This is a safeguard in case the model drops them
+        verbose("Warning: Expression is missing decimal points that might have been in the image")
+    
+    # Leniently parsed answers may carry the flag as text
+    assign = answer.get('assign', False)
+    if isinstance(assign, str):
+        assign = assign.strip().lower() == 'true'
+    
+    return {
+        'expr': expr,
+        'result': format_result(result),
+        'assign': bool(assign)
+    }
+
+def analyze_image(img: Image, dict_of_vars: dict):
+    try:
+        content_parts = build_content_parts(img, dict_of_vars)
         
         # Generate content with structured prompt
-        response = model.generate_content(content_parts)
-        print("Raw response from Gemini:", response.text) # CHANGE
+        with span('model'):
+            text = generate(content_parts, generation_config())
+        verbose("Raw response from Gemini:", text)
         
-        if not response.text:
-            print("Empty response received from Gemini") # CHANGE 
+        if not text:
+            errors_total.inc(stage='empty_response')
+            print("Empty response received from Gemini")
             return [{"expr": "Empty response", "result": "Please try again", "assign": False}]
         
-        try:
-            # Clean the response text while preserving decimal points
-            cleaned_text = clean_json_string(response.text)
-            print("Cleaned response text:", cleaned_text)
-            
-            # Try to parse the JSON
-            try:
-                answers = json.loads(cleaned_text)
-                print("Successfully parsed JSON:", answers)
-            except json.JSONDecodeError as e:
-                print(f"Failed to parse JSON: {e}")
-                # Try to extract a valid JSON array from the response
-                match = re.search(r'\[.*\]', cleaned_text)
-                if match:
-                    cleaned_text = match.group(0)
-                    print("Extracted JSON array:", cleaned_text)
-                    answers = json.loads(cleaned_text)
-                else:
-                    # Return a default response if we can't parse the JSON
-                    return [{"expr": "Invalid response format", "result": "Please try again", "assign": False}]
-            
-            # Ensure we have a list
-            if not isinstance(answers, list):
-                answers = [answers]
+        answers = read_answers(text)
+        if not answers:
+            errors_total.inc(stage='parse')
+            return [{"expr": "Invalid response format", "result": "Please try again", "assign": False}]
+        
+        with span('format'):
+            processed_answers = [process_answer(answer) for answer in answers if 'expr' in answer]
+        if not processed_answers:
+            return [{"expr": "No valid results found", "result": "Please try again", "assign": False}]
             
-            # Process each answer with careful decimal handling
-            processed_answers = []
-            for answer in answers:
-                if not isinstance(answer, dict):
+        return processed_answers
+        
+    except CircuitOpen:
+        raise
+    except Exception as e:
+        errors_total.inc(stage='model')
+        print(f"Error in Gemini API call: {e}")
+        return [{"expr": "Error in API call", "result": str(e), "assign": False}]
+
+def stream_analyze_image(img: Image, dict_of_vars: dict, on_answer):
+    """Like analyze_image, but streams the generation and calls on_answer(row)
+    as soon as each object in the response is complete. Returns all rows."""
+    try:
+        content_parts = build_content_parts(img, dict_of_vars)
+        parser = ObjectStreamParser()
+        processed_answers = []
+        # Generation, parsing and delivery interleave, so the stream is timed as one stage
+        with span('model_stream'):
+            chunks = (chunk.text for chunk in generate(content_parts, generation_config(), stream=True))
+            for answer in parser.objects(chunks):
+                if 'expr' not in answer:
                     continue
-                
-                # Get the expression and result
-                expr = str(answer.get('expr', ''))
-                result = str(answer.get('result', ''))
-                
-                # Ensure the expression preserves decimal points
-                if '.' not in expr and any(c.isdigit() for c in expr):
-                    # Check if the original expression in the image had decimal points
-                    # This is a safeguard in case the model drops them
-                    print("Warning: Expression is missing decimal points that might have been in the image")
-                
-                processed_answer = {
-                    'expr': expr,
-                    'result': format_result(result),
-                    'assign': bool(answer.get('assign', False))
-                }
+                processed_answer = process_answer(answer)
                 processed_answers.append(processed_answer)
-            
-            if not processed_answers:
-                return [{"expr": "No valid results found", "result": "Please try again", "assign": False}]
-                
-            return processed_answers
-            
-        except json.JSONDecodeError as e:
-            print(f"Error in parsing JSON response: {e}")
-            print("Raw response that failed to parse:", response.text)
-            return [{"expr": "Error parsing response", "result": str(e), "assign": False}]
-        except Exception as e:
-            print(f"Unexpected error in parsing response: {e}")
-            print("Raw response that failed to parse:", response.text)
-            return [{"expr": "Error parsing response", "result": str(e), "assign": False}]
+                on_answer(processed_answer)
         
+        if not processed_answers:
+            error = {"expr": "No valid results found", "result": "Please try again", "assign": False}
+            on_answer(error)
+            return [error]
+        return processed_answers
+    
+    except CircuitOpen:
+        raise
     except Exception as e:
-        print(f"Error in Gemini API call: {e}")
-        return [{"expr": "Error in API call", "result": str(e), "assign": False}]
\ No newline at end of file
+        errors_total.inc(stage='model')
+        print(f"Error in Gemini streaming call: {e}")
+        error = {"expr": "Error in API call", "result": str(e), "assign": False}
+        on_answer(error)
+        return [error]
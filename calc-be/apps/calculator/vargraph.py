@@ -0,0 +1,183 @@
+import re
+from graphlib import TopologicalSorter, CycleError
+from apps.calculator.evaluator import (
+    EvaluationError, NAME_PATTERN, CONSTANTS, parse, references, evaluate_tree, reconcile, normalize_vars, to_number,
+    is_number,
+)
+from metrics import verbose
+
+
+class ExprNode:
+    """One recognized row: what it assigns, what it reads and its latest evaluation."""
+
+    def __init__(self, index: int, row: dict):
+        self.index = index
+        self.row = dict(row)
+        self.model_result = str(row.get('result', ''))
+        self.value = None
+        self.output = dict(row)
+        try:
+            if self.model_result and not is_number(self.model_result):
+                # A symbolic answer ("x = 5", "2x + 3") is not ours to check
+                raise EvaluationError(f"Model result is not a number: {self.model_result!r}")
+            self.target, self.tree = parse(str(row.get('expr', '')))
+            self.refs = references(self.tree)
+        except EvaluationError:
+            # Not arithmetic: keep the model's answer, and its assignment if it made one
+            self.tree = None
+            self.refs = set()
+            name = str(row.get('expr', '')).split('=')[0].strip()
+            self.target = name if row.get('assign') and NAME_PATTERN.match(name) else None
+
+    def mentions(self, names) -> bool:
+        """Whether the raw expression text uses any of the names; used for rows that didn't parse."""
+        expr = str(self.row.get('expr', ''))
+        return any(re.search(rf'\b{re.escape(name)}\b', expr) for name in names)
+
+
+class VariableGraph:
+    """Rows of a canvas as a DAG over the variables they assign and read.
+
+    A reference resolves to the closest assignment above it in reading order,
+    falling back to any assignment on the canvas and then to the client's
+    dict_of_vars. Changing a variable re-evaluates only the rows downstream of
+    it, in topological order, without touching the model.
+    """
+
+    def __init__(self):
+        self.nodes = []
+        self.external = {}
+        self.sources = {}
+        self.order = []
+        self.cyclic = set()
+
+    def load(self, rows: list, dict_of_vars: dict) -> list:
+        self.nodes = [ExprNode(i, row) for i, row in enumerate(rows)]
+        self.external = normalize_vars(dict_of_vars)
+        self._link()
+        self._recompute(self.order)
+        return self.rows()
+
+    def rows(self) -> list:
+        return [node.output for node in self.nodes]
+
+    def _resolve(self, index: int, name: str):
+        definers = [n.index for n in self.nodes if n.target == name and n.index != index]
+        before = [i for i in definers if i < index]
+        if before:
+            return before[-1]
+        return definers[0] if definers else None
+
+    def _link(self):
+        # sources[i][name] is the node index feeding that name to row i, or None for dict_of_vars
+        self.sources = {
+            node.index: {name: self._resolve(node.index, name) for name in node.refs}
+            for node in self.nodes
+        }
+        graph = {
+            index: {src for src in deps.values() if src is not None}
+            for index, deps in self.sources.items()
+        }
+        # Rows on a cycle (x = y + 1, y = x - 1) can't be evaluated; drop them and sort the rest
+        self.cyclic = set()
+        while True:
+            acyclic = {i: deps - self.cyclic for i, deps in graph.items() if i not in self.cyclic}
+            try:
+                self.order = list(TopologicalSorter(acyclic).static_order()) + sorted(self.cyclic)
+                break
+            except CycleError as e:
+                self.cyclic.update(e.args[1])
+
+    def dependents(self, names) -> list:
+        """Rows downstream of the given dict_of_vars names, in evaluation order."""
+        names = set(names)
+        affected = {
+            index for index, deps in self.sources.items()
+            if any(src is None and name in names for name, src in deps.items())
+        }
+        changed = True
+        while changed:
+            changed = False
+            for index, deps in self.sources.items():
+                if index not in affected and any(src in affected for src in deps.values()):
+                    affected.add(index)
+                    changed = True
+        return [i for i in self.order if i in affected]
+
+    def changed_names(self, dict_of_vars: dict) -> set:
+        new_external = normalize_vars(dict_of_vars)
+        return {
+            name for name in set(self.external) | set(new_external)
+            if self.external.get(name) != new_external.get(name)
+        }
+
+    def stale(self, names) -> list:
+        """Rows that couldn't be evaluated locally but mention one of the names.
+
+        Their result came from the model and may depend on those variables, so
+        only re-recognition can refresh them.
+        """
+        if not names:
+            return []
+        return [node for node in self.nodes if node.tree is None and node.mentions(names)]
+
+    def update(self, dict_of_vars: dict):
+        """Apply new client variables and re-evaluate only what depends on them.
+
+        Returns (rows, number of rows recomputed).
+        """
+        changed = self.changed_names(dict_of_vars)
+        self.external = normalize_vars(dict_of_vars)
+        affected = self.dependents(changed)
+        # The model's results were computed against the old values, so don't flag corrections
+        self._recompute(affected, check_model=False)
+        return self.rows(), len(affected)
+
+    def _value_of(self, index: int, name: str):
+        src = self.sources[index][name]
+        if src is None:
+            if name in self.external:
+                return self.external[name]
+            if name in CONSTANTS:
+                return CONSTANTS[name]
+            raise EvaluationError(f"Unknown variable: {name}")
+        value = self.nodes[src].value
+        if value is None:
+            raise EvaluationError(f"Variable {name} has no value")
+        return value
+
+    def _recompute(self, indices, check_model: bool = True):
+        for index in indices:
+            node = self.nodes[index]
+            output = dict(node.row)
+            node.value = None
+            if node.tree is None or index in self.cyclic:
+                output['verified'] = False
+                if node.target is not None:
+                    try:
+                        node.value = to_number(node.model_result)
+                    except EvaluationError:
+                        pass
+                node.output = output
+                continue
+            try:
+                scope = {name: self._value_of(index, name) for name in node.refs}
+                result, node.value = evaluate_tree(node.tree, scope)
+            except EvaluationError:
+                output['verified'] = False
+                node.output = output
+                continue
+            if check_model and node.model_result:
+                result, agrees = reconcile(result, node.value, node.model_result)
+                if not agrees:
+                    verbose(f"Correcting model result for {node.row.get('expr')!r}: {node.model_result!r} -> {result!r}")
+                    output['corrected'] = True
+            output['result'] = result
+            output['assign'] = node.target is not None
+            output['verified'] = True
+            node.output = output
+
+
+def evaluate_rows(rows: list, dict_of_vars: dict) -> list:
+    """One-shot evaluation of a response's rows against the client's variables."""
+    return VariableGraph().load(rows, dict_of_vars)
@@ -0,0 +1,39 @@
+import os
+
+MONGODB_URL = os.getenv("MONGODB_URL", "mongodb://localhost:27017")
+DATABASE_NAME = "Drawcal"
+
+_client = None
+
+
+def get_client():
+    """The shared motor client, created (and motor imported) on first use."""
+    global _client
+    if _client is None:
+        from motor.motor_asyncio import AsyncIOMotorClient
+        _client = AsyncIOMotorClient(MONGODB_URL)
+    return _client
+
+
+def close_client():
+    global _client
+    if _client is not None:
+        _client.close()
+        _client = None
+
+
+class LazyCollection:
+    """Stands in for a motor collection until it is first used.
+
+    Importing motor and pymongo costs more than the rest of the auth module, and
+    most cold starts serve a calculation before anyone logs in.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self._collection = None
+
+    def __getattr__(self, attr):
+        if self._collection is None:
+            self._collection = get_client()[DATABASE_NAME][self.name]
+        return getattr(self._collection, attr)
@@ -0,0 +1,111 @@
+import asyncio
+import os
+import time
+from urllib.parse import urlencode
+
+GOOGLE_DISCOVERY_URL = os.getenv("GOOGLE_DISCOVERY_URL", "https://accounts.google.com/.well-known/openid-configuration")
+# Explicit endpoints win over the discovery document (e.g. to point at a local stub OAuth server)
+GOOGLE_AUTH_URI = os.getenv("GOOGLE_AUTH_URI")
+GOOGLE_TOKEN_URI = os.getenv("GOOGLE_TOKEN_URI")
+GOOGLE_USERINFO_URI = os.getenv("GOOGLE_USERINFO_URI")
+DISCOVERY_TTL_SECONDS = int(os.getenv("GOOGLE_DISCOVERY_TTL", "86400"))
+OAUTH_HTTP_TIMEOUT = float(os.getenv("OAUTH_HTTP_TIMEOUT", "10"))
+
+SCOPES = ["openid", "https://www.googleapis.com/auth/userinfo.email", "https://www.googleapis.com/auth/userinfo.profile"]
+
+
+class OAuthError(Exception):
+    pass
+
+
+class GoogleOAuth:
+    """Authorization-code flow against Google over one pooled async HTTP client.
+
+    Nothing per-login is stored on the instance: each login carries its own
+    state through the redirect, so concurrent logins can't interfere. The
+    discovery document is fetched once and reused for DISCOVERY_TTL_SECONDS.
+    """
+
+    def __init__(self, client_id: str, client_secret: str, redirect_uri: str):
+        self.client_id = client_id
+        self.client_secret = client_secret
+        self.redirect_uri = redirect_uri
+        self._http = None
+        self._endpoints = None
+        self._endpoints_expire = 0.0
+        self._discovery_lock = None
+
+    @property
+    def http(self):
+        # Created on first use so it binds to the server's event loop (and httpx
+        # is only imported once someone logs in with Google)
+        if self._http is None or self._http.is_closed:
+            import httpx
+            self._http = httpx.AsyncClient(
+                timeout=OAUTH_HTTP_TIMEOUT,
+                limits=httpx.Limits(max_connections=32, max_keepalive_connections=8),
+            )
+        return self._http
+
+    async def endpoints(self) -> dict:
+        if GOOGLE_AUTH_URI and GOOGLE_TOKEN_URI and GOOGLE_USERINFO_URI:
+            return {
+                "authorization_endpoint": GOOGLE_AUTH_URI,
+                "token_endpoint": GOOGLE_TOKEN_URI,
+                "userinfo_endpoint": GOOGLE_USERINFO_URI,
+            }
+        if self._endpoints is not None and time.monotonic() < self._endpoints_expire:
+            return self._endpoints
+        if self._discovery_lock is None:
+            self._discovery_lock = asyncio.Lock()
+        # Logins arriving while the document is fetched wait for that fetch instead of repeating it
+        async with self._discovery_lock:
+            if self._endpoints is None or time.monotonic() >= self._endpoints_expire:
+                response = await self.http.get(GOOGLE_DISCOVERY_URL)
+                response.raise_for_status()
+                document = response.json()
+                self._endpoints = {
+                    "authorization_endpoint": GOOGLE_AUTH_URI or document["authorization_endpoint"],
+                    "token_endpoint": GOOGLE_TOKEN_URI or document["token_endpoint"],
+                    "userinfo_endpoint": GOOGLE_USERINFO_URI or document["userinfo_endpoint"],
+                }
+                self._endpoints_expire = time.monotonic() + DISCOVERY_TTL_SECONDS
+        return self._endpoints
+
+    async def authorization_url(self, state: str) -> str:
+        params = {
+            "client_id": self.client_id,
+            "redirect_uri": self.redirect_uri,
+            "response_type": "code",
+            "scope": " ".join(SCOPES),
+            "state": state,
+            "access_type": "offline",
+            "include_granted_scopes": "true",
+            "prompt": "consent",
+        }
+        return f"{(await self.endpoints())['authorization_endpoint']}?{urlencode(params)}"
+
+    async def exchange_code(self, code: str) -> dict:
+        response = await self.http.post((await self.endpoints())["token_endpoint"], data={
+            "code": code,
+            "client_id": self.client_id,
+            "client_secret": self.client_secret,
+            "redirect_uri": self.redirect_uri,
+            "grant_type": "authorization_code",
+        })
+        if response.status_code != 200:
+            raise OAuthError(f"Token exchange failed ({response.status_code}): {response.text}")
+        return response.json()
+
+    async def userinfo(self, access_token: str) -> dict:
+        response = await self.http.get(
+            (await self.endpoints())["userinfo_endpoint"],
+            headers={"Authorization": f"Bearer {access_token}"},
+        )
+        if response.status_code != 200:
+            raise OAuthError(f"Userinfo request failed ({response.status_code}): {response.text}")
+        return response.json()
+
+    async def close(self):
+        if self._http is not None:
+            await self._http.aclose()
@@ -0,0 +1,68 @@
+from datetime import datetime
+
+ASCENDING = 1
+
+# Indexes backing every query in auth/router.py, as (keys, options). Names are
+# fixed so re-running the bootstrap is a no-op rather than a conflict. They are
+# plain data so importing this module doesn't import pymongo.
+USER_INDEXES = [
+    ([("email", ASCENDING)], {"name": "email_unique", "unique": True}),
+]
+SESSION_INDEXES = [
+    # verify, session/check and logout look a session up by its token hash
+    ([("token_hash", ASCENDING)], {"name": "token_hash_unique", "unique": True, "sparse": True}),
+    # login keeps the newest MAX_ACTIVE_SESSIONS per user
+    ([("user_id", ASCENDING), ("created_at", ASCENDING)], {"name": "user_created"}),
+    # Sessions stored with the raw token before hashing; can be dropped once they have all expired
+    ([("token", ASCENDING)], {"name": "legacy_token", "sparse": True}),
+    # MongoDB's TTL monitor deletes sessions once expires_at has passed
+    ([("expires_at", ASCENDING)], {"name": "expires_at_ttl", "expireAfterSeconds": 0}),
+]
+
+# Indexes earlier versions created, which nothing queries any more
+RETIRED_INDEXES = {
+    "sessions": ["user_active_expiry", "user_token"],
+}
+
+
+def index_models(specs: list) -> list:
+    from pymongo import IndexModel
+    return [IndexModel(keys, **options) for keys, options in specs]
+
+
+def query_shapes(user_id: str = "audit@example.com", token: str = "audit-token", hashed: str = "audit-hash") -> list:
+    """(collection name, operation, filter, sort) for each query the auth router
+    sends, for explain() audits. tests/test_indexes.py checks this list against
+    the calls in auth/router.py, so a new query can't go unaudited."""
+    now = datetime.utcnow()
+    return [
+        # find_session, by the token's hash, then by a raw token stored before hashing
+        ("sessions", "find_one", {"token_hash": hashed, "expires_at": {"$gt": now}}, None),
+        ("sessions", "find_one", {"token": token, "is_active": True, "expires_at": {"$gt": now}}, None),
+        ("sessions", "update_one", {"_id": "audit-id"}, None),
+        # start_session's cap on live sessions per user
+        ("sessions", "find", {"user_id": user_id}, [("created_at", -1)]),
+        ("sessions", "delete_many", {"_id": {"$in": ["audit-id", "audit-id-2"]}}, None),
+        # logout
+        ("sessions", "delete_one", {"token_hash": hashed}, None),
+        ("sessions", "delete_one", {"token": token}, None),
+        # login upsert, the last-login writer and every user lookup
+        ("users", "update_one", {"email": user_id}, None),
+        ("users", "find_one", {"email": user_id}, None),
+    ]
+
+
+async def ensure_indexes(users_collection, sessions_collection):
+    """Create the auth indexes if missing and drop retired ones. Failures are
+    logged, not raised, so a duplicate email or a read-only user doesn't stop
+    the API from serving."""
+    from pymongo.errors import PyMongoError
+    for collection, indexes in ((users_collection, USER_INDEXES), (sessions_collection, SESSION_INDEXES)):
+        try:
+            await collection.create_indexes(index_models(indexes))
+            existing = await collection.index_information()
+            for name in RETIRED_INDEXES.get(collection.name, ()):
+                if name in existing:
+                    await collection.drop_index(name)
+        except PyMongoError as e:
+            print(f"Could not ensure indexes on {collection.name}: {e}")
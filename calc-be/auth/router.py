@@ -1,29 +1,35 @@
 from fastapi import APIRouter, HTTPException, Request, Depends
 from fastapi.responses import RedirectResponse
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
-from pydantic import BaseModel
+from pydantic import BaseModel, ValidationError
 import jwt
 from datetime import datetime, timedelta
-from google.oauth2.credentials import Credentials
-from google_auth_oauthlib.flow import Flow
-from googleapiclient.discovery import build
 import os
-import json
 from typing import Optional
 import ssl
-from motor.motor_asyncio import AsyncIOMotorClient
-from bson import ObjectId
+import secrets
+from auth.db import LazyCollection, close_client
+from auth.sessions import SessionCache, LastLoginWriter, token_hash
+from auth.indexes import ensure_indexes
+from auth.google import GoogleOAuth
+from metrics import errors_total, registry
+import asyncio
 
-# MongoDB Configuration
-MONGODB_URL = os.getenv("MONGODB_URL", "mongodb://localhost:27017")
-client = AsyncIOMotorClient(MONGODB_URL)
-db = client.Drawcal
-users_collection = db.users
-sessions_collection = db.sessions
+# MongoDB Configuration (connected on first use)
+ENSURE_INDEXES = os.getenv("ENSURE_INDEXES", "true").lower() == "true"
+# Logging in again beyond this many live sessions ends the oldest ones
+MAX_ACTIVE_SESSIONS = int(os.getenv("MAX_ACTIVE_SESSIONS", "5"))
+SESSION_DAYS = 30
+users_collection = LazyCollection("users")
+sessions_collection = LazyCollection("sessions")
 
 router = APIRouter()
 security = HTTPBearer()
 
+session_cache = SessionCache()
+# Looked up at flush time so the collection can be swapped (e.g. for the benchmark fakes)
+last_login_writer = LastLoginWriter(lambda: users_collection)
+
 # Configure Google OAuth2
 GOOGLE_CLIENT_ID = os.getenv("GOOGLE_CLIENT_ID")
 GOOGLE_CLIENT_SECRET = os.getenv("GOOGLE_CLIENT_SECRET")
@@ -33,21 +39,11 @@ REDIRECT_URI = os.getenv("REDIRECT_URI")
 SECRET_KEY = os.getenv("SECRET_KEY", "your-secret-key")
 ALGORITHM = "HS256"
 
-# Configure the OAuth2 flow
-flow = Flow.from_client_config(
-    {
-        "web": {
-            "client_id": GOOGLE_CLIENT_ID,
-            "client_secret": GOOGLE_CLIENT_SECRET,
-            "auth_uri": "https://accounts.google.com/o/oauth2/auth",
-            "token_uri": "https://oauth2.googleapis.com/token",
-            "redirect_uris": [REDIRECT_URI],
-            "javascript_origins": [os.getenv("FRONTEND_URL", "http://localhost:5173")]
-        }
-    },
-    scopes=["openid", "https://www.googleapis.com/auth/userinfo.email", "https://www.googleapis.com/auth/userinfo.profile"],
-    redirect_uri=REDIRECT_URI
-)
+# Configure the OAuth2 client (one pooled HTTP client; no per-login state on it)
+google_oauth = GoogleOAuth(GOOGLE_CLIENT_ID, GOOGLE_CLIENT_SECRET, REDIRECT_URI)
+OAUTH_STATE_MINUTES = 10
+# Binds the state to the browser that started the login, against login CSRF
+OAUTH_STATE_COOKIE = "oauth_state"
 
 # Disable SSL verification for development
 ssl._create_default_https_context = ssl._create_unverified_context
@@ -60,11 +56,10 @@ class User(BaseModel):
     last_login: datetime = datetime.utcnow()
 
 class Session(BaseModel):
-    user_id: str
-    token: str
+    user_id: str  # the user's email, same as the token's sub
+    token_hash: str  # sha256 of the JWT; the token itself is never stored
     created_at: datetime = datetime.utcnow()
     expires_at: datetime
-    is_active: bool = True
 
 class LoginRequest(BaseModel):
     username: str
@@ -75,48 +70,34 @@ class TokenData(BaseModel):
     name: str
     role: str
     exp: Optional[datetime] = None
+    token: Optional[str] = None
 
 async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)) -> TokenData:
     try:
         token = credentials.credentials
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        return TokenData(**payload)
+        return TokenData(**payload, token=token)
     except jwt.ExpiredSignatureError:
         raise HTTPException(status_code=401, detail="Token has expired")
-    except jwt.JWTError:
+    except (jwt.InvalidTokenError, ValidationError):
+        # Malformed, badly signed, or a signed token of another kind (e.g. an OAuth state)
         raise HTTPException(status_code=401, detail="Invalid token")
 
 @router.get("/verify")
 async def verify_token(current_user: TokenData = Depends(get_current_user)):
     """Verify the current session token"""
     try:
-        # Find active session
-        session = await sessions_collection.find_one({
-            "user_id": current_user.sub,
-            "is_active": True,
-            "expires_at": {"$gt": datetime.utcnow()}
-        })
-        
-        if not session:
-            raise HTTPException(status_code=401, detail="Session expired or invalid")
-            
-        # Find user
-        user = await users_collection.find_one({"email": current_user.sub})
-        if not user:
-            raise HTTPException(status_code=401, detail="User not found")
+        user_info = await session_user(current_user)
             
-        # Update last login time
-        await users_collection.update_one(
-            {"email": current_user.sub},
-            {"$set": {"last_login": datetime.utcnow()}}
-        )
+        # Update last login time (written in bulk in the background)
+        last_login_writer.touch(current_user.sub)
             
         return {
             "success": True,
             "user": {
-                "email": user["email"],
-                "name": user["name"],
-                "role": user["role"]
+                "email": user_info["email"],
+                "name": user_info["name"],
+                "role": user_info["role"]
             }
         }
     except HTTPException:
@@ -128,13 +109,23 @@ async def verify_token(current_user: TokenData = Depends(get_current_user)):
 async def google_login():
     """Initiate Google OAuth2 flow"""
     try:
-        authorization_url, state = flow.authorization_url(
-            access_type='offline',
-            include_granted_scopes='true',
-            prompt='consent'
+        # The state is signed rather than stored, so any worker can check it on the way back.
+        # Its nonce also goes in a cookie: a state fetched by someone else won't match it.
+        nonce = secrets.token_urlsafe(16)
+        state = jwt.encode({
+            "purpose": "oauth_state",
+            "nonce": nonce,
+            "exp": datetime.utcnow() + timedelta(minutes=OAUTH_STATE_MINUTES)
+        }, SECRET_KEY, algorithm=ALGORITHM)
+        authorization_url = await google_oauth.authorization_url(state)
+        response = RedirectResponse(authorization_url)
+        response.set_cookie(
+            OAUTH_STATE_COOKIE, nonce, max_age=OAUTH_STATE_MINUTES * 60, path="/auth/google",
+            httponly=True, samesite="lax", secure=(REDIRECT_URI or "").startswith("https"),
         )
-        return RedirectResponse(authorization_url)
+        return response
     except Exception as e:
+        errors_total.inc(stage="google_login")
         print(f"Google login error: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Failed to initiate Google login: {str(e)}")
 
@@ -142,13 +133,19 @@ async def google_login():
 async def google_callback(request: Request):
     """Handle Google OAuth2 callback"""
     try:
-        auth_response = str(request.url)
-        # Replace http with https in the callback URL
-        auth_response = auth_response.replace('http://', 'https://')
-        flow.fetch_token(authorization_response=auth_response)
-        credentials = flow.credentials
-        userinfo_service = build('oauth2', 'v2', credentials=credentials)
-        userinfo = userinfo_service.userinfo().get().execute()
+        params = request.query_params
+        if "error" in params or "code" not in params:
+            raise HTTPException(status_code=400, detail=f"Google login was not completed: {params.get('error', 'missing code')}")
+        try:
+            state = jwt.decode(params.get("state", ""), SECRET_KEY, algorithms=[ALGORITHM])
+        except jwt.InvalidTokenError:
+            state = {}
+        cookie = request.cookies.get(OAUTH_STATE_COOKIE, "")
+        if state.get("purpose") != "oauth_state" or not cookie or not secrets.compare_digest(str(state.get("nonce", "")), cookie):
+            raise HTTPException(status_code=400, detail="Invalid or expired login state")
+        
+        tokens = await google_oauth.exchange_code(params["code"])
+        userinfo = await google_oauth.userinfo(tokens["access_token"])
         
         # Create or update user in MongoDB
         email = userinfo['email']
@@ -160,7 +157,7 @@ async def google_callback(request: Request):
         }
         
         # Update or insert user
-        result = await users_collection.update_one(
+        await users_collection.update_one(
             {"email": email},
             {"$set": user_data},
             upsert=True
@@ -174,17 +171,15 @@ async def google_callback(request: Request):
         })
         
         # Store session in MongoDB
-        session_data = {
-            "user_id": str(result.upserted_id) if result.upserted_id else email,
-            "token": access_token,
-            "created_at": datetime.utcnow(),
-            "expires_at": datetime.utcnow() + timedelta(days=30),
-            "is_active": True
-        }
-        await sessions_collection.insert_one(session_data)
+        await start_session(email, access_token)
         
-        return RedirectResponse(f"{os.getenv('FRONTEND_URL', 'http://localhost:5173')}/auth/callback?token={access_token}")
+        response = RedirectResponse(f"{os.getenv('FRONTEND_URL', 'http://localhost:5173')}/auth/callback?token={access_token}")
+        response.delete_cookie(OAUTH_STATE_COOKIE, path="/auth/google")
+        return response
+    except HTTPException:
+        raise
     except Exception as e:
+        errors_total.inc(stage="google_callback")
         print(f"Google callback error: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Failed to complete Google login: {str(e)}")
 
@@ -205,14 +200,7 @@ async def login(request: LoginRequest):
         })
         
         # Store session in MongoDB
-        session_data = {
-            "user_id": str(user["_id"]),
-            "token": access_token,
-            "created_at": datetime.utcnow(),
-            "expires_at": datetime.utcnow() + timedelta(days=30),
-            "is_active": True
-        }
-        await sessions_collection.insert_one(session_data)
+        await start_session(user["email"], access_token)
         
         return {
             "success": True,
@@ -232,33 +220,81 @@ def create_access_token(data: dict):
     """Create JWT token"""
     try:
         to_encode = data.copy()
-        # Token expires in 30 days
-        expire = datetime.utcnow() + timedelta(days=30)
+        # Unique per token, so two logins in the same second still get distinct sessions
+        to_encode.setdefault("jti", secrets.token_hex(8))
+        # Token expires with its session
+        expire = datetime.utcnow() + timedelta(days=SESSION_DAYS)
         to_encode.update({"exp": expire})
         encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
         return encoded_jwt
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to create access token: {str(e)}")
 
+async def start_session(user_id: str, token: str):
+    """Store a compact session for a new token, then end the user's oldest
+    sessions beyond MAX_ACTIVE_SESSIONS."""
+    now = datetime.utcnow()
+    await sessions_collection.insert_one({
+        "user_id": user_id,
+        "token_hash": token_hash(token),
+        "created_at": now,
+        "expires_at": now + timedelta(days=SESSION_DAYS)
+    })
+    stale = sessions_collection.find({"user_id": user_id}, {"token_hash": 1}).sort("created_at", -1).skip(MAX_ACTIVE_SESSIONS)
+    stale_sessions = [session async for session in stale]
+    if stale_sessions:
+        await sessions_collection.delete_many({"_id": {"$in": [session["_id"] for session in stale_sessions]}})
+        for session in stale_sessions:
+            if "token_hash" in session:
+                session_cache.invalidate_hash(session["token_hash"])
+
+async def find_session(token: str, user_id: str):
+    """The live session for a token, by its hash. Sessions stored before tokens
+    were hashed are found by the raw token once and converted in place, taking
+    the token's subject as user_id so they count towards the session cap."""
+    hashed = token_hash(token)
+    session = await sessions_collection.find_one(
+        {"token_hash": hashed, "expires_at": {"$gt": datetime.utcnow()}},
+        {"_id": 1}
+    )
+    if session:
+        return session
+    session = await sessions_collection.find_one(
+        {"token": token, "is_active": True, "expires_at": {"$gt": datetime.utcnow()}},
+        {"_id": 1}
+    )
+    if session:
+        await sessions_collection.update_one(
+            {"_id": session["_id"]},
+            {"$set": {"token_hash": hashed, "user_id": user_id}, "$unset": {"token": "", "is_active": ""}}
+        )
+    return session
+
+async def session_user(current_user: TokenData) -> dict:
+    """The user behind a live session, from the session cache or MongoDB."""
+    # Recently verified sessions are answered from memory
+    user = session_cache.get(current_user.token)
+    if user is not None:
+        return user
+    
+    session = await find_session(current_user.token, current_user.sub)
+    if not session:
+        raise HTTPException(status_code=401, detail="Session expired or invalid")
+        
+    # Find user
+    user = await users_collection.find_one({"email": current_user.sub})
+    if not user:
+        raise HTTPException(status_code=401, detail="User not found")
+    
+    user = {"email": user["email"], "name": user["name"], "role": user["role"]}
+    session_cache.set(current_user.token, user, current_user.exp)
+    return user
+
 @router.get("/session/check")
 async def check_session(current_user: TokenData = Depends(get_current_user)):
     """Check if the current session is valid"""
     try:
-        # Find active session
-        session = await sessions_collection.find_one({
-            "user_id": current_user.sub,
-            "token": current_user.token,
-            "is_active": True,
-            "expires_at": {"$gt": datetime.utcnow()}
-        })
-        
-        if not session:
-            raise HTTPException(status_code=401, detail="Session expired or invalid")
-            
-        # Find user
-        user = await users_collection.find_one({"email": current_user.sub})
-        if not user:
-            raise HTTPException(status_code=401, detail="User not found")
+        user = await session_user(current_user)
             
         return {
             "success": True,
@@ -277,19 +313,12 @@ async def check_session(current_user: TokenData = Depends(get_current_user)):
 async def logout(current_user: TokenData = Depends(get_current_user)):
     """Logout user and invalidate session"""
     try:
-        # Update session to inactive
-        await sessions_collection.update_one(
-            {
-                "user_id": current_user.sub,
-                "is_active": True
-            },
-            {
-                "$set": {
-                    "is_active": False,
-                    "logged_out_at": datetime.utcnow()
-                }
-            }
-        )
+        session_cache.invalidate(current_user.token)
+        
+        # End this token's session only; the user's other devices stay signed in
+        result = await sessions_collection.delete_one({"token_hash": token_hash(current_user.token)})
+        if not result.deleted_count:
+            await sessions_collection.delete_one({"token": current_user.token})
         return {"success": True, "message": "Logged out successfully"}
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Logout failed: {str(e)}")
@@ -312,4 +341,27 @@ async def get_user_profile(current_user: TokenData = Depends(get_current_user)):
     except HTTPException:
         raise
     except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Failed to fetch user profile: {str(e)}") 
\ No newline at end of file
+        raise HTTPException(status_code=500, detail=f"Failed to fetch user profile: {str(e)}")
+
+index_bootstrap = None
+
+async def startup():
+    """Called from the app's lifespan hook."""
+    # In the background, so an unreachable MongoDB doesn't hold up startup
+    global index_bootstrap
+    if ENSURE_INDEXES:
+        index_bootstrap = asyncio.create_task(ensure_indexes(users_collection, sessions_collection))
+
+async def shutdown():
+    if index_bootstrap is not None:
+        index_bootstrap.cancel()
+    await last_login_writer.close()
+    await google_oauth.close()
+    close_client()
+
+@registry.collector
+def auth_metrics():
+    stats = session_cache.stats()
+    yield "drawcal_session_cache_hits_total", "counter", "Session verifications served from memory", {}, stats["hits"]
+    yield "drawcal_session_cache_misses_total", "counter", "Session verifications that went to MongoDB", {}, stats["misses"]
+    yield "drawcal_session_cache_entries", "gauge", "Cached sessions", {}, stats["entries"]
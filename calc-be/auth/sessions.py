@@ -0,0 +1,125 @@
+import asyncio
+import hashlib
+import os
+import time
+from collections import OrderedDict
+from datetime import datetime
+from threading import Lock
+
+# Verified sessions are trusted for this long without asking MongoDB again. Each
+# worker has its own cache, so a logout on one worker reaches the others within a TTL.
+SESSION_CACHE_TTL = int(os.getenv("SESSION_CACHE_TTL", "60"))
+SESSION_CACHE_MAX_ENTRIES = int(os.getenv("SESSION_CACHE_MAX_ENTRIES", "10000"))
+LAST_LOGIN_FLUSH_SECONDS = float(os.getenv("LAST_LOGIN_FLUSH_SECONDS", "30"))
+
+
+def token_hash(token: str) -> str:
+    return hashlib.sha256(token.encode()).hexdigest()
+
+
+class SessionCache:
+    """Short-TTL LRU of sessions already checked against MongoDB, keyed by token hash.
+
+    Raw tokens are never held as keys. An entry never outlives its token's
+    expiry, and logout drops it immediately.
+    """
+
+    def __init__(self, ttl: int = SESSION_CACHE_TTL, max_entries: int = SESSION_CACHE_MAX_ENTRIES):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, token: str):
+        key = token_hash(token)
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                expires_at, user = entry
+                if expires_at > now:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return user
+                del self._entries[key]
+            self.misses += 1
+        return None
+
+    def set(self, token: str, user: dict, token_expires_at: datetime = None):
+        ttl = self.ttl
+        if token_expires_at is not None:
+            ttl = min(ttl, token_expires_at.timestamp() - time.time())
+        if ttl <= 0:
+            return
+        with self._lock:
+            self._entries[token_hash(token)] = (time.monotonic() + ttl, user)
+            self._entries.move_to_end(token_hash(token))
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, token: str):
+        self.invalidate_hash(token_hash(token))
+
+    def invalidate_hash(self, hashed: str):
+        with self._lock:
+            self._entries.pop(hashed, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"entries": len(self._entries), "ttl": self.ttl, "hits": self.hits, "misses": self.misses}
+
+
+class LastLoginWriter:
+    """Write-behind for users.last_login.
+
+    Verifications only record the time in memory; a background task writes the
+    latest time per user in one unordered bulk_write every flush interval, so a
+    user verifying ten times a minute costs at most one update.
+    """
+
+    def __init__(self, get_collection, interval: float = LAST_LOGIN_FLUSH_SECONDS):
+        self.get_collection = get_collection
+        self.interval = interval
+        self._pending = {}
+        self._task = None
+        self.flushes = 0
+        self.written = 0
+
+    def touch(self, email: str):
+        self._pending[email] = datetime.utcnow()
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def _run(self):
+        while self._pending:
+            await asyncio.sleep(self.interval)
+            await self.flush()
+
+    async def flush(self):
+        if not self._pending:
+            return
+        from pymongo import UpdateOne
+        pending, self._pending = self._pending, {}
+        try:
+            await self.get_collection().bulk_write(
+                [UpdateOne({"email": email}, {"$set": {"last_login": at}}) for email, at in pending.items()],
+                ordered=False,
+            )
+        except Exception as e:
+            print(f"last_login flush failed, retrying next interval: {e}")
+            # Keep newer touches that arrived while the write was in flight
+            self._pending = {**pending, **self._pending}
+            return
+        self.flushes += 1
+        self.written += len(pending)
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+        await self.flush()
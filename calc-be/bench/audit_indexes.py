@@ -0,0 +1,104 @@
+"""Check with explain() that every auth query is served by an index.
+
+Creates the auth indexes in a scratch database on a real mongod, seeds it with
+users and sessions, then explains each query shape from auth/indexes.py. Fails
+(exit status 1) if any winning plan contains a COLLSCAN or no index scan.
+
+Run from calc-be/:  python -m bench.audit_indexes [--url mongodb://localhost:27017] [--db Drawcal_audit]
+"""
+import argparse
+import json
+import sys
+from datetime import datetime, timedelta
+from pymongo import MongoClient
+from auth.indexes import USER_INDEXES, SESSION_INDEXES, index_models, query_shapes
+from auth.sessions import token_hash
+
+
+def stages(plan):
+    """Every stage name in a (possibly nested) winning plan."""
+    found = [plan.get('stage')]
+    for child in plan.get('inputStages', []) + [plan[key] for key in ('inputStage', 'queryPlan') if key in plan]:
+        found.extend(stages(child))
+    return [stage for stage in found if stage]
+
+
+def index_names(plan):
+    names = [plan['indexName']] if 'indexName' in plan else []
+    for child in plan.get('inputStages', []) + [plan[key] for key in ('inputStage', 'queryPlan') if key in plan]:
+        names.extend(index_names(child))
+    return names
+
+
+def seed(db, users=200, sessions_per_user=5):
+    now = datetime.utcnow()
+    db.users.insert_many([{'email': f'user{i}@example.com', 'name': f'User {i}', 'role': 'user'} for i in range(users)])
+    db.sessions.insert_many([
+        {
+            'user_id': f'user{i}@example.com',
+            'token_hash': token_hash(f'token-{i}-{j}'),
+            'created_at': now - timedelta(minutes=j),
+            'expires_at': now + timedelta(days=30),
+        }
+        for i in range(users) for j in range(sessions_per_user)
+    ])
+    # A few sessions from before tokens were hashed
+    db.sessions.insert_many([
+        {'user_id': str(i), 'token': f'legacy-{i}', 'created_at': now, 'expires_at': now + timedelta(days=30), 'is_active': True}
+        for i in range(users // 10)
+    ])
+
+
+def audit(db):
+    report, ok = [], True
+    for collection, operation, query, sort in query_shapes('user7@example.com', 'legacy-7', token_hash('token-7-1')):
+        # Updates and deletes pick their plan the way a find with the same filter does
+        cursor = db[collection].find(query)
+        if sort:
+            cursor = cursor.sort(sort)
+        explained = cursor.limit(1).explain()
+        plan = explained['queryPlanner']['winningPlan']
+        execution = explained.get('executionStats', {})
+        plan_stages = stages(plan)
+        # IDHACK is the _id index's fast path for an exact _id match
+        covered = 'COLLSCAN' not in plan_stages and ('IXSCAN' in plan_stages or 'IDHACK' in plan_stages)
+        ok = ok and covered
+        report.append({
+            'collection': collection,
+            'operation': operation,
+            'filter': sorted(query),
+            'stages': plan_stages,
+            'indexes': index_names(plan),
+            'keys_examined': execution.get('totalKeysExamined'),
+            'docs_examined': execution.get('totalDocsExamined'),
+            'indexed': covered,
+        })
+    return ok, report
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--url', default='mongodb://localhost:27017')
+    parser.add_argument('--db', default='Drawcal_audit')
+    parser.add_argument('--keep', action='store_true', help="don't drop the scratch database afterwards")
+    args = parser.parse_args()
+
+    client = MongoClient(args.url, serverSelectionTimeoutMS=3000)
+    client.drop_database(args.db)
+    db = client[args.db]
+    try:
+        db.users.create_indexes(index_models(USER_INDEXES))
+        db.sessions.create_indexes(index_models(SESSION_INDEXES))
+        seed(db)
+        ok, report = audit(db)
+    finally:
+        if not args.keep:
+            client.drop_database(args.db)
+    print(json.dumps(report, indent=2))
+    if not ok:
+        print("Some auth queries are not served by an index", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
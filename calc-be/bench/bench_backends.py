@@ -0,0 +1,83 @@
+"""Offline recognition: latency and accuracy of the local engine, and the cost
+of a full /calculator/process round trip against the stub backend.
+
+The local engine's templates are rendered from Pillow's default font, so
+accuracy on that font says little. It is reported per font: 'default' next to
+TrueType fonts the templates were not built from, which stand in for other
+handwriting. 'served_wrong' counts confident reads with a wrong result: the
+answers a client would get back as verified.
+
+Run from calc-be/:  python -m bench.bench_backends
+"""
+import json
+import time
+from fastapi.testclient import TestClient
+from apps.calculator.backends import BACKENDS, LowConfidence, enable_stub_backend
+from apps.calculator.cache import result_cache
+from apps.calculator.evaluator import EvaluationError, evaluate
+from apps.calculator.segment import segment_image
+from bench.canvases import SCREENS, render_canvas, to_data_url
+
+CASES = ['12 * 7', '10 / 3', '2 + 2 =', '8 - 3', '99 / 11', 'x = 5', '(3+4)*2', '6 x 7', '44.55 + 55.33', '7.5 * 2',
+         '6 + 9', 'x * 3', '81 / 9', '1 + 4']
+FONTS = [None, 'DejaVuSans.ttf', 'DejaVuSans-Bold.ttf', 'DejaVuSerif.ttf', 'DejaVuSansMono.ttf']
+
+
+def normalize(expr):
+    return expr.replace(' ', '').replace('6x7', '6*7').rstrip('=')
+
+
+def expected_result(expr, scope):
+    try:
+        return evaluate(normalize(expr), scope)[0]
+    except EvaluationError:
+        return None
+
+
+def bench_local(font=None):
+    local = BACKENDS['local']
+    local.classifier  # render templates outside the timed loop
+    scope = {'x': 5}
+    correct = served = served_wrong = total = 0
+    timings = []
+    for seed, expected in enumerate(CASES):
+        for size in SCREENS.values():
+            for _, image in segment_image(render_canvas(size, [expected], seed=seed, font=font)):
+                start = time.perf_counter()
+                lines = local.classifier.read(image)
+                timings.append(time.perf_counter() - start)
+                total += 1
+                text = lines[0][0] if lines else ''
+                correct += normalize(text) == normalize(expected)
+                try:
+                    rows = local.read(image, scope)
+                except LowConfidence:
+                    continue
+                served += 1
+                served_wrong += rows[0]['result'] != expected_result(expected, scope)
+    timings.sort()
+    return {
+        'regions': total,
+        'accuracy': round(correct / total, 3),
+        'served_locally': round(served / total, 3),
+        'served_wrong': served_wrong,
+        'p50_ms': round(timings[len(timings) // 2] * 1000, 2),
+        'max_ms': round(timings[-1] * 1000, 2),
+    }
+
+
+def bench_stub_round_trip(requests=20):
+    import main
+    enable_stub_backend()
+    client = TestClient(main.app)
+    payload = {'image': to_data_url(render_canvas(SCREENS['fullhd'], CASES[:3])), 'dict_of_vars': {}, 'backend': 'stub'}
+    result_cache.max_entries = 0
+    start = time.perf_counter()
+    for _ in range(requests):
+        assert client.post('/calculator/process', json=payload).json()['type'] == 'success'
+    return {'requests': requests, 'ms_per_request': round((time.perf_counter() - start) / requests * 1000, 2)}
+
+
+if __name__ == '__main__':
+    local = {font or 'default': bench_local(font) for font in FONTS}
+    print(json.dumps({'local': local, 'stub_round_trip': bench_stub_round_trip()}, indent=2))
@@ -0,0 +1,67 @@
+"""Throughput of region analysis with and without micro-batching.
+
+The stub backend sleeps once per model call whatever the number of images, so
+with a fixed number of model threads (the stand-in for a per-call rate limit)
+batching should multiply the images analyzed per second by about the batch size.
+
+Run from calc-be/:  python -m bench.bench_batching [--latency-ms 200] [--clients 64] [--seconds 5]
+"""
+import argparse
+import asyncio
+import json
+import time
+from apps.calculator import batching, pipeline
+from apps.calculator.backends import enable_stub_backend
+from apps.calculator.cache import result_cache
+from apps.calculator.pool import analysis_limiter
+from apps.calculator.segment import segment_image
+from bench.canvases import SCREENS, render_canvas
+
+
+async def run(clients, seconds, region):
+    stub = enable_stub_backend()
+    calls_before = stub.calls
+    done = 0
+    deadline = time.perf_counter() + seconds
+
+    async def client(seed):
+        nonlocal done
+        n = seed
+        while time.perf_counter() < deadline:
+            # Distinct vars so neither the cache nor single-flight absorbs the load
+            await pipeline.analyze_cached(region, {'seed': n}, 'stub')
+            n += clients
+            done += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(client(seed) for seed in range(clients)))
+    elapsed = time.perf_counter() - start
+    return {
+        'images': done,
+        'model_calls': stub.calls - calls_before,
+        'images_per_s': round(done / elapsed, 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--latency-ms', type=int, default=200)
+    parser.add_argument('--clients', type=int, default=64)
+    parser.add_argument('--seconds', type=float, default=5)
+    args = parser.parse_args()
+
+    enable_stub_backend().latency_ms = args.latency_ms
+    # Enough admission capacity for every client; the model threads are the bottleneck under test
+    analysis_limiter.capacity = args.clients
+    _, region = segment_image(render_canvas(SCREENS['fullhd'], ['12 * 7']))[0]
+    report = {}
+    for size in (1, 2, 4, 8):
+        batching.BATCH_MAX_SIZE = size
+        batching.batchers.clear()
+        result_cache.clear()
+        report[f'batch_{size}'] = asyncio.run(run(args.clients, args.seconds, region))
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,269 @@
+"""End-to-end benchmark: the real API, a stub Gemini endpoint and replayed canvases.
+
+Starts bench/stub_gemini.py in this process and the API (bench/e2e_server.py)
+in a child process. MongoDB is in memory unless --mongo-url is given. Then:
+  - replays the canvases in bench/data/canvases.jsonl, plus any recorded PNGs
+    in --png-dir, through POST /calculator/process;
+  - runs login -> verify -> session/check -> user/profile -> logout flows
+    against /auth.
+It reports, as JSON:
+  - throughput, p50/p95/p99 latency and bytes sent/received per endpoint;
+  - the API process's peak RSS;
+  - its per-stage timings from /metrics.
+
+A recorded PNG `name.png` may have a `name.json` next to it holding its
+dict_of_vars. With --baseline, the run exits non-zero if any endpoint's p95 or
+throughput is worse than that earlier report by more than --tolerance.
+
+Run from calc-be/:  python -m bench.bench_e2e [--requests 200] [--concurrency 4] [--latency-ms 800]
+                        [--output report.json] [--baseline previous.json]
+"""
+import argparse
+import asyncio
+import base64
+import json
+import os
+import re
+import subprocess
+import sys
+import time
+from pathlib import Path
+import httpx
+from bench.bench_oauth import serve
+from bench.canvases import SCREENS, render_canvas, to_data_url
+from bench.load_auth_latency import percentile
+from bench.stub_gemini import create_app
+from apps.calculator.utils import ERROR_EXPRS
+
+CANVASES = Path(__file__).parent / 'data' / 'canvases.jsonl'
+GEMINI_PORT = 8981
+API_PORT = 8982
+STAGE_LINE = re.compile(r'drawcal_stage_seconds_(sum|count)\{stage="([^"]+)"\} (\S+)')
+
+
+def load_corpus(png_dir: str = None) -> list:
+    """[(name, request body)] for every canvas to replay."""
+    corpus = []
+    with open(CANVASES, encoding='utf-8') as f:
+        for line in f:
+            if line.strip():
+                spec = json.loads(line)
+                img = render_canvas(SCREENS[spec['screen']], spec['expressions'], seed=spec['seed'], photo=spec['photo'])
+                corpus.append((spec['name'], {'image': to_data_url(img), 'dict_of_vars': spec['dict_of_vars']}))
+    if png_dir:
+        for path in sorted(Path(png_dir).glob('*.png')):
+            vars_path = path.with_suffix('.json')
+            dict_of_vars = json.loads(vars_path.read_text()) if vars_path.exists() else {}
+            data_url = 'data:image/png;base64,' + base64.b64encode(path.read_bytes()).decode()
+            corpus.append((path.stem, {'image': data_url, 'dict_of_vars': dict_of_vars}))
+    return corpus
+
+
+class Recorder:
+    """Latency and byte counts per endpoint."""
+
+    def __init__(self):
+        self.samples = {}
+
+    def record(self, endpoint: str, seconds: float, status: int, sent: int, received: int, failed: bool = False):
+        entry = self.samples.setdefault(endpoint, {'latencies': [], 'statuses': {}, 'sent': 0, 'received': 0, 'failed': 0})
+        entry['latencies'].append(seconds)
+        entry['statuses'][str(status)] = entry['statuses'].get(str(status), 0) + 1
+        entry['sent'] += sent
+        entry['received'] += received
+        entry['failed'] += failed
+
+    def report(self, elapsed: float) -> dict:
+        report = {}
+        for endpoint, entry in self.samples.items():
+            latencies, count = entry['latencies'], len(entry['latencies'])
+            report[endpoint] = {
+                'count': count,
+                'throughput_rps': round(count / elapsed, 2),
+                'p50_ms': round(percentile(latencies, 50) * 1000, 2),
+                'p95_ms': round(percentile(latencies, 95) * 1000, 2),
+                'p99_ms': round(percentile(latencies, 99) * 1000, 2),
+                'max_ms': round(max(latencies) * 1000, 2),
+                'bytes_sent_per_request': entry['sent'] // count,
+                'bytes_received_per_request': entry['received'] // count,
+                'statuses': entry['statuses'],
+                'failed': entry['failed'],
+            }
+        return report
+
+
+async def timed(client, recorder, endpoint, method, url, **kwargs):
+    request = client.build_request(method, url, **kwargs)
+    start = time.perf_counter()
+    response = await client.send(request)
+    elapsed = time.perf_counter() - start
+    sent = len(request.content or b'')
+    failed = response.status_code >= 400
+    if endpoint == 'process' and not failed:
+        # The route answers 200 with error rows when recognition failed
+        body = response.json()
+        failed = body.get('type') == 'error' or any(row.get('expr') in ERROR_EXPRS for row in body.get('data', []))
+    recorder.record(endpoint, elapsed, response.status_code, sent, len(response.content), failed)
+    return response
+
+
+async def run_process(client, corpus, requests, concurrency) -> dict:
+    recorder, next_index = Recorder(), iter(range(requests))
+
+    async def worker():
+        for index in next_index:
+            _, body = corpus[index % len(corpus)]
+            await timed(client, recorder, 'process', 'POST', '/calculator/process', json=body)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return recorder.report(time.perf_counter() - start)
+
+
+async def run_auth(client, flows, concurrency, users) -> dict:
+    recorder, next_flow = Recorder(), iter(range(flows))
+
+    async def worker(slot):
+        # One user per worker so the per-user session cap never logs a running flow out
+        email = f'bench{slot % users}@example.com'
+        for _ in next_flow:
+            response = await timed(client, recorder, 'auth/login', 'POST', '/auth/login',
+                                   json={'username': email, 'password': 'bench'})
+            if response.status_code != 200:
+                continue
+            headers = {'Authorization': f"Bearer {response.json()['token']}"}
+            await timed(client, recorder, 'auth/verify', 'GET', '/auth/verify', headers=headers)
+            await timed(client, recorder, 'auth/session/check', 'GET', '/auth/session/check', headers=headers)
+            await timed(client, recorder, 'auth/user/profile', 'GET', '/auth/user/profile', headers=headers)
+            await timed(client, recorder, 'auth/logout', 'POST', '/auth/logout', headers=headers)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker(slot) for slot in range(concurrency)))
+    return recorder.report(time.perf_counter() - start)
+
+
+def stage_timings(metrics_text: str) -> dict:
+    totals = {}
+    for kind, stage, value in STAGE_LINE.findall(metrics_text):
+        totals.setdefault(stage, {})[kind] = float(value)
+    return {
+        stage: {'count': int(t.get('count', 0)), 'mean_ms': round(t.get('sum', 0) / t['count'] * 1000, 3) if t.get('count') else 0}
+        for stage, t in sorted(totals.items())
+    }
+
+
+def peak_rss_mb(pid: int):
+    """VmHWM of a child process (Linux); None elsewhere."""
+    try:
+        with open(f'/proc/{pid}/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return round(int(line.split()[1]) / 1024, 1)
+    except OSError:
+        return None
+
+
+def start_api(args) -> subprocess.Popen:
+    env = {
+        **os.environ,
+        'GEMINI_API_ENDPOINT': f'http://127.0.0.1:{args.gemini_port}',
+        'GEMINI_API_KEY': 'stub',
+        'RECOGNITION_BACKEND': 'gemini',
+        'VERBOSE_LOG': 'off',
+    }
+    if not args.cache:
+        # Replays repeat canvases; a zero TTL makes every one reach the model
+        env['CACHE_TTL_SECONDS'] = '0'
+        env.pop('REDIS_URL', None)
+    command = [sys.executable, '-m', 'bench.e2e_server', '--port', str(args.api_port), '--users', str(args.concurrency)]
+    if args.mongo_url:
+        command += ['--mongo-url', args.mongo_url]
+    process = subprocess.Popen(command, env=env)
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        try:
+            httpx.get(f'http://127.0.0.1:{args.api_port}/', timeout=1)
+            return process
+        except httpx.TransportError:
+            if process.poll() is not None:
+                raise SystemExit('API process exited during startup')
+            time.sleep(0.2)
+    process.kill()
+    raise SystemExit('API did not start within 30s')
+
+
+async def run(args, corpus) -> dict:
+    async with httpx.AsyncClient(base_url=f'http://127.0.0.1:{args.api_port}', timeout=120) as client:
+        # The first request imports the Gemini SDK; keep it out of the numbers
+        await client.post('/calculator/process', json=corpus[0][1])
+        endpoints = await run_process(client, corpus, args.requests, args.concurrency)
+        endpoints.update(await run_auth(client, args.auth_flows, args.concurrency, args.concurrency))
+        stages = stage_timings((await client.get('/metrics')).text)
+        model_client = (await client.get('/calculator/cache/stats')).json()['model']
+    return {'endpoints': endpoints, 'stages': stages, 'model_client': model_client}
+
+
+def regressions(report: dict, baseline: dict, tolerance: float) -> list:
+    found = []
+    for endpoint, current in report['endpoints'].items():
+        previous = baseline.get('endpoints', {}).get(endpoint)
+        if not previous:
+            continue
+        if current['p95_ms'] > previous['p95_ms'] * (1 + tolerance):
+            found.append(f"{endpoint}: p95 {previous['p95_ms']} -> {current['p95_ms']} ms")
+        if current['throughput_rps'] < previous['throughput_rps'] * (1 - tolerance):
+            found.append(f"{endpoint}: throughput {previous['throughput_rps']} -> {current['throughput_rps']} req/s")
+    return found
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--requests', type=int, default=200, help='/calculator/process requests')
+    parser.add_argument('--auth-flows', type=int, default=200, help='login ... logout sequences')
+    parser.add_argument('--concurrency', type=int, default=4)
+    parser.add_argument('--latency-ms', type=int, default=800, help='stub model latency')
+    parser.add_argument('--jitter-ms', type=int, default=200)
+    parser.add_argument('--error-rate', type=float, default=0, help='share of model calls failing with 503')
+    parser.add_argument('--slow-rate', type=float, default=0, help='share of model calls taking --slow-ms')
+    parser.add_argument('--slow-ms', type=int, default=15000)
+    parser.add_argument('--png-dir', help='recorded canvas PNGs to replay as well')
+    parser.add_argument('--mongo-url', help='use this MongoDB instead of in-memory fakes')
+    parser.add_argument('--cache', action='store_true', help='keep the result cache on (repeats then skip the model)')
+    parser.add_argument('--gemini-port', type=int, default=GEMINI_PORT)
+    parser.add_argument('--api-port', type=int, default=API_PORT)
+    parser.add_argument('--output', help='also write the report to this file')
+    parser.add_argument('--baseline', help='earlier report to compare against')
+    parser.add_argument('--tolerance', type=float, default=0.25)
+    args = parser.parse_args()
+
+    corpus = load_corpus(args.png_dir)
+    stub = create_app(args.latency_ms, args.jitter_ms, error_rate=args.error_rate, slow_rate=args.slow_rate, slow_ms=args.slow_ms)
+    stub_server, _ = serve(stub, args.gemini_port)
+    api = start_api(args)
+    try:
+        report = asyncio.run(run(args, corpus))
+        report['api_peak_rss_mb'] = peak_rss_mb(api.pid)
+    finally:
+        api.terminate()
+        api.wait()
+        stub_server.should_exit = True
+    report['config'] = {
+        'requests': args.requests, 'auth_flows': args.auth_flows, 'concurrency': args.concurrency,
+        'model_latency_ms': args.latency_ms, 'model_jitter_ms': args.jitter_ms, 'model_error_rate': args.error_rate,
+        'model_slow_rate': args.slow_rate, 'model_slow_ms': args.slow_ms, 'corpus_size': len(corpus),
+        'cache': args.cache, 'mongo': 'local' if args.mongo_url else 'in-memory',
+    }
+    report['model_requests'] = dict(stub.state.requests)
+
+    print(json.dumps(report, indent=2))
+    if args.output:
+        Path(args.output).write_text(json.dumps(report, indent=2))
+    if args.baseline:
+        found = regressions(report, json.loads(Path(args.baseline).read_text()), args.tolerance)
+        if found:
+            print('Performance regressions:\n  ' + '\n  '.join(found), file=sys.stderr)
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
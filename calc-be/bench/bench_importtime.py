@@ -0,0 +1,71 @@
+"""Cold-start guard: how long `import main` takes in a fresh interpreter.
+
+Runs `python -X importtime -c "import main"` several times, reports the median
+cumulative import time and the heaviest top-level packages, and exits non-zero
+if the median is over budget or if a module that should load lazily (the
+Gemini SDK, motor/pymongo, httpx) was imported at startup.
+
+Run from calc-be/:  python -m bench.bench_importtime [--runs 5] [--budget-ms 900]
+"""
+import argparse
+import json
+import re
+import statistics
+import subprocess
+import sys
+from collections import Counter
+
+# Loaded on first use (first model call, first database query, first Google login)
+LAZY_MODULES = ('google.generativeai', 'google.ai', 'motor', 'pymongo', 'httpx')
+LINE = re.compile(r'import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)')
+
+
+def measure():
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', 'import main'],
+        capture_output=True, text=True, check=True,
+    )
+    total, packages, modules = None, Counter(), set()
+    for line in result.stderr.splitlines():
+        match = LINE.match(line)
+        if not match:
+            continue
+        self_us, cumulative_us, _, name = match.groups()
+        modules.add(name)
+        packages[name.split('.')[0]] += int(self_us)
+        if name == 'main':
+            total = int(cumulative_us)
+    return total, packages, modules
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--budget-ms', type=float, default=900)
+    args = parser.parse_args()
+
+    totals, packages, modules = [], Counter(), set()
+    for _ in range(args.runs):
+        total, run_packages, run_modules = measure()
+        totals.append(total)
+        packages.update(run_packages)
+        modules |= run_modules
+
+    median_ms = statistics.median(totals) / 1000
+    eager = sorted(m for m in modules if any(m == lazy or m.startswith(lazy + '.') for lazy in LAZY_MODULES))
+    report = {
+        'runs': args.runs,
+        'median_ms': round(median_ms, 1),
+        'budget_ms': args.budget_ms,
+        'heaviest_packages_ms': {name: round(us / args.runs / 1000, 1) for name, us in packages.most_common(10)},
+        'eagerly_imported_lazy_modules': eager[:10],
+    }
+    print(json.dumps(report, indent=2))
+    if median_ms > args.budget_ms or eager:
+        print("Import-time budget exceeded" if median_ms > args.budget_ms else "Lazy modules imported at startup",
+              file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
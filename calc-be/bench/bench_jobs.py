@@ -0,0 +1,60 @@
+"""Batch job throughput against the number of job workers.
+
+Queues one worksheet of --pages canvases per run. Recognition uses the stub
+backend with --model-latency-ms per call, standing in for the network wait of a
+Gemini call. The run reports pages per second for each worker count. Pages are
+independent, so throughput should grow close to linearly until the model
+limiter or the image pool saturates.
+
+Run from calc-be/:  python -m bench.bench_jobs [--pages 48] [--workers 1 2 4 8] [--model-latency-ms 300]
+"""
+import argparse
+import asyncio
+import json
+import time
+from apps.calculator import backends
+from apps.calculator.cache import result_cache
+from apps.calculator.jobs import Job, JobQueue
+from apps.calculator.pages import PageSource
+from bench.canvases import SCREENS, render_canvas, to_data_url
+
+
+async def run(workers: int, images: list) -> dict:
+    queue = JobQueue(workers=workers)
+    start = time.perf_counter()
+    job = queue.submit(Job(PageSource('data_urls', images), {}, 'stub'))
+    while job.finished is None:
+        await asyncio.sleep(0.01)
+    elapsed = time.perf_counter() - start
+    await queue.close()
+    return {
+        'workers': workers,
+        'pages': job.pages,
+        'failed': job.failed,
+        'seconds': round(elapsed, 2),
+        'pages_per_second': round(job.pages / elapsed, 2),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--pages', type=int, default=48)
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4, 8])
+    parser.add_argument('--model-latency-ms', type=int, default=300)
+    args = parser.parse_args()
+
+    backends.enable_stub_backend().latency_ms = args.model_latency_ms
+    # Every page differs, as on a real worksheet, so none is served from the cache
+    images = [
+        to_data_url(render_canvas(SCREENS['laptop'], [f'{i} * 7', f'x = {i + 5}'], seed=i))
+        for i in range(args.pages)
+    ]
+    report = []
+    for workers in args.workers:
+        result_cache.clear()
+        report.append(asyncio.run(run(workers, images)))
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,96 @@
+"""Google login round trips against the local stub OAuth server.
+
+Starts bench/stub_oauth.py and the API (with in-memory MongoDB fakes) on local
+ports, runs many concurrent login -> callback flows, and samples /auth/verify
+meanwhile. The OAuth calls are async and pooled, so verify latency should stay
+flat while logins are in flight, and the discovery document is fetched once.
+
+Run from calc-be/:  python -m bench.bench_oauth [--logins 200] [--concurrency 20] [--latency-ms 80]
+"""
+import argparse
+import asyncio
+import json
+import os
+import threading
+import time
+from urllib.parse import parse_qs, urlparse
+import httpx
+import uvicorn
+from bench.load_auth_latency import sample_verify, summarize
+
+STUB_PORT = 8978
+API_PORT = 8979
+
+
+def serve(app, port):
+    server = uvicorn.Server(uvicorn.Config(app, host='127.0.0.1', port=port, log_level='warning'))
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    while not server.started:
+        time.sleep(0.05)
+    return server, thread
+
+
+async def login(client, name):
+    start = time.perf_counter()
+    response = await client.get('/auth/google/login')
+    state = parse_qs(urlparse(response.headers['location']).query)['state'][0]
+    # The client's cookie jar is shared by concurrent logins, so send this flow's own cookie
+    cookie = f"oauth_state={response.cookies['oauth_state']}"
+    response = await client.get('/auth/google/callback', params={'code': name, 'state': state}, headers={'Cookie': cookie})
+    if response.status_code != 307 or 'token=' not in response.headers.get('location', ''):
+        raise RuntimeError(f'Login for {name} failed: {response.status_code} {response.text}')
+    return time.perf_counter() - start
+
+
+async def run(args, token):
+    async with httpx.AsyncClient(base_url=f'http://127.0.0.1:{API_PORT}', timeout=30) as client:
+        semaphore = asyncio.Semaphore(args.concurrency)
+
+        async def limited(n):
+            async with semaphore:
+                return await login(client, f'user{n}')
+
+        start = time.perf_counter()
+        logins = asyncio.gather(*(limited(n) for n in range(args.logins)))
+        verify = asyncio.create_task(sample_verify(client, token, 1.0))
+        timings = await logins
+        elapsed = time.perf_counter() - start
+        verify_samples = await verify
+    return {
+        'stub_latency_ms': args.latency_ms,
+        'logins': summarize(timings),
+        'logins_per_s': round(args.logins / elapsed, 1),
+        'verify_during_logins': summarize(verify_samples),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--logins', type=int, default=200)
+    parser.add_argument('--concurrency', type=int, default=20)
+    parser.add_argument('--latency-ms', type=int, default=80)
+    args = parser.parse_args()
+
+    # Must be set before the auth router is imported
+    os.environ['GOOGLE_DISCOVERY_URL'] = f'http://127.0.0.1:{STUB_PORT}/.well-known/openid-configuration'
+    os.environ.setdefault('REDIRECT_URI', f'http://127.0.0.1:{API_PORT}/auth/google/callback')
+    from bench.fakes import install_fake_auth_store
+    from bench.stub_oauth import create_app
+    import main as app_module
+
+    token, _, _ = install_fake_auth_store()
+    stub_app = create_app(args.latency_ms)
+    servers = [serve(stub_app, STUB_PORT), serve(app_module.app, API_PORT)]
+    try:
+        report = asyncio.run(run(args, token))
+    finally:
+        for server, thread in servers:
+            server.should_exit = True
+            thread.join()
+    report['stub_requests'] = stub_app.state.requests
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    main()
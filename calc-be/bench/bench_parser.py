@@ -0,0 +1,169 @@
+"""Correctness, robustness and speed of the response parser against the legacy cleanup.
+
+bench/data/responses.jsonl holds raw model responses in the shapes Gemini
+produces (fences, prose, Python literals, bare keys, LaTeX, ...) with the rows
+each should yield. On top of the corpus the fuzzer:
+  - wraps responses in prose and fences and re-splits them into random stream
+    chunks, which must not change the rows read;
+  - truncates them and sprinkles random bytes in, which must never raise.
+
+Run from calc-be/:  python -m bench.bench_parser [--fuzz 2000] [--seed 0]
+"""
+import argparse
+import contextlib
+import io
+import json
+import random
+import time
+from pathlib import Path
+from apps.calculator.parser import ObjectStreamParser, parse_answers
+from bench.legacy_parser import legacy_parse
+
+CORPUS = Path(__file__).parent / 'data' / 'responses.jsonl'
+PROSE = ['Here is the result:', 'Sure!', 'The image contains the following expressions.', 'Note: results are rounded.']
+
+
+def load_corpus():
+    with open(CORPUS, encoding='utf-8') as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def normalize(rows):
+    return [(str(r.get('expr')), str(r.get('result')), str(r.get('assign')).lower() == 'true') for r in rows]
+
+
+def same(rows, case):
+    got, want = normalize(rows), normalize(case['expected'])
+    if len(got) != len(want):
+        return False
+    for (expr, result, assign), (w_expr, w_result, w_assign) in zip(got, want):
+        if expr != w_expr or assign != w_assign:
+            return False
+        if result != w_result:
+            # A bare 15.0 comes back as a float, so compare numeric results by value
+            try:
+                if float(result) != float(w_result):
+                    return False
+            except ValueError:
+                return False
+    return True
+
+
+def parse_new(text):
+    return [answer for answer in parse_answers(text) if 'expr' in answer]
+
+
+def parse_legacy(text):
+    try:
+        return [answer for answer in legacy_parse(text) if 'expr' in answer]
+    except Exception:
+        return None
+
+
+def streamed(text, rng):
+    parser, rows = ObjectStreamParser(), []
+    pos = 0
+    while pos < len(text):
+        step = rng.randint(1, 24)
+        rows.extend(parser.feed(text[pos:pos + step]))
+        pos += step
+    rows.extend(parser.finish())
+    return [answer for answer in rows if 'expr' in answer]
+
+
+def wrap(text, rng):
+    if rng.random() < 0.5:
+        text = f"```json\n{text}\n```" if not text.startswith('```') else text
+    if rng.random() < 0.5:
+        text = rng.choice(PROSE) + '\n' + text
+    if rng.random() < 0.5:
+        text = text + '\n' + rng.choice(PROSE)
+    return text
+
+
+def damage(text, rng):
+    if rng.random() < 0.5:
+        return text[:rng.randint(0, len(text))]
+    chars = list(text)
+    for _ in range(rng.randint(1, 5)):
+        chars.insert(rng.randint(0, len(chars)), chr(rng.randint(32, 0x2fff)))
+    return ''.join(chars)
+
+
+def correctness(corpus):
+    report = {'new': 0, 'legacy': 0, 'cases': len(corpus), 'legacy_failures': [], 'new_failures': []}
+    for case in corpus:
+        if same(parse_new(case['raw']), case):
+            report['new'] += 1
+        else:
+            report['new_failures'].append(case['name'])
+        legacy = parse_legacy(case['raw'])
+        if legacy is not None and same(legacy, case):
+            report['legacy'] += 1
+        else:
+            report['legacy_failures'].append(case['name'])
+    return report
+
+
+def fuzz(corpus, iterations, seed):
+    # Damaged objects are reported as skipped on stdout; keep them out of the report
+    with contextlib.redirect_stdout(io.StringIO()):
+        return run_fuzz(corpus, iterations, seed)
+
+
+def run_fuzz(corpus, iterations, seed):
+    rng = random.Random(seed)
+    report = {'wrapped': 0, 'new_wrapped_ok': 0, 'legacy_wrapped_ok': 0, 'stream_mismatches': 0,
+              'damaged': 0, 'new_raised': 0, 'legacy_raised': 0}
+    for _ in range(iterations):
+        case = rng.choice(corpus)
+        text = wrap(case['raw'], rng)
+        report['wrapped'] += 1
+        whole = parse_new(text)
+        report['new_wrapped_ok'] += same(whole, case)
+        legacy = parse_legacy(text)
+        report['legacy_wrapped_ok'] += legacy is not None and same(legacy, case)
+        if normalize(streamed(text, rng)) != normalize(whole):
+            report['stream_mismatches'] += 1
+
+        broken = damage(text, rng)
+        report['damaged'] += 1
+        try:
+            parse_new(broken)
+        except Exception:
+            report['new_raised'] += 1
+        try:
+            legacy_parse(broken)
+        except Exception:
+            report['legacy_raised'] += 1
+    return report
+
+
+def timing(corpus, rounds=200):
+    texts = [case['raw'] for case in corpus]
+    results = {}
+    for name, fn in (('new', parse_new), ('legacy', parse_legacy)):
+        start = time.perf_counter()
+        for _ in range(rounds):
+            for text in texts:
+                fn(text)
+        results[f'{name}_us_per_response'] = round((time.perf_counter() - start) / (rounds * len(texts)) * 1e6, 2)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--fuzz', type=int, default=2000)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    corpus = load_corpus()
+    print(json.dumps({
+        'correctness': correctness(corpus),
+        'fuzz': fuzz(corpus, args.fuzz, args.seed),
+        'timing': timing(corpus),
+    }, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,116 @@
+"""How often the near-duplicate index reuses a result, and how often wrongly.
+
+Each expression is drawn once and indexed. Then variants of the same drawing
+are looked up: with a thicker pen, zoomed by 3%, JPEG re-encoded, with a stray
+dot and drawn on a larger screen. (Moving a drawing needs no lookup: the
+prepared image is cropped to its ink, so the exact cache already hits.) Edits
+changing one character are looked up too; any hit on an edit is a false match.
+The report lists the hit rate per variant and the spread of pHash distance and
+block_diff, which is what PERCEPTUAL_THRESHOLD and PERCEPTUAL_MAX_BLOCK_DIFF
+are tuned against.
+
+Run from calc-be/:  python -m bench.bench_perceptual [--threshold 16] [--max-block-diff 12]
+"""
+import argparse
+import io
+import json
+import random
+from PIL import Image, ImageDraw, ImageFilter
+from apps.calculator.preprocess import prepare_image
+from apps.calculator.similar import NearDuplicateIndex, block_diff, perceptual_hash, thumbnail
+from bench.canvases import SCREENS, render_canvas
+from constants import PERCEPTUAL_THRESHOLD, PERCEPTUAL_MAX_BLOCK_DIFF
+
+EXPRESSIONS = [
+    '2 + 2', 'x = 5', '12 * 7', '10 / 3', '44.55 + 55.33', '7 - 1', '(3 + 4) * 2',
+    'y = 2 * x + 1', '123456 + 789012', '1 / 2 + 1 / 3', '9 * 9', '81 - 17',
+]
+
+
+def jpeg(img: Image.Image) -> Image.Image:
+    buffer = io.BytesIO()
+    img.convert('RGB').save(buffer, format='JPEG', quality=60)
+    return Image.open(buffer)
+
+
+def zoom(img: Image.Image, factor: float) -> Image.Image:
+    return img.resize((round(img.width * factor), round(img.height * factor)), Image.BILINEAR)
+
+
+def stray_dot(img: Image.Image, rng: random.Random) -> Image.Image:
+    img = img.copy()
+    width, height = img.size
+    x, y = rng.randint(width // 10, width // 3), rng.randint(height // 10, height // 4)
+    ImageDraw.Draw(img).ellipse((x, y, x + 6, y + 6), fill='#FFFFFF')
+    return img
+
+
+def edits(expr: str) -> list:
+    """The expression with one character changed: its first and its last digit
+    bumped, and a decimal point put between two digits."""
+    positions = [i for i, c in enumerate(expr) if c.isdigit()]
+    changed = [expr[:i] + str((int(expr[i]) + 1) % 10) + expr[i + 1:] for i in sorted({positions[0], positions[-1]})]
+    pairs = [i for i in positions if i + 1 in positions and '.' not in expr[max(i - 3, 0):i + 4]]
+    if pairs:
+        changed.append(expr[:pairs[0] + 1] + '.' + expr[pairs[0] + 1:])
+    return changed
+
+
+def variants(expr: str, rng: random.Random) -> dict:
+    laptop = SCREENS['laptop']
+    return {
+        'thicker_pen': render_canvas(laptop, [expr]).filter(ImageFilter.MaxFilter(3)),
+        'zoomed_3pct': zoom(render_canvas(laptop, [expr]), 1.03),
+        'jpeg': jpeg(render_canvas(laptop, [expr])),
+        'stray_dot': stray_dot(render_canvas(laptop, [expr]), rng),
+        'other_screen': render_canvas(SCREENS['fullhd'], [expr]),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--threshold', type=int, default=PERCEPTUAL_THRESHOLD)
+    parser.add_argument('--max-block-diff', type=float, default=PERCEPTUAL_MAX_BLOCK_DIFF)
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    index = NearDuplicateIndex(threshold=args.threshold, max_block_diff=args.max_block_diff)
+    thumbs = {}
+    for expr in EXPRESSIONS:
+        thumbs[expr] = thumbnail(prepare_image(render_canvas(SCREENS['laptop'], [expr])))
+        index.add('bench', thumbs[expr], [{'expr': expr}])
+
+    samples = {}
+
+    def probe(kind: str, original: str, img: Image.Image, expected: str):
+        thumb = thumbnail(prepare_image(img))
+        responses = index.lookup('bench', thumb)
+        entry = samples.setdefault(kind, {'lookups': 0, 'hits': 0, 'false_matches': 0, 'distances': [], 'block_diffs': []})
+        entry['lookups'] += 1
+        entry['distances'].append(bin(perceptual_hash(thumb) ^ perceptual_hash(thumbs[original])).count('1'))
+        entry['block_diffs'].append(round(block_diff(thumb, thumbs[original]), 1))
+        if responses is not None:
+            entry['hits'] += 1
+            entry['false_matches'] += responses[0]['expr'] != expected
+
+    for expr in EXPRESSIONS:
+        for kind, img in variants(expr, rng).items():
+            probe(kind, expr, img, expr)
+        for edited in edits(expr):
+            probe('one_char_edit', expr, render_canvas(SCREENS['laptop'], [edited]), edited)
+
+    report = {
+        kind: {
+            'lookups': s['lookups'],
+            'hit_rate': round(s['hits'] / s['lookups'], 2),
+            'false_matches': s['false_matches'],
+            'distance': {'min': min(s['distances']), 'max': max(s['distances'])},
+            'block_diff': {'min': min(s['block_diffs']), 'max': max(s['block_diffs'])},
+        }
+        for kind, s in samples.items()
+    }
+    print(json.dumps({'threshold': args.threshold, 'max_block_diff': args.max_block_diff, 'variants': report}, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,56 @@
+"""Compare upload bytes and encode time with and without canvas preprocessing.
+
+Run from calc-be/:  python -m bench.bench_preprocess
+"""
+import io
+import json
+import sys
+import time
+from PIL import Image
+from apps.calculator.preprocess import prepare_image, encode_png
+from bench.canvases import SCREENS, render_canvas, to_png
+
+
+def best_of(fn, repeat=5):
+    best = float('inf')
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        best = min(best, time.perf_counter() - start)
+    return best * 1000, result
+
+
+def baseline(png: bytes) -> bytes:
+    # What analyze_image used to do: decode and re-encode the full window
+    return encode_png(Image.open(io.BytesIO(png)))
+
+
+def preprocessed(png: bytes, mode: str) -> bytes:
+    return encode_png(prepare_image(Image.open(io.BytesIO(png)), mode=mode))
+
+
+def main():
+    rows = []
+    for name, size in SCREENS.items():
+        png = to_png(render_canvas(size))
+        base_ms, base_bytes = best_of(lambda: baseline(png))
+        row = {'canvas': name, 'size': size, 'baseline_bytes': len(base_bytes), 'baseline_ms': round(base_ms, 2)}
+        for mode in ('L', '1'):
+            ms, out = best_of(lambda: preprocessed(png, mode))
+            row[f'{mode}_bytes'] = len(out)
+            row[f'{mode}_ms'] = round(ms, 2)
+            row[f'{mode}_bytes_ratio'] = round(len(base_bytes) / len(out), 1)
+        rows.append(row)
+
+    if '--json' in sys.argv:
+        print(json.dumps(rows, indent=2))
+        return
+    print(f"{'canvas':8} {'baseline':>18} {'grayscale':>18} {'bi-level':>18}")
+    for r in rows:
+        print(f"{r['canvas']:8} {r['baseline_bytes']:>9,}B {r['baseline_ms']:>6.1f}ms "
+              f"{r['L_bytes']:>9,}B {r['L_ms']:>6.1f}ms {r['1_bytes']:>9,}B {r['1_ms']:>6.1f}ms")
+
+
+if __name__ == '__main__':
+    main()
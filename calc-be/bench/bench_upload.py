@@ -0,0 +1,121 @@
+"""Peak memory and CPU per request: base64-in-JSON /process vs binary /process/raw.
+
+Each path runs in its own subprocess so ru_maxrss isn't shared. Requests are
+driven straight through the ASGI app with the body in 64 KiB chunks, as
+uvicorn delivers it, so only server-side cost is measured; the model is stubbed.
+
+Run from calc-be/:  python -m bench.bench_upload [--size 3840x2160] [--requests 20] [--photo]
+"""
+import argparse
+import asyncio
+import base64
+import json
+import resource
+import subprocess
+import sys
+import time
+import tracemalloc
+
+CHUNK = 64 * 1024
+
+
+async def call_asgi(app, path, body: bytes, headers):
+    chunks = [body[i:i + CHUNK] for i in range(0, len(body), CHUNK)] or [b'']
+    received = []
+    status = {}
+
+    async def receive():
+        chunk = chunks.pop(0)
+        return {'type': 'http.request', 'body': chunk, 'more_body': bool(chunks)}
+
+    async def send(message):
+        if message['type'] == 'http.response.start':
+            status['code'] = message['status']
+        elif message['type'] == 'http.response.body':
+            received.append(message.get('body', b''))
+
+    scope = {
+        'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'method': 'POST',
+        'scheme': 'http', 'path': path, 'raw_path': path.encode(), 'query_string': b'',
+        'root_path': '', 'client': ('127.0.0.1', 1), 'server': ('127.0.0.1', 80),
+        'headers': [(k.lower().encode(), v.encode()) for k, v in headers.items()],
+    }
+    await app(scope, receive, send)
+    return status['code'], b''.join(received)
+
+
+def worker(path_kind, size, requests, photo):
+    from apps.calculator import backends, pipeline
+    from bench.canvases import render_canvas, to_png
+    import main
+
+    backends.enable_stub_backend()
+    backends.RECOGNITION_BACKEND = 'stub'
+    pipeline.result_cache.max_entries = 0  # measure the full decode path every time
+
+    width, height = size
+    png = to_png(render_canvas(size, expressions=['44.55 + 55.33', 'x = 5', '12 * 7', '10 / 3'], photo=photo))
+    if path_kind == 'json':
+        url = 'data:image/png;base64,' + base64.b64encode(png).decode()
+        body = json.dumps({'image': url, 'dict_of_vars': {'x': 5}}).encode()
+        path, headers = '/calculator/process', {'content-type': 'application/json'}
+    else:
+        body = png
+        path, headers = '/calculator/process/raw', {'content-type': 'image/png', 'x-dict-of-vars': '{"x": 5}'}
+    headers['content-length'] = str(len(body))
+    del png
+
+    async def run_all():
+        # Warm up imports and pools before measuring
+        await call_asgi(main.app, path, body, headers)
+        baseline_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        tracemalloc.start()
+        cpu_start = time.process_time()
+        wall_start = time.perf_counter()
+        for _ in range(requests):
+            code, _ = await call_asgi(main.app, path, body, headers)
+            assert code == 200, code
+        cpu = (time.process_time() - cpu_start) / requests
+        wall = (time.perf_counter() - wall_start) / requests
+        _, traced_peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return {
+            'path': path,
+            'body_bytes': len(body),
+            'cpu_ms_per_request': round(cpu * 1000, 2),
+            'wall_ms_per_request': round(wall * 1000, 2),
+            'traced_peak_kib': traced_peak // 1024,
+            'rss_growth_kib': peak_rss - baseline_rss,
+            'peak_rss_kib': peak_rss,
+        }
+
+    print(json.dumps(asyncio.run(run_all())))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--size', default='3840x2160')
+    parser.add_argument('--requests', type=int, default=20)
+    parser.add_argument('--photo', action='store_true', help='include an uploaded-picture region (~1 MB PNG at 4K)')
+    parser.add_argument('--worker', choices=['json', 'raw'])
+    args = parser.parse_args()
+    size = tuple(int(v) for v in args.size.split('x'))
+
+    if args.worker:
+        worker(args.worker, size, args.requests, args.photo)
+        return
+
+    results = []
+    for kind in ('json', 'raw'):
+        out = subprocess.run(
+            [sys.executable, '-W', 'ignore', '-m', 'bench.bench_upload', '--worker', kind,
+             '--size', args.size, '--requests', str(args.requests)] + (['--photo'] if args.photo else []),
+            capture_output=True, text=True, check=True,
+        )
+        results.append(json.loads(out.stdout.strip().splitlines()[-1]))
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
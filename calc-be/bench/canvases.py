@@ -0,0 +1,56 @@
+"""Synthetic canvases that look like what the frontend posts: a dark full-window
+canvas with a few white handwritten-size expressions on it."""
+import base64
+import io
+import random
+from PIL import Image, ImageDraw, ImageFont
+
+BACKGROUND = '#1A1B1E'
+INK = '#FFFFFF'
+
+SCREENS = {
+    'laptop': (1366, 768),
+    'fullhd': (1920, 1080),
+    '4k': (3840, 2160),
+}
+
+EXPRESSIONS = ['44.55 + 55.33', 'x = 5', '12 * 7', '10 / 3', '2 + 2']
+
+
+def load_font(name, size):
+    """Pillow's default font, or a TrueType font looked up by file name (DejaVuSans.ttf)."""
+    if name is None:
+        return ImageFont.load_default(size=size)
+    return ImageFont.truetype(name, size)
+
+
+def render_canvas(size, expressions=EXPRESSIONS[:2], seed=0, photo=False, font=None):
+    """Draw expressions on a blank canvas; photo=True also pastes a noisy image,
+    like a picture uploaded onto the canvas, which makes the PNG much larger.
+    `font` names a TrueType file to draw with instead of Pillow's default, which
+    the local engine's templates are rendered from."""
+    rng = random.Random(seed)
+    width, height = size
+    img = Image.new('RGBA', size, BACKGROUND)
+    if photo:
+        noise = Image.effect_noise((width // 3, height // 3), 64).convert('RGBA')
+        img.paste(noise, (width - width // 3 - width // 20, height - height // 3 - height // 20))
+    draw = ImageDraw.Draw(img)
+    font_size = max(height // 12, 24)
+    font = load_font(font, font_size)
+    y = rng.randint(height // 10, height // 5)
+    for expr in expressions:
+        x = rng.randint(width // 10, width // 4)
+        draw.text((x, y), expr, fill=INK, font=font, stroke_width=max(font_size // 24, 1), stroke_fill=INK)
+        y += int(font_size * 1.8)
+    return img
+
+
+def to_png(img) -> bytes:
+    buffer = io.BytesIO()
+    img.save(buffer, format='PNG')
+    return buffer.getvalue()
+
+
+def to_data_url(img) -> str:
+    return 'data:image/png;base64,' + base64.b64encode(to_png(img)).decode()
@@ -0,0 +1,56 @@
+"""The API as bench_e2e runs it.
+
+It runs in its own process so that its peak memory is measured on its own.
+MongoDB is replaced by in-memory fakes unless --mongo-url is given. Either way,
+the users bench0@example.com ... bench{N-1}@example.com exist. Model calls go
+wherever GEMINI_API_ENDPOINT points; bench_e2e sets that.
+
+Run from calc-be/:  python -m bench.e2e_server [--port 8982] [--users 32] [--mongo-url mongodb://localhost:27017]
+"""
+import argparse
+import os
+from datetime import datetime
+
+
+def bench_users(count: int) -> list:
+    return [
+        {'email': f'bench{i}@example.com', 'name': f'Bench {i}', 'role': 'user', 'created_at': datetime.utcnow()}
+        for i in range(count)
+    ]
+
+
+def seed_mongo(url: str, users: list):
+    from pymongo import MongoClient, UpdateOne
+    from auth.db import DATABASE_NAME
+    client = MongoClient(url, serverSelectionTimeoutMS=3000)
+    client[DATABASE_NAME].users.bulk_write(
+        [UpdateOne({'email': user['email']}, {'$setOnInsert': user}, upsert=True) for user in users]
+    )
+    client.close()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--port', type=int, default=8982)
+    parser.add_argument('--users', type=int, default=32)
+    parser.add_argument('--mongo-url', help='use this MongoDB instead of in-memory fakes')
+    args = parser.parse_args()
+
+    if args.mongo_url:
+        # auth.db reads this at import
+        os.environ['MONGODB_URL'] = args.mongo_url
+    import uvicorn
+    import main as app_module
+    from auth import router as auth_router
+
+    if args.mongo_url:
+        seed_mongo(args.mongo_url, bench_users(args.users))
+    else:
+        from bench.fakes import FakeCollection
+        auth_router.users_collection = FakeCollection(bench_users(args.users), name='users')
+        auth_router.sessions_collection = FakeCollection(name='sessions')
+    uvicorn.run(app_module.app, host='127.0.0.1', port=args.port, log_level='warning')
+
+
+if __name__ == '__main__':
+    main()
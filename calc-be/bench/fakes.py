@@ -0,0 +1,135 @@
+"""In-memory stand-ins used by the benchmarks so they run without MongoDB or Gemini."""
+import copy
+from types import SimpleNamespace
+from bson import ObjectId
+
+
+def _matches(doc, query):
+    for key, expected in query.items():
+        value = doc.get(key)
+        if isinstance(expected, dict):
+            for op, operand in expected.items():
+                if op == '$gt' and not (value is not None and value > operand):
+                    return False
+                if op == '$lt' and not (value is not None and value < operand):
+                    return False
+                if op == '$in' and value not in operand:
+                    return False
+        elif value != expected:
+            return False
+    return True
+
+
+class FakeCursor:
+    def __init__(self, docs):
+        self.docs = docs
+
+    def sort(self, key, direction=1):
+        self.docs.sort(key=lambda doc: doc.get(key), reverse=direction < 0)
+        return self
+
+    def skip(self, count):
+        self.docs = self.docs[count:]
+        return self
+
+    def __aiter__(self):
+        return self._iterate()
+
+    async def _iterate(self):
+        for doc in self.docs:
+            yield doc
+
+
+class FakeCollection:
+    """The subset of the motor collection API used by auth/router.py."""
+
+    def __init__(self, docs=None, name='fake'):
+        self.docs = [{'_id': ObjectId(), **copy.deepcopy(d)} for d in docs or []]
+        self.name = name
+        self.calls = 0
+        self.indexes = []
+
+    async def create_indexes(self, indexes):
+        self.indexes.extend(index.document['name'] for index in indexes)
+        return list(self.indexes)
+
+    def find(self, query, *args, **kwargs):
+        self.calls += 1
+        return FakeCursor([copy.deepcopy(doc) for doc in self.docs if _matches(doc, query)])
+
+    async def find_one(self, query, *args, **kwargs):
+        self.calls += 1
+        for doc in self.docs:
+            if _matches(doc, query):
+                return copy.deepcopy(doc)
+        return None
+
+    async def insert_one(self, doc):
+        self.calls += 1
+        doc = dict(doc)
+        doc.setdefault('_id', ObjectId())
+        self.docs.append(doc)
+        return SimpleNamespace(inserted_id=doc['_id'])
+
+    async def update_one(self, query, update, upsert=False):
+        self.calls += 1
+        for doc in self.docs:
+            if _matches(doc, query):
+                doc.update(update.get('$set', {}))
+                for key in update.get('$unset', {}):
+                    doc.pop(key, None)
+                return SimpleNamespace(matched_count=1, modified_count=1, upserted_id=None)
+        if upsert:
+            doc = {**{k: v for k, v in query.items() if not isinstance(v, dict)}, **update.get('$set', {})}
+            doc['_id'] = ObjectId()
+            self.docs.append(doc)
+            return SimpleNamespace(matched_count=0, modified_count=0, upserted_id=doc['_id'])
+        return SimpleNamespace(matched_count=0, modified_count=0, upserted_id=None)
+
+    async def delete_one(self, query):
+        self.calls += 1
+        for doc in self.docs:
+            if _matches(doc, query):
+                self.docs.remove(doc)
+                return SimpleNamespace(deleted_count=1)
+        return SimpleNamespace(deleted_count=0)
+
+    async def delete_many(self, query):
+        self.calls += 1
+        kept = [doc for doc in self.docs if not _matches(doc, query)]
+        deleted, self.docs = len(self.docs) - len(kept), kept
+        return SimpleNamespace(deleted_count=deleted)
+
+    async def bulk_write(self, requests, ordered=True):
+        self.calls += 1
+        for request in requests:
+            # pymongo's UpdateOne keeps its filter and document in private slots
+            await self.update_one(request._filter, request._doc)
+            self.calls -= 1
+        return SimpleNamespace(modified_count=len(requests))
+
+    async def update_many(self, query, update):
+        self.calls += 1
+        matched = [doc for doc in self.docs if _matches(doc, query)]
+        for doc in matched:
+            doc.update(update.get('$set', {}))
+        return SimpleNamespace(matched_count=len(matched), modified_count=len(matched))
+
+
+def install_fake_auth_store(email='bench@example.com', name='Bench User'):
+    """Swap the auth router's collections for in-memory ones holding one user with a live session."""
+    from datetime import datetime, timedelta
+    from auth import router as auth_router
+    from auth.sessions import token_hash
+
+    users = FakeCollection([{'email': email, 'name': name, 'role': 'user', 'created_at': datetime.utcnow()}], name='users')
+    token = auth_router.create_access_token({'sub': email, 'name': name, 'role': 'user'})
+    sessions = FakeCollection([{
+        'user_id': email,
+        'token_hash': token_hash(token),
+        'created_at': datetime.utcnow(),
+        'expires_at': datetime.utcnow() + timedelta(days=1),
+    }], name='sessions')
+    auth_router.users_collection = users
+    auth_router.sessions_collection = sessions
+    return token, users, sessions
@@ -0,0 +1,117 @@
+"""Load test: /auth/verify latency while /calculator/process is saturated.
+
+The model call is replaced by the stub backend's blocking sleep, which is what
+the synchronous Gemini SDK does to the calling thread. Before analysis moved off
+the event loop every verify request queued behind it; now its p99 should barely move.
+
+Run from calc-be/:  python -m bench.load_auth_latency [--model-latency 1.5] [--concurrency 12]
+"""
+import argparse
+import asyncio
+import json
+import statistics
+import threading
+import time
+import httpx
+import uvicorn
+from bench.canvases import render_canvas, to_data_url
+from bench.fakes import install_fake_auth_store
+
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    return ordered[min(int(len(ordered) * pct / 100), len(ordered) - 1)]
+
+
+def summarize(samples):
+    return {
+        'count': len(samples),
+        'p50_ms': round(statistics.median(samples) * 1000, 2),
+        'p99_ms': round(percentile(samples, 99) * 1000, 2),
+        'max_ms': round(max(samples) * 1000, 2),
+    }
+
+
+async def sample_verify(client, token, duration):
+    samples = []
+    deadline = time.perf_counter() + duration
+    while time.perf_counter() < deadline:
+        start = time.perf_counter()
+        response = await client.get('/auth/verify', headers={'Authorization': f'Bearer {token}'})
+        response.raise_for_status()
+        samples.append(time.perf_counter() - start)
+        await asyncio.sleep(0.01)
+    return samples
+
+
+async def flood_process(client, concurrency, duration):
+    statuses = {}
+    deadline = time.perf_counter() + duration
+
+    # Rendered up front so the load generator doesn't compete with the server for the GIL
+    images = [to_data_url(render_canvas((1280, 720), seed=seed)) for seed in range(concurrency)]
+
+    async def worker(seed):
+        # Distinct vars so the result cache can't absorb the load
+        payload = {'image': images[seed], 'dict_of_vars': {'seed': seed}}
+        while time.perf_counter() < deadline:
+            payload['dict_of_vars']['seed'] += concurrency
+            response = await client.post('/calculator/process', json=payload, timeout=60)
+            statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+            if response.status_code == 429:
+                await asyncio.sleep(float(response.headers.get('Retry-After', 1)))
+
+    await asyncio.gather(*(worker(i) for i in range(concurrency)))
+    return statuses
+
+
+async def run(args, base_url, token):
+    async with httpx.AsyncClient(base_url=base_url) as client:
+        idle = await sample_verify(client, token, args.duration / 2)
+        loaded, statuses = await asyncio.gather(
+            sample_verify(client, token, args.duration),
+            flood_process(client, args.concurrency, args.duration),
+        )
+    return {
+        'model_latency_s': args.model_latency,
+        'process_concurrency': args.concurrency,
+        'verify_idle': summarize(idle),
+        'verify_under_load': summarize(loaded),
+        'process_statuses': statuses,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--model-latency', type=float, default=1.5)
+    parser.add_argument('--concurrency', type=int, default=12)
+    parser.add_argument('--duration', type=float, default=6.0)
+    parser.add_argument('--port', type=int, default=8977)
+    args = parser.parse_args()
+
+    from apps.calculator import backends
+    import main as app_module
+
+    # The stub sleeps on the model thread exactly like the blocking SDK call
+    backends.RECOGNITION_BACKEND = 'stub'
+    backends.enable_stub_backend().latency_ms = int(args.model_latency * 1000)
+    token, users, sessions = install_fake_auth_store()
+
+    server = uvicorn.Server(uvicorn.Config(app_module.app, host='127.0.0.1', port=args.port, log_level='warning'))
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    while not server.started:
+        time.sleep(0.05)
+    try:
+        report = asyncio.run(run(args, f'http://127.0.0.1:{args.port}', token))
+    finally:
+        server.should_exit = True
+        thread.join()
+    verifies = report['verify_idle']['count'] + report['verify_under_load']['count']
+    # Includes the write-behind last_login flush made when the server shuts down
+    report['mongo_calls_per_verify'] = round((users.calls + sessions.calls) / verifies, 3)
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    main()
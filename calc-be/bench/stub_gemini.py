@@ -0,0 +1,110 @@
+"""A local stand-in for the Gemini generateContent REST API.
+
+Answers come from the recorded responses in bench/data/responses.jsonl. Each
+image is mapped to one recording by a hash of its bytes, so a replayed canvas
+always gets the same answer. Requests asking for JSON output
+(responseMimeType application/json) get the recording's rows as plain JSON.
+Other requests get the raw text as the model produced it: fences, prose,
+Python literals and so on. Multi-image requests get rows tagged with "image",
+as the batch prompt asks. Every call waits --latency-ms (± --jitter-ms) before
+answering. To misbehave like a struggling upstream, --error-rate of the calls
+fail with 503, and --slow-rate of them take --slow-ms instead. Point the API at
+it with
+
+    GEMINI_API_ENDPOINT=http://127.0.0.1:8981 GEMINI_API_KEY=stub
+
+Run from calc-be/:  python -m bench.stub_gemini [--port 8981] [--latency-ms 800] [--jitter-ms 200]
+                        [--error-rate 0.1] [--slow-rate 0.05] [--slow-ms 15000]
+"""
+import argparse
+import asyncio
+import base64
+import hashlib
+import json
+import random
+from pathlib import Path
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
+
+RECORDINGS = Path(__file__).parent / 'data' / 'responses.jsonl'
+STREAM_CHUNKS = 3
+
+
+def load_recordings():
+    with open(RECORDINGS, encoding='utf-8') as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def candidate(text: str) -> dict:
+    return {'candidates': [{'content': {'parts': [{'text': text}], 'role': 'model'}, 'finishReason': 'STOP', 'index': 0}]}
+
+
+def create_app(latency_ms: int = 0, jitter_ms: int = 0, seed: int = 0,
+               error_rate: float = 0, slow_rate: float = 0, slow_ms: int = 15000) -> FastAPI:
+    app = FastAPI()
+    app.state.requests = {'generate': 0, 'stream': 0, 'images': 0, 'failed': 0, 'slow': 0}
+    recordings = [r for r in load_recordings() if r['expected']]
+    rng = random.Random(seed)
+
+    async def delay():
+        if slow_rate and rng.random() < slow_rate:
+            app.state.requests['slow'] += 1
+            await asyncio.sleep(slow_ms / 1000)
+            return
+        wait = latency_ms + (rng.uniform(-jitter_ms, jitter_ms) if jitter_ms else 0)
+        if wait > 0:
+            await asyncio.sleep(wait / 1000)
+
+    def answer(body: dict) -> str:
+        images = [
+            base64.b64decode(part['inlineData']['data'])
+            for content in body.get('contents', [])
+            for part in content.get('parts', [])
+            if 'inlineData' in part
+        ]
+        app.state.requests['images'] += len(images)
+        picks = [recordings[int(hashlib.sha256(image).hexdigest(), 16) % len(recordings)] for image in images]
+        structured = body.get('generationConfig', {}).get('responseMimeType') == 'application/json'
+        if len(picks) == 1:
+            return json.dumps(picks[0]['expected']) if structured else picks[0]['raw']
+        return json.dumps([{**row, 'image': number} for number, pick in enumerate(picks, start=1) for row in pick['expected']])
+
+    @app.post('/v1beta/models/{method}')
+    async def generate(method: str, request: Request):
+        body = await request.json()
+        if error_rate and rng.random() < error_rate:
+            app.state.requests['failed'] += 1
+            await delay()
+            return JSONResponse({'error': {'code': 503, 'message': 'The model is overloaded.', 'status': 'UNAVAILABLE'}}, status_code=503)
+        text = answer(body)
+        if method.endswith(':streamGenerateContent'):
+            app.state.requests['stream'] += 1
+            # The REST transport reads a JSON array of partial responses
+            size = max(len(text) // STREAM_CHUNKS, 1)
+            chunks = [text[i:i + size] for i in range(0, len(text), size)] or ['']
+            await delay()
+            return [candidate(chunk) for chunk in chunks]
+        app.state.requests['generate'] += 1
+        await delay()
+        return candidate(text)
+
+    @app.get('/stats')
+    async def stats():
+        return app.state.requests
+
+    return app
+
+
+if __name__ == '__main__':
+    import uvicorn
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--port', type=int, default=8981)
+    parser.add_argument('--latency-ms', type=int, default=800)
+    parser.add_argument('--jitter-ms', type=int, default=200)
+    parser.add_argument('--error-rate', type=float, default=0)
+    parser.add_argument('--slow-rate', type=float, default=0)
+    parser.add_argument('--slow-ms', type=int, default=15000)
+    args = parser.parse_args()
+    app = create_app(args.latency_ms, args.jitter_ms, error_rate=args.error_rate, slow_rate=args.slow_rate, slow_ms=args.slow_ms)
+    uvicorn.run(app, host='127.0.0.1', port=args.port)
@@ -0,0 +1,72 @@
+"""A local stand-in for Google's OAuth endpoints.
+
+Any authorization code is accepted: the code `alice` logs in as
+alice@example.com. Each endpoint waits --latency-ms before answering to mimic
+the round trip to Google. Point the API at it with
+
+    GOOGLE_DISCOVERY_URL=http://127.0.0.1:8978/.well-known/openid-configuration
+
+or set GOOGLE_AUTH_URI / GOOGLE_TOKEN_URI / GOOGLE_USERINFO_URI individually.
+
+Run from calc-be/:  python -m bench.stub_oauth [--port 8978] [--latency-ms 80]
+"""
+import argparse
+import asyncio
+from urllib.parse import parse_qs
+from fastapi import FastAPI, Header, HTTPException, Request
+from fastapi.responses import RedirectResponse
+
+
+def create_app(latency_ms: int = 0) -> FastAPI:
+    app = FastAPI()
+    app.state.requests = {'discovery': 0, 'token': 0, 'userinfo': 0}
+
+    async def delay():
+        if latency_ms:
+            await asyncio.sleep(latency_ms / 1000)
+
+    @app.get('/.well-known/openid-configuration')
+    async def discovery(request: Request):
+        app.state.requests['discovery'] += 1
+        await delay()
+        base = str(request.base_url).rstrip('/')
+        return {
+            'issuer': base,
+            'authorization_endpoint': f'{base}/o/oauth2/auth',
+            'token_endpoint': f'{base}/token',
+            'userinfo_endpoint': f'{base}/userinfo',
+        }
+
+    @app.get('/o/oauth2/auth')
+    async def authorize(redirect_uri: str, state: str, login_hint: str = 'stub-user'):
+        # Consent is implied: send the browser straight back with a code
+        return RedirectResponse(f'{redirect_uri}?code={login_hint}&state={state}')
+
+    @app.post('/token')
+    async def token(request: Request):
+        app.state.requests['token'] += 1
+        await delay()
+        # Parsed by hand so the stub doesn't need python-multipart
+        form = {key: values[0] for key, values in parse_qs((await request.body()).decode()).items()}
+        if form.get('grant_type') != 'authorization_code' or 'code' not in form:
+            raise HTTPException(status_code=400, detail='invalid_grant')
+        return {'access_token': f"access-{form['code']}", 'token_type': 'Bearer', 'expires_in': 3599}
+
+    @app.get('/userinfo')
+    async def userinfo(authorization: str = Header(...)):
+        app.state.requests['userinfo'] += 1
+        await delay()
+        code = authorization.removeprefix('Bearer access-')
+        return {'email': f'{code}@example.com', 'name': code.title(), 'verified_email': True}
+
+    return app
+
+
+if __name__ == '__main__':
+    import uvicorn
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--port', type=int, default=8978)
+    parser.add_argument('--latency-ms', type=int, default=80)
+    args = parser.parse_args()
+    uvicorn.run(create_app(args.latency_ms), host='127.0.0.1', port=args.port)
@@ -8,3 +8,92 @@ PORT = '8900'
 ENV = 'dev'
 
 GEMINI_API_KEY = os.getenv('GEMINI_API_KEY')
+# Another Gemini API endpoint (e.g. bench/stub_gemini.py), reached over the REST transport
+GEMINI_API_ENDPOINT = os.getenv('GEMINI_API_ENDPOINT')
+
+# Result cache
+CACHE_MAX_ENTRIES = int(os.getenv('CACHE_MAX_ENTRIES', '512'))
+CACHE_TTL_SECONDS = int(os.getenv('CACHE_TTL_SECONDS', '3600'))
+REDIS_URL = os.getenv('REDIS_URL')
+
+# Canvas preprocessing before model upload
+PREPROCESS_MAX_SIDE = int(os.getenv('PREPROCESS_MAX_SIDE', '1024'))
+PREPROCESS_MODE = os.getenv('PREPROCESS_MODE', '1')  # '1' (bi-level), 'L' (grayscale) or 'off'
+PREPROCESS_MARGIN = int(os.getenv('PREPROCESS_MARGIN', '16'))
+INK_THRESHOLD = int(os.getenv('INK_THRESHOLD', '48'))
+
+# Analysis concurrency
+MODEL_CONCURRENCY = int(os.getenv('MODEL_CONCURRENCY', '8'))  # threads making model calls
+MAX_PENDING_ANALYSES = int(os.getenv('MAX_PENDING_ANALYSES', '16'))  # requests (or job pages) waiting on the model before 429
+IMAGE_WORKERS = int(os.getenv('IMAGE_WORKERS', '0'))  # >0 uses a process pool for decode/preprocess
+RETRY_AFTER_SECONDS = int(os.getenv('RETRY_AFTER_SECONDS', '2'))
+
+# Canvas segmentation into independently analyzed expression regions
+SEGMENT_REGIONS = os.getenv('SEGMENT_REGIONS', 'true').lower() == 'true'
+SEGMENT_ROW_GAP = int(os.getenv('SEGMENT_ROW_GAP', '48'))  # blank rows separating two lines
+SEGMENT_COL_GAP = int(os.getenv('SEGMENT_COL_GAP', '160'))  # blank columns separating two expressions on a line
+SEGMENT_MIN_INK = int(os.getenv('SEGMENT_MIN_INK', '16'))  # regions with fewer ink pixels are specks
+SEGMENT_MAX_REGIONS = int(os.getenv('SEGMENT_MAX_REGIONS', '12'))
+
+# Server-held canvases for incremental submission
+CANVAS_MAX_SESSIONS = int(os.getenv('CANVAS_MAX_SESSIONS', '64'))
+CANVAS_SESSION_TTL = int(os.getenv('CANVAS_SESSION_TTL', '900'))
+
+# 'solve' asks the model for results, 'transcribe' only for expressions (results are computed locally)
+RECOGNITION_MODE = os.getenv('RECOGNITION_MODE', 'solve')
+LOCAL_EVALUATION = os.getenv('LOCAL_EVALUATION', 'true').lower() == 'true'
+
+# Raw binary uploads
+RAW_UPLOAD_MAX_BYTES = int(os.getenv('RAW_UPLOAD_MAX_BYTES', str(16 * 1024 * 1024)))
+
+# Recognition backend: 'gemini', 'local' (offline glyph classifier), 'auto' (local, falling back to gemini) or 'stub'
+RECOGNITION_BACKEND = os.getenv('RECOGNITION_BACKEND', 'gemini')
+LOCAL_MIN_CONFIDENCE = float(os.getenv('LOCAL_MIN_CONFIDENCE', '0.8'))
+LOCAL_MIN_MARGIN = float(os.getenv('LOCAL_MIN_MARGIN', '0.1'))  # similarity of the best glyph over the runner-up
+# 'auto' only compares local reads with Gemini's until this is on; see bench_backends for accuracy on unseen fonts
+AUTO_SERVE_LOCAL = os.getenv('AUTO_SERVE_LOCAL', 'false').lower() == 'true'
+# The canned-answer 'stub' backend exists only when enabled, for benchmarks and tests
+STUB_BACKEND = os.getenv('STUB_BACKEND', 'false').lower() == 'true'
+STUB_LATENCY_MS = int(os.getenv('STUB_LATENCY_MS', '0'))
+
+# Micro-batching: pack concurrent requests' regions into one multi-image model call (1 disables)
+BATCH_MAX_SIZE = int(os.getenv('BATCH_MAX_SIZE', '4'))
+BATCH_MAX_WAIT_MS = int(os.getenv('BATCH_MAX_WAIT_MS', '20'))
+
+# Schema-constrained JSON output with a short fixed prompt instead of the long formatting instructions
+STRUCTURED_OUTPUT = os.getenv('STRUCTURED_OUTPUT', 'true').lower() == 'true'
+
+# Create the Gemini client at startup instead of on the first request (off suits serverless cold starts)
+PRELOAD_MODEL = os.getenv('PRELOAD_MODEL', 'false').lower() == 'true'
+
+# Per-request detail logs (payloads, raw model output): 'all', 'sampled' (LOG_SAMPLE_RATE of them) or 'off'
+VERBOSE_LOG = os.getenv('VERBOSE_LOG', 'sampled').lower()
+LOG_SAMPLE_RATE = float(os.getenv('LOG_SAMPLE_RATE', '0.01'))
+
+# Model call resilience
+MODEL_DEADLINE_SECONDS = float(os.getenv('MODEL_DEADLINE_SECONDS', '20'))  # total per call, retries included
+MODEL_RETRIES = int(os.getenv('MODEL_RETRIES', '2'))  # extra attempts after a transient error
+MODEL_HEDGE_PERCENTILE = float(os.getenv('MODEL_HEDGE_PERCENTILE', '0'))  # e.g. 95 sends a duplicate after the p95 latency; 0 disables
+MODEL_HEDGE_MIN_MS = int(os.getenv('MODEL_HEDGE_MIN_MS', '500'))
+MODEL_HEDGE_BUDGET = float(os.getenv('MODEL_HEDGE_BUDGET', '0.1'))  # at most this share of calls is duplicated
+BREAKER_WINDOW = int(os.getenv('BREAKER_WINDOW', '20'))  # recent attempts the failure ratio is taken over
+BREAKER_MIN_CALLS = int(os.getenv('BREAKER_MIN_CALLS', '10'))
+BREAKER_FAILURE_RATIO = float(os.getenv('BREAKER_FAILURE_RATIO', '0.5'))
+BREAKER_COOLDOWN_SECONDS = float(os.getenv('BREAKER_COOLDOWN_SECONDS', '30'))
+# While the breaker is open: 'none' fails fast, 'local' answers with the offline engine (uncached; see LOCAL_MIN_MARGIN)
+MODEL_FALLBACK = os.getenv('MODEL_FALLBACK', 'none')
+
+# Batch jobs: worksheets and multi-page uploads processed in the background
+JOB_WORKERS = int(os.getenv('JOB_WORKERS', '4'))  # pages processed concurrently
+JOB_MAX_PAGES = int(os.getenv('JOB_MAX_PAGES', '200'))
+JOB_MAX_JOBS = int(os.getenv('JOB_MAX_JOBS', '64'))  # jobs kept, oldest finished ones dropped first
+JOB_TTL = int(os.getenv('JOB_TTL', '3600'))
+JOB_UPLOAD_MAX_BYTES = int(os.getenv('JOB_UPLOAD_MAX_BYTES', str(64 * 1024 * 1024)))
+JOB_PDF_DPI = int(os.getenv('JOB_PDF_DPI', '150'))
+
+# Near-duplicate reuse: serve an image from a perceptually similar one recognized earlier (same backend and variables)
+PERCEPTUAL_CACHE = os.getenv('PERCEPTUAL_CACHE', 'false').lower() == 'true'
+PERCEPTUAL_THRESHOLD = int(os.getenv('PERCEPTUAL_THRESHOLD', '16'))  # Hamming distance, of 256 pHash bits
+PERCEPTUAL_MAX_BLOCK_DIFF = float(os.getenv('PERCEPTUAL_MAX_BLOCK_DIFF', '12'))  # mean gray levels over the most changed 8x8 block
+PERCEPTUAL_MAX_ENTRIES = int(os.getenv('PERCEPTUAL_MAX_ENTRIES', '2048'))  # ~4KB each
+PERCEPTUAL_VERIFY_RATE = float(os.getenv('PERCEPTUAL_VERIFY_RATE', '0.05'))  # share of hits re-recognized to measure false matches
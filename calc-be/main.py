@@ -1,10 +1,28 @@
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
+from fastapi.responses import PlainTextResponse
 from fastapi.middleware.cors import CORSMiddleware
 from apps.calculator.route import router as calculator_router
-from auth.router import router as auth_router
-from constants import SERVER_URL, PORT, ENV
-
-app = FastAPI()
+from apps.calculator.pool import model_executor
+from apps.calculator.jobs import job_queue
+from apps.calculator.utils import get_model
+from auth import router as auth
+from constants import SERVER_URL, PORT, ENV, PRELOAD_MODEL
+import metrics
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Heavy clients (Gemini SDK, MongoDB) are created on first use; long-running
+    # servers can warm the model in the background instead
+    if PRELOAD_MODEL:
+        model_executor.submit(get_model)
+    await auth.startup()
+    yield
+    await job_queue.close()
+    await auth.shutdown()
+
+app = FastAPI(lifespan=lifespan)
+app.add_middleware(metrics.MetricsMiddleware)
 
 # Configure CORS
 app.add_middleware(
@@ -16,13 +34,17 @@ app.add_middleware(
 )
 
 # Include routers
-app.include_router(auth_router, prefix="/auth", tags=["auth"])
+app.include_router(auth.router, prefix="/auth", tags=["auth"])
 app.include_router(calculator_router, prefix="/calculator", tags=["calculator"])
 
 @app.get("/")
 async def health():
     return {'message': 'Server is running'}
 
+@app.get("/metrics", response_class=PlainTextResponse, include_in_schema=False)
+async def prometheus_metrics():
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run("main:app", host=SERVER_URL, port=int(PORT), reload=(ENV == "dev"))
@@ -0,0 +1,223 @@
+"""In-process metrics, served in the Prometheus text format at GET /metrics.
+
+Counters and histograms are module-level so any module can record into them
+without a registry being passed around. Components that already keep their own
+statistics (result cache, limiter, single-flight, batchers, session cache)
+register a collector that is read at scrape time instead of being counted twice.
+
+Spans timed inside image worker processes (IMAGE_WORKERS > 0) stay in those
+processes; the API process still sees the whole decode in drawcal_stage_seconds
+through the route's own span around the worker call.
+"""
+import bisect
+import random
+import time
+from contextlib import contextmanager
+from threading import Lock
+from constants import VERBOSE_LOG, LOG_SAMPLE_RATE
+
+# Seconds; covers a cache hit (sub-millisecond) up to a slow model call
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def escape(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def label_text(labels: dict) -> str:
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{name}="{escape(value)}"' for name, value in labels.items()) + '}'
+
+
+def number_text(value) -> str:
+    if value == float('inf'):
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return str(value)
+
+
+class Counter:
+    kind = 'counter'
+
+    def __init__(self, name: str, help: str, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = Lock()
+
+    def inc(self, amount: float = 1, **labels):
+        key = tuple(str(labels.get(name, '')) for name in self.labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels) -> float:
+        with self._lock:
+            return self._values.get(tuple(str(labels.get(name, '')) for name in self.labels), 0)
+
+    def samples(self):
+        with self._lock:
+            items = list(self._values.items())
+        for key, value in items:
+            yield self.name, dict(zip(self.labels, key)), value
+
+
+class Histogram:
+    kind = 'histogram'
+
+    def __init__(self, name: str, help: str, labels=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        self._series = {}
+        self._lock = Lock()
+
+    def observe(self, value: float, **labels):
+        key = tuple(str(labels.get(name, '')) for name in self.labels)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                # Per-bucket (not cumulative) counts, sum, count
+                series = self._series[key] = [[0] * len(self.buckets), 0.0, 0]
+            index = bisect.bisect_left(self.buckets, value)
+            if index < len(self.buckets):
+                series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def samples(self):
+        with self._lock:
+            items = [(key, list(counts), total, count) for key, (counts, total, count) in self._series.items()]
+        for key, counts, total, count in items:
+            labels = dict(zip(self.labels, key))
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                yield self.name + '_bucket', {**labels, 'le': number_text(bound)}, cumulative
+            yield self.name + '_bucket', {**labels, 'le': '+Inf'}, count
+            yield self.name + '_sum', labels, round(total, 6)
+            yield self.name + '_count', labels, count
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+        self.collectors = []
+
+    def counter(self, name: str, help: str, labels=()) -> Counter:
+        metric = Counter(name, help, labels)
+        self.metrics.append(metric)
+        return metric
+
+    def histogram(self, name: str, help: str, labels=(), buckets=DEFAULT_BUCKETS) -> Histogram:
+        metric = Histogram(name, help, labels, buckets)
+        self.metrics.append(metric)
+        return metric
+
+    def collector(self, fn):
+        """Register fn() -> iterable of (name, kind, help, labels, value), read on every scrape."""
+        self.collectors.append(fn)
+        return fn
+
+    def render(self) -> str:
+        lines = []
+        for metric in self.metrics:
+            lines.append(f'# HELP {metric.name} {metric.help}')
+            lines.append(f'# TYPE {metric.name} {metric.kind}')
+            lines.extend(f'{name}{label_text(labels)} {number_text(value)}' for name, labels, value in metric.samples())
+        described = set()
+        for collect in self.collectors:
+            try:
+                samples = list(collect())
+            except Exception as e:
+                # A broken collector shouldn't take the whole scrape down
+                print(f"Metrics collector {getattr(collect, '__name__', collect)} failed: {e}")
+                continue
+            for name, kind, help, labels, value in samples:
+                if name not in described:
+                    described.add(name)
+                    lines.append(f'# HELP {name} {help}')
+                    lines.append(f'# TYPE {name} {kind}')
+                lines.append(f'{name}{label_text(labels)} {number_text(value)}')
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+
+stage_seconds = registry.histogram(
+    'drawcal_stage_seconds', 'Time spent in each processing stage', ('stage',))
+request_seconds = registry.histogram(
+    'drawcal_http_request_seconds', 'HTTP request latency by route', ('method', 'route', 'status'))
+errors_total = registry.counter(
+    'drawcal_errors_total', 'Errors by where they were caught', ('stage',))
+parse_fallbacks_total = registry.counter(
+    'drawcal_parse_fallbacks_total', 'Model output that needed a slower parsing path', ('kind',))
+log_lines_total = registry.counter(
+    'drawcal_verbose_log_lines_total', 'Verbose log lines, by whether they were written or dropped', ('outcome',))
+
+
+@contextmanager
+def span(stage: str):
+    """Time the enclosed block into drawcal_stage_seconds{stage=...}, even if it raises."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        stage_seconds.observe(time.perf_counter() - start, stage=stage)
+
+
+def verbose(*args):
+    """print() for per-request detail (payloads, raw responses), which costs real
+    I/O under load: VERBOSE_LOG='all' writes every line, 'sampled' about
+    LOG_SAMPLE_RATE of them, 'off' none. Errors should use plain print()."""
+    if VERBOSE_LOG == 'all' or (VERBOSE_LOG == 'sampled' and random.random() < LOG_SAMPLE_RATE):
+        log_lines_total.inc(outcome='written')
+        print(*args)
+    else:
+        log_lines_total.inc(outcome='dropped')
+
+
+def render() -> str:
+    return registry.render()
+
+
+def route_template(scope) -> str:
+    """The matched route with its parameters put back, e.g. /calculator/canvas/{canvas_id}."""
+    if 'route' not in scope:
+        return 'unmatched'
+    path = scope['path']
+    for name, value in scope.get('path_params', {}).items():
+        path = path.replace(f'/{value}', '/{' + name + '}', 1)
+    return path
+
+
+class MetricsMiddleware:
+    """ASGI middleware observing drawcal_http_request_seconds per route template
+    (/canvas/{canvas_id}, not the concrete path, so ids don't explode the series).
+    Streaming responses are timed until their last byte is sent."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+        start = time.perf_counter()
+        status = 500
+
+        async def send_with_status(message):
+            nonlocal status
+            if message['type'] == 'http.response.start':
+                status = message['status']
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            request_seconds.observe(
+                time.perf_counter() - start, method=scope['method'], route=route_template(scope), status=status,
+            )
@@ -1,5 +1,21 @@
 from pydantic import BaseModel
+from typing import List, Optional
 
 class ImageData(BaseModel):
     image: str
-    dict_of_vars: dict
\ No newline at end of file
+    dict_of_vars: dict
+    backend: Optional[str] = None
+
+class CanvasPatch(BaseModel):
+    x: int
+    y: int
+    image: str
+    dict_of_vars: dict = {}
+
+class VariablesUpdate(BaseModel):
+    dict_of_vars: dict
+
+class BatchJob(BaseModel):
+    images: List[str]
+    dict_of_vars: dict = {}
+    backend: Optional[str] = None
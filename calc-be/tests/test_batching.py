@@ -0,0 +1,55 @@
+import asyncio
+from apps.calculator.backends import StubBackend
+from apps.calculator.batching import MicroBatcher
+
+
+class PartialBackend(StubBackend):
+    """Answers a batch for every image but the last, like a model that skipped one."""
+
+    def recognize_batch(self, items):
+        answers = super().recognize_batch(items)
+        return answers[:-1] + [None] if len(items) > 1 else answers
+
+
+def submit_all(batcher, count):
+    async def run():
+        return await asyncio.gather(*(batcher.submit(None, {}) for _ in range(count)))
+    return asyncio.run(run())
+
+
+def test_full_batch_is_one_call():
+    backend = StubBackend()
+    batcher = MicroBatcher(backend, max_size=4, max_wait_ms=1000)
+    results = submit_all(batcher, 4)
+    assert len(results) == 4 and all(rows[0]['expr'] == '2 + 2' for rows in results)
+    assert backend.calls == 1
+    assert batcher.stats()['batched_images'] == 4
+
+
+def test_partial_batch_is_sent_after_max_wait():
+    backend = StubBackend()
+    batcher = MicroBatcher(backend, max_size=8, max_wait_ms=10)
+    assert len(submit_all(batcher, 3)) == 3
+    assert backend.calls == 1
+
+
+def test_images_missing_from_a_batched_answer_are_retried_alone():
+    backend = PartialBackend()
+    batcher = MicroBatcher(backend, max_size=3, max_wait_ms=1000)
+    results = submit_all(batcher, 3)
+    assert all(rows is not None for rows in results)
+    assert batcher.stats()['fallbacks'] == 1
+    assert backend.calls == 2
+
+
+def test_a_failed_call_fails_every_image_in_it():
+    class Failing(StubBackend):
+        def recognize_batch(self, items):
+            raise ConnectionError("reset")
+
+    batcher = MicroBatcher(Failing(), max_size=2, max_wait_ms=1000)
+
+    async def run():
+        return await asyncio.gather(batcher.submit(None, {}), batcher.submit(None, {}), return_exceptions=True)
+
+    assert all(isinstance(e, ConnectionError) for e in asyncio.run(run()))
@@ -0,0 +1,109 @@
+import time
+import pytest
+from apps.calculator.evaluator import EvaluationError, evaluate, normalize_vars, parse, reconcile
+from apps.calculator.vargraph import evaluate_rows
+
+
+def test_parse_plain_expressions_and_assignments():
+    assert parse('2 + 2')[0] is None
+    assert parse('2 + 2 =')[0] is None
+    assert parse('x = 5')[0] == 'x'
+    assert evaluate('e = 3', {}) == ('3', 'e', 3)
+
+
+@pytest.mark.parametrize('expr', ['2x + 3 = 13', 'x^2 + 2x + 1 = 0', '2 + 2 = 5', 'sin(30)', 'cos(pi) + 1'])
+def test_equations_and_trigonometry_are_not_evaluated(expr):
+    with pytest.raises(EvaluationError):
+        parse(expr)
+
+
+def test_parse_rejects_non_arithmetic():
+    for expr in ['', 'import os', '__import__("os")', 'x' * 300, '2 +']:
+        with pytest.raises(EvaluationError):
+            evaluate(expr, {})
+
+
+def test_symbols_and_implicit_multiplication():
+    assert evaluate('3 × 4 ÷ 2', {})[0] == '6'
+    assert evaluate('2x', {'x': 3})[0] == '6'
+    assert evaluate('2(3 + 1)', {})[0] == '8'
+    assert evaluate('√(16)', {})[0] == '4'
+
+
+def test_assignment_returns_target_and_value():
+    assert evaluate('y = 2 * x + 1', {'x': 5}) == ('11', 'y', 11)
+
+
+def test_unknown_variable():
+    with pytest.raises(EvaluationError):
+        evaluate('z + 1', {})
+
+
+def test_scientific_notation_is_a_literal():
+    assert evaluate('1e-3 * 2', {})[0] == '0.002'
+    assert evaluate('2.5E3 + 1', {})[0] == '2501'
+    # Without an exponent it is still 2 times Euler's number
+    assert evaluate('2e', {})[0] == '5.436564'
+
+
+def test_nested_powers_are_capped_quickly():
+    start = time.perf_counter()
+    for expr in ['((9^999)^999)^999', '9^999^999', '(2^999)^999']:
+        with pytest.raises(EvaluationError):
+            evaluate(expr, {})
+    assert time.perf_counter() - start < 1
+
+
+def test_overflow_and_division_by_zero():
+    for expr in ['1 / 0', '10.0 ^ 999', 'exp(1000)']:
+        with pytest.raises(EvaluationError):
+            evaluate(expr, {})
+
+
+@pytest.mark.parametrize('expr', ['sqrt((-8)^(1/3))', '((-8)^0.5) % 2', '(-8)^0.5', 'sqrt(-1)', 'abs((-1)^0.5)'])
+def test_complex_values_are_rejected(expr):
+    with pytest.raises(EvaluationError):
+        evaluate(expr, {})
+
+
+def test_normalize_vars_takes_names_from_assignment_keys():
+    assert normalize_vars({'x = 5': '5', 'y': 2.5, '2 + 2': 4, 'z': 'abc'}) == {'x': 5, 'y': 2.5}
+
+
+def test_reconcile_keeps_model_precision():
+    assert reconcile('0.000001', 6e-7, '0.0000006') == ('0.0000006', True)
+    assert reconcile('0.000001', 6e-7, '0.0000009') == ('0.0000006', False)
+    assert reconcile('3.333333', 10 / 3, '3.333') == ('3.333333', True)
+    assert reconcile('4', 4, '5') == ('4', False)
+
+
+def test_equations_keep_the_model_answer():
+    rows = evaluate_rows([
+        {'expr': '2x + 3 = 13', 'result': '5', 'assign': False},
+        {'expr': 'x^2 + 2x + 1 = 0', 'result': '-1', 'assign': False},
+    ], {'x = 5': 5})
+    assert [row['result'] for row in rows] == ['5', '-1']
+    assert not any(row['verified'] or row.get('corrected') for row in rows)
+
+
+def test_trigonometry_keeps_the_model_answer():
+    rows = evaluate_rows([{'expr': 'sin(30)', 'result': '0.5', 'assign': False}], {})
+    assert rows[0]['result'] == '0.5'
+    assert rows[0]['verified'] is False and 'corrected' not in rows[0]
+
+
+def test_non_numeric_model_answers_are_left_alone():
+    rows = evaluate_rows([{'expr': 'x = 2 + 3', 'result': 'x = 5', 'assign': True}], {})
+    assert rows[0]['result'] == 'x = 5'
+    assert rows[0]['verified'] is False and 'corrected' not in rows[0]
+
+
+def test_constants_can_be_assigned():
+    rows = evaluate_rows([
+        {'expr': 'e = 3', 'result': '3', 'assign': True},
+        {'expr': 'e + 1', 'result': '4', 'assign': False},
+        {'expr': 'pi * 2', 'result': '6.283', 'assign': False},
+    ], {})
+    assert [row['result'] for row in rows] == ['3', '4', '6.283185']
+    assert rows[0]['assign'] is True
+    assert all(row['verified'] and not row.get('corrected') for row in rows)
@@ -0,0 +1,9 @@
+import pytest
+from apps.calculator.glyphs import TIMES_X
+
+
+@pytest.mark.parametrize('text, expected', [
+    ('6x7', '6*7'), ('(3+4)x2', '(3+4)*2'), ('x*3', 'x*3'), ('x=5', 'x=5'), ('2x+1', '2x+1'), ('y=x', 'y=x'),
+])
+def test_x_is_a_times_sign_only_between_operands(text, expected):
+    assert TIMES_X.sub('*', text) == expected
@@ -0,0 +1,26 @@
+import ast
+from pathlib import Path
+from auth.indexes import query_shapes
+
+ROUTER = Path(__file__).resolve().parent.parent / 'auth' / 'router.py'
+COLLECTIONS = {'users_collection': 'users', 'sessions_collection': 'sessions'}
+READS_AND_WRITES = {'find', 'find_one', 'update_one', 'update_many', 'delete_one', 'delete_many', 'count_documents'}
+
+
+def router_queries() -> set:
+    """(collection, operation, filter keys) of every collection call in auth/router.py."""
+    queries = set()
+    for node in ast.walk(ast.parse(ROUTER.read_text())):
+        if not (isinstance(node, ast.Call) and isinstance(node.func, ast.Attribute)
+                and isinstance(node.func.value, ast.Name) and node.func.value.id in COLLECTIONS
+                and node.func.attr in READS_AND_WRITES):
+            continue
+        query = node.args[0]
+        assert isinstance(query, ast.Dict), f"line {node.lineno}: filter is not a dict literal"
+        queries.add((COLLECTIONS[node.func.value.id], node.func.attr, frozenset(key.value for key in query.keys)))
+    return queries
+
+
+def test_every_router_query_is_audited():
+    audited = {(collection, operation, frozenset(query)) for collection, operation, query, _ in query_shapes()}
+    assert router_queries() == audited
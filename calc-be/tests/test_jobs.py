@@ -0,0 +1,42 @@
+import asyncio
+import io
+import pytest
+from PIL import Image
+from apps.calculator import backends
+from apps.calculator.jobs import Job, JobQueue
+from apps.calculator.pages import PageSource
+
+
+def pdf_of(pages: int) -> bytes:
+    buffer = io.BytesIO()
+    images = [Image.new('RGB', (200, 100), 'white') for _ in range(pages)]
+    images[0].save(buffer, format='PDF', save_all=True, append_images=images[1:])
+    return buffer.getvalue()
+
+
+def test_pdf_is_parsed_once_and_closed():
+    source = PageSource('pdf', bytearray(pdf_of(3)))
+    assert len(source) == 3
+    assert [source.load(i).size for i in range(3)] == [source.load(0).size] * 3
+    source.close()
+    with pytest.raises(ValueError):
+        source.load(0)
+
+
+def test_cancelled_job_stays_pollable():
+    backends.enable_stub_backend()
+
+    async def run():
+        queue = JobQueue(workers=1)
+        images = [Image.new('RGB', (64, 64), 'white') for _ in range(4)]
+        buffer = io.BytesIO()
+        images[0].save(buffer, format='TIFF', save_all=True, append_images=images[1:])
+        job = queue.submit(Job(PageSource('tiff', bytearray(buffer.getvalue())), {}, 'stub'))
+        queue.cancel(job.id)
+        await asyncio.sleep(0.05)
+        await queue.close()
+        return queue.get(job.id).summary()
+
+    summary = asyncio.run(run())
+    assert summary['status'] == 'cancelled'
+    assert summary['results'] == []
@@ -0,0 +1,26 @@
+from apps.calculator.parser import ObjectStreamParser, parse_answers
+
+ROWS = '{"expr": "1+1", "result": 2, "assign": false}'
+
+
+def test_quote_inside_an_unquoted_value_does_not_open_a_string():
+    text = "[{expr: f'(x), result: 2, assign: false}, " + ROWS + "]"
+    assert [row['expr'] for row in parse_answers(text)] == ["f'(x)", '1+1']
+
+
+def test_braces_and_apostrophes_inside_strings():
+    rows = parse_answers("""[{'expr': "it's {x}", 'result': 'a}b', "assign": False}]""")
+    assert rows == [{'expr': "it's {x}", 'result': 'a}b', 'assign': False}]
+
+
+def test_unclosed_object_is_reread_from_its_next_brace():
+    text = '[{"expr": "2 +", "result": ' + ROWS + ', ' + ROWS.replace('1+1', '3*3') + ']'
+    assert [row['expr'] for row in parse_answers(text)] == ['1+1', '3*3']
+
+
+def test_chunked_feed_matches_whole_text():
+    text = "Here you go:\n```json\n[{expr: f'(x), result: 2}, " + ROWS + ", {\"expr\": \"x = 5\", "
+    parser = ObjectStreamParser()
+    rows = [row for i in range(0, len(text), 3) for row in parser.feed(text[i:i + 3])] + parser.finish()
+    assert rows == parse_answers(text)
+    assert [row['expr'] for row in rows] == ["f'(x)", '1+1']
@@ -0,0 +1,22 @@
+import asyncio
+import pytest
+from fastapi import HTTPException
+from starlette.requests import Request
+from apps.calculator.route import read_body
+
+
+def request_with(length: bytes, body: bytes = b'xxxx') -> Request:
+    async def receive():
+        return {'type': 'http.request', 'body': body, 'more_body': False}
+    return Request({'type': 'http', 'method': 'POST', 'headers': [(b'content-length', length)]}, receive)
+
+
+@pytest.mark.parametrize('length', [b'abc', b'-5', b'1e3', b'\xb2', b'\xd9\xa4'])
+def test_malformed_content_length_is_a_400(length):
+    with pytest.raises(HTTPException) as e:
+        asyncio.run(read_body(request_with(length)))
+    assert e.value.status_code == 400
+
+
+def test_body_matching_content_length_is_read():
+    assert asyncio.run(read_body(request_with(b'4'))) == b'xxxx'
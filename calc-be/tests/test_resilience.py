@@ -0,0 +1,116 @@
+import asyncio
+import threading
+import time
+import pytest
+from PIL import Image
+from apps.calculator import backends, pipeline
+from apps.calculator.backends import GeminiBackend, StubBackend
+from apps.calculator.cache import result_cache
+from apps.calculator.resilience import CircuitBreaker, CircuitOpen, ModelClient
+
+
+def failing_breaker(**kwargs):
+    breaker = CircuitBreaker(window=4, min_calls=4, failure_ratio=0.5, **kwargs)
+    for _ in range(4):
+        assert breaker.allow()
+        breaker.record(False)
+    return breaker
+
+
+def test_breaker_opens_and_probes_once_after_cooldown():
+    breaker = failing_breaker(cooldown=0.05)
+    assert breaker.state == 'open' and not breaker.allow()
+    time.sleep(0.06)
+    assert breaker.allow()
+    # Only one probe while it is out
+    assert not breaker.allow()
+    breaker.record(True)
+    assert breaker.state == 'closed' and breaker.allow()
+
+
+def test_failed_probe_reopens_the_breaker():
+    breaker = failing_breaker(cooldown=0.05)
+    time.sleep(0.06)
+    assert breaker.allow()
+    breaker.record(False)
+    assert breaker.state == 'open' and breaker.opened == 2
+
+
+def test_expired_deadline_does_not_take_the_probe():
+    breaker = failing_breaker(cooldown=0)
+    client = ModelClient(deadline=1, retries=0, breaker=breaker)
+    with pytest.raises(TimeoutError):
+        client._attempt(lambda timeout: 'late', time.monotonic() - 1)
+    assert client.call(lambda timeout: 'ok') == 'ok'
+    assert breaker.state == 'closed'
+
+
+def test_open_breaker_refuses_calls():
+    client = ModelClient(retries=0, breaker=failing_breaker(cooldown=60))
+    with pytest.raises(CircuitOpen):
+        client.call(lambda timeout: 'ok')
+
+
+def test_transient_errors_are_retried():
+    attempts = []
+
+    def flaky(timeout):
+        attempts.append(timeout)
+        if len(attempts) < 3:
+            raise ConnectionError("reset")
+        return 'ok'
+
+    assert ModelClient(deadline=5, retries=2).call(flaky) == 'ok'
+    assert len(attempts) == 3
+    assert all(0 < timeout <= 5 for timeout in attempts)
+
+
+def test_other_errors_are_not_retried_or_counted_against_upstream():
+    attempts = []
+
+    def rejected(timeout):
+        attempts.append(timeout)
+        raise ValueError("blocked content")
+
+    client = ModelClient(retries=2)
+    with pytest.raises(ValueError):
+        client.call(rejected)
+    assert len(attempts) == 1
+    assert client.breaker._outcomes.count(False) == 0
+
+
+def test_slow_attempt_is_hedged():
+    client = ModelClient(deadline=5, retries=0, hedge_percentile=50, hedge_min_ms=0, hedge_budget=1)
+    client._latencies.extend([0.01] * 20)
+    lock, calls = threading.Lock(), []
+
+    def answer(timeout):
+        with lock:
+            calls.append(timeout)
+            first = len(calls) == 1
+        if first:
+            time.sleep(0.5)
+            return 'primary'
+        return 'hedge'
+
+    start = time.perf_counter()
+    assert client.call(answer) == 'hedge'
+    assert time.perf_counter() - start < 0.4
+    assert client.hedges == 1
+
+
+def test_fallback_answers_are_served_but_not_cached(monkeypatch):
+    def open_circuit(*args):
+        raise CircuitOpen("open")
+
+    monkeypatch.setattr(backends, 'analyze_image', open_circuit)
+    monkeypatch.setattr(backends, 'analyze_images', open_circuit)
+    # Batchers are kept per backend name; don't leave one behind for this instance
+    monkeypatch.setattr(pipeline, 'batching_enabled', lambda backend: False)
+    backend = GeminiBackend(fallback=StubBackend())
+    image = Image.new('RGB', (32, 32), 'white')
+    key = pipeline.region_cache_key(image, {}, backend)
+
+    rows = asyncio.run(pipeline.recognize_and_cache(key, backend, image, {}))
+    assert rows[0]['fallback'] is True
+    assert asyncio.run(result_cache.get(key)) is None
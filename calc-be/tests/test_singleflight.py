@@ -0,0 +1,87 @@
+import asyncio
+import pytest
+from fastapi import HTTPException
+from apps.calculator.pipeline import recognize_shared
+from apps.calculator.pool import Admission, AnalysisLimiter
+from apps.calculator.singleflight import SingleFlight
+
+
+def counted(result, delay=0.01):
+    calls = []
+
+    async def work():
+        calls.append(1)
+        await asyncio.sleep(delay)
+        return result
+    return work, calls
+
+
+def test_identical_calls_share_one_task():
+    flight = SingleFlight()
+    work, calls = counted(['rows'])
+
+    async def run():
+        return await asyncio.gather(*(flight.do('key', work) for _ in range(5)))
+
+    assert asyncio.run(run()) == [['rows']] * 5
+    assert len(calls) == 1
+    assert flight.stats() == {'in_flight': 0, 'started': 1, 'saved_calls': 4}
+
+
+def test_a_caller_going_away_does_not_cancel_the_others():
+    flight = SingleFlight()
+    work, calls = counted(['rows'], delay=0.05)
+
+    async def run():
+        first = asyncio.ensure_future(flight.do('key', work))
+        second = asyncio.ensure_future(flight.do('key', work))
+        await asyncio.sleep(0.01)
+        first.cancel()
+        return await second
+
+    assert asyncio.run(run()) == ['rows']
+    assert len(calls) == 1
+
+
+def test_refused_starter_does_not_refuse_the_requests_that_would_join_it(monkeypatch):
+    from apps.calculator import pipeline
+    flight = SingleFlight()
+    monkeypatch.setattr(pipeline, 'single_flight', flight)
+    work, calls = counted(['rows'])
+    full, free = AnalysisLimiter(capacity=0), AnalysisLimiter(capacity=1)
+
+    async def run():
+        refused = asyncio.ensure_future(recognize_shared('key', Admission(full), work))
+        admitted = asyncio.ensure_future(recognize_shared('key', Admission(free), work))
+        return await asyncio.gather(refused, admitted, return_exceptions=True)
+
+    refused, admitted = asyncio.run(run())
+    assert isinstance(refused, HTTPException) and refused.status_code == 429
+    assert admitted == (False, ['rows'])
+    assert len(calls) == 1
+
+
+def test_joiner_of_a_call_refused_a_slot_starts_its_own(monkeypatch):
+    from apps.calculator import pipeline
+    flight = SingleFlight()
+    monkeypatch.setattr(pipeline, 'single_flight', flight)
+    calls = []
+
+    async def work():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        if len(calls) == 1:
+            raise HTTPException(status_code=429, detail="busy")
+        return ['rows']
+
+    async def run():
+        # A background call (no admission) that the limiter refuses once it runs
+        background = asyncio.ensure_future(flight.do('key', work))
+        await asyncio.sleep(0)
+        joined = await recognize_shared('key', Admission(AnalysisLimiter(capacity=1)), work)
+        with pytest.raises(HTTPException):
+            await background
+        return joined
+
+    assert asyncio.run(run()) == (False, ['rows'])
+    assert len(calls) == 2
@@ -0,0 +1,65 @@
+from apps.calculator.vargraph import VariableGraph, evaluate_rows
+
+
+def rows_of(*exprs):
+    return [{'expr': expr, 'result': '', 'assign': '=' in expr} for expr in exprs]
+
+
+def test_assignments_flow_down_the_canvas():
+    rows = evaluate_rows(rows_of('x = 5', 'y = x * 2', 'y + 1'), {})
+    assert [row['result'] for row in rows] == ['5', '10', '11']
+    assert [row['assign'] for row in rows] == [True, True, False]
+    assert all(row['verified'] for row in rows)
+
+
+def test_closest_assignment_above_wins():
+    rows = evaluate_rows(rows_of('x = 1', 'x + 1', 'x = 10', 'x + 1'), {})
+    assert [row['result'] for row in rows] == ['1', '2', '10', '11']
+
+
+def test_client_variables_are_the_fallback():
+    rows = evaluate_rows(rows_of('a + 1'), {'a = 4': 4})
+    assert rows[0]['result'] == '5'
+
+
+def test_cycles_are_left_unverified():
+    rows = evaluate_rows(rows_of('x = y + 1', 'y = x - 1', '2 + 2'), {})
+    assert [row['verified'] for row in rows] == [False, False, True]
+    assert rows[2]['result'] == '4'
+
+
+def test_bad_rows_do_not_break_the_others():
+    rows = evaluate_rows(rows_of('sqrt((-8)^(1/3))', '((9^999)^999)^999', 'hello', '1 + 1'), {})
+    assert [row['verified'] for row in rows] == [False, False, False, True]
+    assert rows[3]['result'] == '2'
+
+
+def test_model_results_are_corrected_only_when_wrong():
+    rows = evaluate_rows([
+        {'expr': '1e-3 * 2', 'result': '0.002'},
+        {'expr': '0.0000003 * 2', 'result': '0.0000006'},
+        {'expr': '10 / 3', 'result': '3.333'},
+        {'expr': '2 + 2', 'result': '5'},
+    ], {})
+    assert [row.get('corrected', False) for row in rows] == [False, False, False, True]
+    assert rows[1]['result'] == '0.0000006'
+    assert rows[3]['result'] == '4'
+
+
+def test_update_recomputes_only_dependents():
+    graph = VariableGraph()
+    graph.load(rows_of('y = a * 2', 'y + 1', 'b + 1', '3 * 3'), {'a': 1, 'b': 1})
+    assert graph.dependents({'a'}) == [0, 1]
+    assert graph.dependents({'b'}) == [2]
+    rows, recomputed = graph.update({'a': 5, 'b': 1})
+    assert recomputed == 2
+    assert [row['result'] for row in rows] == ['10', '11', '2', '9']
+    # The model's results predate the new values, so nothing is flagged as corrected
+    assert not any(row.get('corrected') for row in rows)
+
+
+def test_stale_finds_unparsed_rows_mentioning_a_name():
+    graph = VariableGraph()
+    graph.load([{'expr': 'solve x^2 = a', 'result': '2'}, {'expr': 'a + 1', 'result': '3'}], {'a': 2})
+    assert [node.index for node in graph.stale({'a'})] == [0]
+    assert graph.stale(set()) == []